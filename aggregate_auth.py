@@ -6,40 +6,67 @@ import argparse
 import csv
 import json
 
-from misp_instances import MISPInstances
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+from config_helpers import config_files, user_keys, dump_atomic
+from generic_config import max_concurrent_nodes
+from misp_instances import MISPInstance
 
 
 def auth_from_config(config):
     auth_admin = {'url': config['baseurl'], 'login': 'admin@admin.test', 'authkey': config['admin_key'], 'password': config['admin_password']}
-    site_admin = {'url': config['baseurl'], 'login': config['email_site_admin'], 'authkey': config['site_admin_authkey'], 'password': config['site_admin_password']}
-    org_admin = {'url': config['baseurl'], 'login': config['email_orgadmin'], 'authkey': config['orgadmin_authkey'], 'password': config['orgadmin_password']}
+    site_admin = {'url': config['baseurl'], 'login': config['email_site_admin'], 'authkey': config.get('site_admin_authkey', 'n/a'), 'password': config.get('site_admin_password', 'n/a')}
+    org_admin = {'url': config['baseurl'], 'login': config['email_orgadmin'], 'authkey': config.get('orgadmin_authkey', 'n/a'), 'password': config.get('orgadmin_password', 'n/a')}
     return auth_admin, site_admin, org_admin
 
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Reset a user password / create a user.')
-    parser.add_argument('--force_reset_passwords', default=False, action='store_true', help='If true, all the site admin and orgadmin accounts will see their passwords reset')
-    args = parser.parse_args()
+def load_config(config_file: Path, create: bool, force_reset_passwords: bool) -> dict[str, Any]:
+    with config_file.open() as f:
+        config = json.load(f)
+    if not create:
+        return config
+    if not force_reset_passwords and all(config.get(key) for key in user_keys):
+        return config
+    # Only contact the instance when something is missing, without bootstrapping it.
+    node = MISPInstance(config_file, force_reset_passwords, bootstrap=False)
+    node.owner_site_admin
+    node.owner_orgadmin
+    return node.config
+
+
+def aggregate_auth(root_misps: str='misps', create: bool=True, force_reset_passwords: bool=False):
+    misp_instances_dir = Path(__file__).resolve().parent / root_misps
+    files = config_files(misp_instances_dir)
+    with ThreadPoolExecutor(max_workers=min(max_concurrent_nodes, len(files))) as executor:
+        configs = list(executor.map(lambda config_file: load_config(config_file, create, force_reset_passwords), files))
 
     to_dump = []
-    instances = MISPInstances(force_reset_passwords=args.force_reset_passwords)
-    auth_admin, site_admin, org_admin = auth_from_config(instances.central_node.config)
-    to_dump.append(auth_admin)
-    to_dump.append(site_admin)
-    to_dump.append(org_admin)
-    for node in instances.client_nodes.values():
-        auth_admin, site_admin, org_admin = auth_from_config(node.config)
+    for config in configs:
+        auth_admin, site_admin, org_admin = auth_from_config(config)
         to_dump.append(auth_admin)
         to_dump.append(site_admin)
         to_dump.append(org_admin)
 
-    with (instances.misp_instances_dir / 'auth.json').open('w') as f:
-        json.dump(to_dump, f, indent=2)
+    dump_atomic(misp_instances_dir / 'auth.json', lambda f: json.dump(to_dump, f, indent=2))
 
-    with (instances.misp_instances_dir / 'auth.csv').open('w') as csvfile:
+    def write_csv(csvfile):
         fieldnames = ['url', 'login', 'authkey', 'password']
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
 
         writer.writeheader()
         for a in to_dump:
             writer.writerow(a)
+
+    dump_atomic(misp_instances_dir / 'auth.csv', write_csv)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Aggregate the credentials of all the instances in auth.json and auth.csv.')
+    parser.add_argument('--root', default='misps', help='Directory with the config files of the instances')
+    parser.add_argument('--force_reset_passwords', default=False, action='store_true', help='If true, all the site admin and orgadmin accounts will see their passwords reset')
+    parser.add_argument('--no_create', default=False, action='store_true', help='Only read the config files, the missing credentials are set to "n/a"')
+    args = parser.parse_args()
+
+    aggregate_auth(args.root, create=not args.no_create, force_reset_passwords=args.force_reset_passwords)
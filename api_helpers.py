@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Talk to the MISP APIs with plain HTTP requests and a short timeout, without MISPInstance
+(that waits for the node to be up and bootstraps it): a node that is down doesn't block the others.'''
+
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import requests
+
+from generic_config import secure_connection, max_concurrent_nodes
+from tracing import tracer
+
+
+class NodeStatus():
+
+    def __init__(self, config: dict[str, Any], timeout: float, test_connections: bool=False):
+        self.config = config
+        self.timeout = timeout
+        self.test_connections = test_connections
+        self.baseurl = config['baseurl'].rstrip('/')
+        self.session = requests.Session()
+        self.session.verify = secure_connection
+        self.session.headers.update({'Authorization': config['admin_key'], 'Accept': 'application/json',
+                                     'Content-Type': 'application/json'})
+
+    def call(self, path: str, post: bool=False, data: Any=None) -> Any:
+        if post:
+            r = self.session.post(f'{self.baseurl}/{path}', json=data if data is not None else {}, timeout=self.timeout)
+        else:
+            r = self.session.get(f'{self.baseurl}/{path}', timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def workers(self) -> str:
+        alive, total, jobs, failed = 0, 0, 0, []
+        for queue, details in self.call('servers/getWorkers').items():
+            if not isinstance(details, dict) or 'workers' not in details:
+                continue
+            workers = details['workers'] if isinstance(details['workers'], list) else []
+            alive += len([w for w in workers if w.get('ok')])
+            total += len(workers)
+            jobs += int(details.get('jobCount', 0))
+            if not details.get('ok'):
+                failed.append(queue)
+        return f'{alive}/{total} up, {jobs} jobs' + (f', KO: {" ".join(failed)}' if failed else '')
+
+    def sync(self) -> str:
+        servers = self.call('servers/index')
+        if not servers:
+            return '-'
+        if not self.test_connections:
+            return f'{len(servers)} server(s)'
+
+        def test(server: dict[str, Any]) -> bool:
+            # Only tests the connection to the remote server
+            return self.call(f'servers/testConnection/{server["Server"]["id"]}', post=True).get('status') == 1
+        # Each test is a round trip to the remote node, the central node has one server per client node
+        with ThreadPoolExecutor(max_workers=min(len(servers), max_concurrent_nodes)) as executor:
+            ok = sum(executor.map(test, servers))
+        return f'{ok}/{len(servers)} ok'
+
+    def run(self) -> dict[str, Any]:
+        status: dict[str, Any] = {'node': self.config['admin_orgname'], 'url': self.baseurl}
+        start = time.time()
+        try:
+            version = self.call('servers/getVersion')
+            status['latency'] = time.time() - start
+            status['version'] = version['version']
+        except Exception as e:
+            # The other calls would fail the same way
+            status['api'] = f'down ({type(e).__name__})'
+            return status
+        status['api'] = 'up'
+        for key, func in [('workers', self.workers), ('sync', self.sync),
+                          ('events', lambda: self.call('users/statistics/data')['stats']['event_count'])]:
+            try:
+                status[key] = func()
+            except Exception as e:
+                status[key] = f'error ({type(e).__name__})'
+        return status
+
+
+def wait_ready(config: dict[str, Any], timeout: int) -> dict[str, Any]:
+    '''Wait for the API and the workers of the instance'''
+    deadline = time.time() + timeout
+    while True:
+        status = NodeStatus(config, timeout=5).run()
+        if status['api'] == 'up' and 'KO' not in status['workers'] and 'error' not in status['workers']:
+            return status
+        if time.time() > deadline:
+            raise Exception(f'{config["hostname"]} not ready after {timeout}s: API {status["api"]}, workers {status.get("workers")}')
+        tracer.sleep(5, config['hostname'])
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Time the orchestration in misp_instances.py against fake_misp.py, without any container.'''
+
+import argparse
+import contextlib
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+from pymisp import PyMISP, MISPEvent
+
+from fake_misp import FakeMISPEnvironment, fake_bin_dir, parse_per_endpoint
+from generic_config import tag_nodes_to_central
+from misp_instances import MISPInstances
+
+
+def seed_events(environment: FakeMISPEnvironment, number_events: int):
+    for name, node in environment.nodes.items():
+        connector = PyMISP(node.url, list(node.authkeys.keys())[0], ssl=False)
+        for i in range(number_events):
+            event = MISPEvent()
+            event.info = f'Benchmark event {i} on {name}'
+            event.add_attribute('ip-dst', f'10.0.{i // 256}.{i % 256}')
+            event.add_attribute('domain', f'event-{i}.{name}.example')
+            event.add_tag(tag_nodes_to_central[0])
+            connector.add_event(event)
+
+
+def run(number_instances: int, args) -> dict[str, float]:
+    timings: dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        root_dir = Path(tmp) / 'misps'
+        environment = FakeMISPEnvironment(root_dir, number_instances, parse_per_endpoint(args.latency),
+                                          parse_per_endpoint(args.failure_rate), args.seed)
+        environment.start()
+        try:
+            seed_events(environment, args.events)
+            output = open(os.devnull, 'w') if not args.verbose else None
+            with contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+                start = time.perf_counter()
+                instances = MISPInstances(root_misps=str(root_dir))
+                timings['MISPInstances.__init__'] = time.perf_counter() - start
+                for step in ['setup_instances', 'setup_sync_all', 'refresh_external_baseurls', 'dump_all_events']:
+                    start = time.perf_counter()
+                    try:
+                        getattr(instances, step)()
+                        timings[step] = time.perf_counter() - start
+                    except Exception as e:
+                        # Most likely an injected failure the orchestration doesn't retry
+                        print(f'{step} failed: {e}', file=sys.stderr)
+                        timings[step] = float('nan')
+            if output:
+                output.close()
+            timings['HTTP requests'] = sum(sum(node.calls.values()) for node in environment.nodes.values())
+        finally:
+            environment.stop()
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the orchestration against fake MISP instances.')
+    parser.add_argument('--nodes', nargs='+', type=int, default=[2, 10, 50], help='Number of client nodes, one run per value')
+    parser.add_argument('--events', type=int, default=20, help='Number of events created on each node before the run')
+    parser.add_argument('--latency', nargs='*', default=[], help='Latency in seconds: "0.01" for all the endpoints, "events/restSearch=0.2" for one')
+    parser.add_argument('--failure_rate', nargs='*', default=[], help='Probability of a 500 error, same format as --latency')
+    parser.add_argument('--docker_latency', type=float, default=0, help='Time spent in each (fake) docker call')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', default=False, action='store_true', help='Do not hide the output of the orchestration')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger('pymisp').setLevel(logging.CRITICAL)
+    os.environ['PATH'] = f'{fake_bin_dir}{os.pathsep}{os.environ["PATH"]}'
+    os.environ['FAKE_DOCKER_LATENCY'] = str(args.docker_latency)
+
+    results = {n: run(n, args) for n in args.nodes}
+    steps = list(results[args.nodes[0]].keys())
+    print(f'{"Step":<30}' + ''.join(f'{str(n) + " nodes":>14}' for n in args.nodes))
+    for step in steps:
+        if step == 'HTTP requests':
+            print(f'{step:<30}' + ''.join(f'{int(results[n][step]):>14}' for n in args.nodes))
+        else:
+            print(f'{step + " (s)":<30}' + ''.join(f'{results[n][step]:>14.2f}' for n in args.nodes))
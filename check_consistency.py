@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Check that the sync delivered what it should, from the metadata of the events only (no export).
+
+With the central node sync (setup_sync.py):
+* the published events of the central node tagged with tag_central_to_nodes must be on every client node
+* the published events of a client node tagged with tag_nodes_to_central must be on the central node
+The events with the distribution "Your organisation only" are never pushed, they are not expected anywhere.
+
+The event index of all the nodes is fetched concurrently, then the events to deliver and the events received are
+hashed per bucket (first characters of the UUID): only the buckets with a different digest are compared event by event.
+On each receiving node, an event is "missing", "stale" (another timestamp) or "extra" (created by the sending org, but not
+delivered by it anymore). The number of attributes is not compared: the attributes restricted to the organisation
+of the sender are not pushed.'''
+
+import argparse
+import hashlib
+import json
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+from api_helpers import NodeStatus
+from config_helpers import config_files
+from generic_config import tag_central_to_nodes, tag_nodes_to_central, unpublish_on_sync, max_concurrent_nodes
+
+# uuid: (timestamp, published, distribution, orgc name, tags)
+Index = dict[str, tuple[int, bool, int, str, frozenset[str]]]
+# uuid: what is compared
+Entries = dict[str, tuple[int, ...]]
+
+
+def fetch_index(config: dict[str, Any], page_size: int, timeout: float) -> Index:
+    node = NodeStatus(config, timeout)
+    index: Index = {}
+    page = 1
+    while True:
+        events = node.call('events/index', post=True, data={'limit': page_size, 'page': page})
+        for event in events:
+            tags = {t['name'] for t in event.get('Tag', [])} | {t['Tag']['name'] for t in event.get('EventTag', [])}
+            index[event['uuid']] = (int(event['timestamp']), bool(event['published']), int(event['distribution']),
+                                    event['Orgc']['name'], frozenset(tags))
+        if len(events) < page_size:
+            return index
+        page += 1
+
+
+def outbound(index: Index, tags: list[str]) -> Entries:
+    '''Events the node has to deliver (distribution 0: your organisation only, never pushed)'''
+    return {event_uuid: entry(values) for event_uuid, values in index.items()
+            if values[1] and values[2] != 0 and values[4] & set(tags)}
+
+
+def entry(values: tuple[int, bool, int, str, frozenset[str]]) -> tuple[int, ...]:
+    # Not the distribution: it is downgraded on the receiving node
+    timestamp, published, _, _, _ = values
+    if unpublish_on_sync:
+        return (timestamp,)
+    return (timestamp, int(published))
+
+
+def digests(entries: Entries, prefix: int) -> dict[str, str]:
+    buckets: dict[str, list[str]] = {}
+    for event_uuid, values in entries.items():
+        buckets.setdefault(event_uuid[:prefix], []).append(f'{event_uuid}:{values}')
+    return {bucket: hashlib.sha256('\n'.join(sorted(items)).encode()).hexdigest() for bucket, items in buckets.items()}
+
+
+def compare(expected: Entries, expected_digests: dict[str, str], received: Index, sender_org: str,
+            prefix: int) -> dict[str, Any]:
+    '''Differences on the receiving node'''
+    # The events of the sender on the receiver, and the ones it should have whoever created them
+    actual = {event_uuid: entry(values) for event_uuid, values in received.items()
+              if values[3] == sender_org or event_uuid in expected}
+    actual_digests = digests(actual, prefix)
+    differing = {bucket for bucket in set(expected_digests) | set(actual_digests)
+                 if expected_digests.get(bucket) != actual_digests.get(bucket)}
+    result: dict[str, Any] = {'buckets': len(differing), 'missing': [], 'stale': [], 'extra': []}
+    for event_uuid in sorted(set(expected) | set(actual)):
+        if event_uuid[:prefix] not in differing:
+            continue
+        if event_uuid not in actual:
+            result['missing'].append(event_uuid)
+        elif event_uuid not in expected:
+            result['extra'].append(event_uuid)
+        elif actual[event_uuid] != expected[event_uuid]:
+            result['stale'].append(event_uuid)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find the events the sync did not deliver, or not completely.',
+                                     epilog=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--root', default='misps', help='Directory with the config files of the instances')
+    parser.add_argument('--prefix', type=int, default=2, help='Characters of the UUID used for the buckets (2: 256 buckets)')
+    parser.add_argument('--page_size', type=int, default=5000, help='Events per page of the index')
+    parser.add_argument('--timeout', type=float, default=60, help='Timeout of each page, in seconds')
+    parser.add_argument('--max_workers', type=int, default=max_concurrent_nodes, help='Indexes fetched at the same time')
+    parser.add_argument('--verbose', action='store_true', help='Print the UUIDs of the events')
+    parser.add_argument('--json', action='store_true', help='Print the differences as JSON')
+    args = parser.parse_args()
+
+    start = time.time()
+    files = config_files(Path(__file__).resolve().parent / args.root)
+    # config_files always lists the central node first, even before it is initialized
+    if not files[0].exists() or len(files) < 2:
+        print(f'Nothing to compare: no central node or no client node in {args.root}.')
+        sys.exit(0)
+    configs = []
+    for config_file in files:
+        with config_file.open() as f:
+            configs.append(json.load(f))
+    with ThreadPoolExecutor(max_workers=min(args.max_workers, len(configs))) as executor:
+        indexes = list(executor.map(lambda config: fetch_index(config, args.page_size, args.timeout), configs))
+    fetched = time.time()
+    central_config, central_index = configs[0], indexes[0]
+
+    results: dict[str, dict[str, Any]] = {}
+    # Central node to the client nodes: the same expected digests for all of them
+    expected = outbound(central_index, tag_central_to_nodes)
+    expected_digests = digests(expected, args.prefix)
+    for config, index in zip(configs[1:], indexes[1:]):
+        results[f'{central_config["admin_orgname"]} -> {config["admin_orgname"]}'] = compare(
+            expected, expected_digests, index, central_config['admin_orgname'], args.prefix)
+    # Client nodes to the central node
+    for config, index in zip(configs[1:], indexes[1:]):
+        from_client = outbound(index, tag_nodes_to_central)
+        results[f'{config["admin_orgname"]} -> {central_config["admin_orgname"]}'] = compare(
+            from_client, digests(from_client, args.prefix), central_index, config['admin_orgname'], args.prefix)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, result in results.items():
+            if not result['buckets']:
+                continue
+            print(f'{name}: {len(result["missing"])} missing, {len(result["stale"])} stale, {len(result["extra"])} extra '
+                  f'({result["buckets"]} bucket(s) differ)')
+            if args.verbose:
+                for key in ['missing', 'stale', 'extra']:
+                    for event_uuid in result[key]:
+                        print(f'    {key}: {event_uuid}')
+        diverging = len([r for r in results.values() if r['buckets']])
+        print(f'{diverging}/{len(results)} sync link(s) diverge, {sum(len(i) for i in indexes)} events on {len(indexes)} node(s), '
+              f'fetched in {fetched - start:.1f}s, compared in {time.time() - fetched:.2f}s')
+    if any(r['buckets'] for r in results.values()):
+        sys.exit(1)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import time
+
+from datetime import datetime
+from pathlib import Path
+
+from misp_instances import MISPInstances
+from stats_store import StatsStore
+
+contexts = ['data', 'orgs', 'users', 'tags', 'attributehistogram', 'sightings', 'galaxyMatrix']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Collect the statistics of all the instances, or query the collected ones.')
+    parser.add_argument('--root', default='misps', help='Directory with the config files of the instances')
+    parser.add_argument('--store', default='stats/stats.jsonl', help='Path of the store, relative to the root directory')
+    parser.add_argument('--contexts', nargs='+', default=['data'], choices=contexts, help='Statistics to collect')
+    parser.add_argument('--interval', type=int, default=0, help='Collect every N seconds (default: collect once)')
+    parser.add_argument('--trend', help='Do not collect, print the values of this key over time (ex. stats.event_count)')
+    parser.add_argument('--node', help='With --trend, only print this node (admin org name)')
+    parser.add_argument('--context', default='data', choices=contexts, help='With --trend, the context of the key')
+    args = parser.parse_args()
+
+    if args.trend:
+        store = StatsStore(Path(__file__).resolve().parent / args.root / args.store)
+        for node, values in store.trend(args.trend, args.context, args.node).items():
+            print(node)
+            for ts, value in values:
+                print(f'    {datetime.fromtimestamp(ts).isoformat(timespec="seconds")}  {value}')
+    else:
+        instances = MISPInstances(root_misps=args.root, bootstrap=False)
+        store = StatsStore(instances.misp_instances_dir / args.store)
+        while True:
+            start = time.time()
+            stored = instances.collect_stats(store, args.contexts)
+            duration = time.time() - start
+            print(f'{datetime.now().isoformat(timespec="seconds")}: {stored} samples in {duration:.1f}s')
+            if not args.interval:
+                break
+            if duration > args.interval:
+                print(f'Warning: the collection took longer than the interval ({args.interval}s)')
+            time.sleep(max(args.interval - duration, 0))
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Read the config files of the instances, without contacting them, and write the files of the tooling.'''
+
+import os
+
+from pathlib import Path
+
+from generic_config import central_node_name, prefix_client_node
+
+# Credentials written in config.json by MISPInstance, once the users are created
+user_keys = ['site_admin_authkey', 'site_admin_password', 'orgadmin_authkey', 'orgadmin_password']
+
+
+def config_files(misp_instances_dir: Path) -> list[Path]:
+    '''Central node first, like MISPInstances (even before it is initialized, check that it exists)'''
+    clients = sorted(path / 'config.json' for path in misp_instances_dir.glob(f'{prefix_client_node}*')
+                     if path.name != central_node_name and (path / 'config.json').exists())
+    return [misp_instances_dir / central_node_name / 'config.json'] + clients
+
+
+def dump_atomic(path: Path, write):
+    '''Write in a temporary file and move it, so a reader never gets a partial file'''
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    with tmp_path.open('w', newline='') as f:
+        write(f)
+    os.replace(tmp_path, path)
@@ -1,18 +1,98 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from misp_instances import MISPInstances
-
 import argparse
+import hashlib
+import io
+import posixpath
+import tarfile
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from docker_helpers import docker_command, misp_core_containers
+from generic_config import max_concurrent_nodes
+
+
+def pack_source(source: Path, destination: str) -> dict[str, tuple[tarfile.TarInfo, bytes]]:
+    '''Read the source once: tar member and content by absolute path in the container.
+    A file is copied to destination (or in it if it ends with /), the content of a directory in destination.'''
+    if source.is_dir():
+        files = [(p, posixpath.join(destination, p.relative_to(source).as_posix())) for p in sorted(source.rglob('*')) if p.is_file()]
+    elif destination.endswith('/'):
+        files = [(source, posixpath.join(destination, source.name))]
+    else:
+        files = [(source, destination)]
+    members = {}
+    for path, container_path in files:
+        content = path.read_bytes()
+        info = tarfile.TarInfo(container_path.lstrip('/'))
+        info.size = len(content)
+        info.mode = path.stat().st_mode & 0o777
+        info.mtime = int(path.stat().st_mtime)
+        members[posixpath.normpath(container_path)] = (info, content)
+    return members
+
+
+def make_tar(members: list[tuple[tarfile.TarInfo, bytes]]) -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as tar:
+        for info, content in members:
+            tar.addfile(info, io.BytesIO(content))
+    return buf.getvalue()
+
+
+def remote_checksums(container: str, destination: str, project: str) -> dict[str, str]:
+    # Missing destination: nothing on stdout, everything will be copied
+    _, outs, _ = docker_command(f'sudo docker exec {container} find {destination} -type f -exec sha256sum {{}} +', project)
+    checksums = {}
+    for line in outs.decode().splitlines():
+        checksum, _, path = line.partition('  ')
+        checksums[posixpath.normpath(path)] = checksum
+    return checksums
+
+
+def distribute(project: str, container: str, members: dict[str, tuple[tarfile.TarInfo, bytes]],
+               checksums: dict[str, str], full_tar: bytes, force: bool) -> str:
+    if force:
+        changed = list(members)
+    else:
+        # Only look at what we would overwrite
+        remote = remote_checksums(container, posixpath.commonpath(list(members)), project)
+        changed = [path for path in members if remote.get(path) != checksums[path]]
+    if not changed:
+        return f'{project}: up to date'
+    tar = full_tar if len(changed) == len(members) else make_tar([members[path] for path in changed])
+    returncode, _, errs = docker_command(f'sudo docker cp - {container}:/', project, stdin=tar)
+    if returncode != 0:
+        return f'{project}: failed - {errs.decode().strip()}'
+    return f'{project}: {len(changed)}/{len(members)} file(s) copied'
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='copy a file or a directory to all the instances')
     parser.add_argument('-s', '--source', required=True)
-    parser.add_argument('-d', '--destination', required=True)
+    parser.add_argument('-d', '--destination', required=True, help='Absolute path in the container')
+    parser.add_argument('--root', default='misps', help='Directory with the config files of the instances')
+    parser.add_argument('--force', default=False, action='store_true', help='Copy everything, without comparing the checksums')
+    parser.add_argument('--max_workers', type=int, default=max_concurrent_nodes, help='Containers updated at the same time')
     args = parser.parse_args()
 
-    instances = MISPInstances()
-    instances.central_node.copy_file(args.source, args.destination)
-    for node in instances.client_nodes.values():
-        node.copy_file(args.source, args.destination)
+    misp_instances_dir = Path(__file__).resolve().parent / args.root
+    projects = [path.name for path in misp_instances_dir.iterdir() if (path / 'config.json').exists()]
+    containers = misp_core_containers(projects)
+    for project in sorted(set(projects) - set(containers)):
+        print(f'{project}: no running misp-core container')
+
+    members = pack_source(Path(args.source), args.destination)
+    checksums = {path: hashlib.sha256(content).hexdigest() for path, (_, content) in members.items()}
+    full_tar = make_tar(list(members.values()))
+
+    if not members:
+        print(f'Nothing to copy in {args.source}')
+    elif containers:
+        with ThreadPoolExecutor(max_workers=min(args.max_workers, len(containers))) as executor:
+            results = executor.map(lambda item: distribute(item[0], item[1], members, checksums, full_tar, args.force),
+                                   sorted(containers.items()))
+            for result in results:
+                print(result)
@@ -1,20 +1,38 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import argparse
 import json
 
 from misp_instances import MISPInstances
 
-url = ''
-data = """
-{
-}
-"""
-
 
 if __name__ == '__main__':
-    json_data = json.loads(data)
-    instances = MISPInstances()
-    instances.central_node.direct_call(url, json_data)
-    for node in instances.client_nodes.values():
-        node.direct_call(url, json_data)
+    parser = argparse.ArgumentParser(description='Send the same API call to all the instances, concurrently.',
+                                     epilog='${orgname}, ${hostname} and ${baseurl} in the url or the payload are replaced by the values of each node.')
+    parser.add_argument('url', help='Path of the API endpoint, ex. servers/serverSettingsEdit/MISP.welcome_text_top')
+    parser.add_argument('-d', '--data', help='JSON payload (POST), default: GET')
+    parser.add_argument('-f', '--data_file', help='File with the JSON payload')
+    parser.add_argument('--root', default='misps', help='Directory with the config files of the instances')
+    parser.add_argument('--nodes', nargs='+', help='Name of the admin org of the nodes to call (default: all)')
+    parser.add_argument('--stop_on_failure', default=False, action='store_true', help='Do not call the remaining nodes after a failure')
+    parser.add_argument('--output', help='Dump the full responses in this JSON file')
+    args = parser.parse_args()
+
+    payload = None
+    if args.data_file:
+        with open(args.data_file) as f:
+            payload = json.load(f)
+    elif args.data:
+        payload = json.loads(args.data)
+
+    instances = MISPInstances(root_misps=args.root, bootstrap=False)
+    results = instances.broadcast(args.url, payload, args.nodes, args.stop_on_failure)
+
+    print(f'{"Node":<30} {"status":<8} {"latency (s)":>11}  response')
+    for name, result in results.items():
+        response = json.dumps(result['response'], default=str)
+        print(f'{name:<30} {result["status"]:<8} {result["latency"]:>11.2f}  {response[:80]}')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Talk to the MISP containers through docker only, no MISP API login needed.'''
+
+import shlex
+
+from pathlib import Path
+from subprocess import Popen, PIPE
+from typing import Optional
+
+from tracing import tracer, command_name
+
+
+def docker_command(command: str, node: str='', stdin: Optional[bytes]=None, cwd: Optional[Path]=None) -> tuple[int, bytes, bytes]:
+    '''Run a docker command (in cwd, for docker compose), returns (return code, stdout, stderr)'''
+    c = shlex.split(command)
+    with tracer.span('docker', command_name(c), node):
+        p = Popen(c, stdin=PIPE if stdin is not None else None, stdout=PIPE, stderr=PIPE, cwd=cwd)
+        outs, errs = p.communicate(stdin)
+    return p.returncode, outs, errs
+
+
+def check(result: tuple[int, bytes, bytes], what: str):
+    '''Raise if the docker_command failed'''
+    returncode, _, errs = result
+    if returncode != 0:
+        raise Exception(f'{what} failed: {errs.decode().strip()}')
+
+
+def misp_core_containers(projects: Optional[list[str]]=None) -> dict[str, str]:
+    '''Running misp-core containers, by compose project (= directory of the instance, ex. misp-central)'''
+    _, outs, _ = docker_command('sudo docker ps --filter label=com.docker.compose.service=misp-core '
+                                '--format "{{.Label \\"com.docker.compose.project\\"}} {{.Names}}"')
+    containers = {}
+    for line in outs.decode().splitlines():
+        if not line.strip():
+            continue
+        project, name = line.split()
+        if projects is None or project in projects:
+            containers[project] = name
+    return containers
+
+
+def compose_containers() -> dict[str, dict[str, str]]:
+    '''State of all the compose containers in one query: {project: {service: state}}'''
+    _, outs, _ = docker_command('sudo docker ps -a --filter label=com.docker.compose.project '
+                                '--format "{{.Label \\"com.docker.compose.project\\"}} {{.Label \\"com.docker.compose.service\\"}} {{.State}}"')
+    containers: dict[str, dict[str, str]] = {}
+    for line in outs.decode().splitlines():
+        if not line.strip():
+            continue
+        project, service, state = line.split()
+        containers.setdefault(project, {})[service] = state
+    return containers
+
+
+def container_images() -> dict[str, dict[str, str]]:
+    '''Image ID of all the compose containers: {project: {service: image ID}}'''
+    _, outs, _ = docker_command('sudo docker ps -aq --filter label=com.docker.compose.project')
+    ids = outs.decode().split()
+    if not ids:
+        return {}
+    _, outs, _ = docker_command('sudo docker inspect -f "{{index .Config.Labels \\"com.docker.compose.project\\"}} '
+                                '{{index .Config.Labels \\"com.docker.compose.service\\"}} {{.Image}}" ' + ' '.join(ids))
+    images: dict[str, dict[str, str]] = {}
+    for line in outs.decode().splitlines():
+        if not line.strip():
+            continue
+        project, service, image = line.split()
+        images.setdefault(project, {})[service] = image
+    return images
+
+
+def image_id(reference: str) -> Optional[str]:
+    '''ID of a local image, None if it was not pulled'''
+    returncode, outs, _ = docker_command(f'sudo docker image inspect -f "{{{{.Id}}}}" {reference}')
+    return outs.decode().strip() if returncode == 0 else None
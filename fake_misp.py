@@ -0,0 +1,705 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''In-process stand-in for the MISP API, covering the endpoints used by the tooling.
+It is *not* a MISP: the data is kept in memory, there are no ACLs and the sync does nothing.'''
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import pymisp
+
+from pymisp import __version__ as pymisp_version
+
+from generic_config import (central_node_name, prefix_client_node, hostname_suffix, admin_email_name,
+                            orgadmin_email_name, central_node_org_name, client_node_org_name_prefix)
+
+fake_bin_dir = Path(__file__).resolve().parent / 'fake_bin'
+
+default_roles = {'1': 'admin', '2': 'Org Admin', '3': 'User', '4': 'Publisher', '5': 'Sync user', '6': 'Read Only'}
+default_taxonomies = ['tlp', 'admiralty-scale', 'pap', 'workflow', 'estimative-language']
+default_galaxies = ['threat-actor', 'malpedia', 'mitre-attack-pattern']
+
+
+class FakeMISPError(Exception):
+
+    def __init__(self, status: int, message: str):
+        self.status = status
+        self.message = message
+
+
+class FakeMISPNode():
+    '''One fake MISP instance, listening on 127.0.0.1.
+
+    :param latency: seconds to wait before answering, per endpoint prefix (ex. {'events/restSearch': 0.2}),
+                    the key '*' applies to all the other endpoints.
+    :param failure_rate: probability to answer with a 500, same keys as latency.
+    '''
+
+    def __init__(self, admin_key: str, latency: Optional[dict[str, float]]=None,
+                 failure_rate: Optional[dict[str, float]]=None, seed: Optional[int]=None, port: int=0):
+        self.latency = latency if latency else {}
+        self.failure_rate = failure_rate if failure_rate else {}
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.calls: dict[str, int] = {}
+        self.ids: dict[str, int] = {}
+        self.store: dict[str, dict[str, dict[str, Any]]] = {
+            'User': {}, 'Organisation': {}, 'Role': {}, 'Tag': {}, 'Server': {}, 'SharingGroup': {},
+            'Taxonomy': {}, 'Galaxy': {}, 'GalaxyCluster': {}, 'Event': {}, 'EventBlocklist': {}, 'Feed': {}}
+        self.settings: dict[str, Any] = {'MISP.host_org_id': '1'}
+        self.authkeys: dict[str, str] = {}
+
+        org = self._new('Organisation', name='ORGNAME', local=True)
+        for role_id, name in default_roles.items():
+            self.store['Role'][role_id] = {'id': role_id, 'name': name, 'default_role': role_id == '3',
+                                           'perm_site_admin': role_id == '1', 'perm_admin': role_id in ['1', '2'],
+                                           'perm_sync': role_id in ['1', '5']}
+        self.ids['Role'] = len(default_roles)
+        admin = self._new('User', email='admin@admin.test', org_id=org['id'], role_id='1', change_pw=True)
+        self.authkeys[admin_key] = admin['id']
+        for namespace in default_taxonomies:
+            self._new('Taxonomy', namespace=namespace, description=namespace, version='1', enabled=False)
+        for name in default_galaxies:
+            self._new('Galaxy', name=name, type=name, namespace='misp', description=name, version='1')
+
+        handler = type('FakeMISPNodeHandler', (FakeMISPHandler,), {'node': self})
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}'
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    # # Storage helpers
+
+    def _new(self, model: str, **fields) -> dict[str, Any]:
+        self.ids[model] = self.ids.get(model, 0) + 1
+        entry = {'uuid': str(uuid.uuid4()), **fields, 'id': str(self.ids[model])}
+        self.store[model][entry['id']] = entry
+        return entry
+
+    def _get(self, model: str, key: str) -> dict[str, Any]:
+        if key in self.store[model]:
+            return self.store[model][key]
+        for entry in self.store[model].values():
+            if entry.get('uuid') == key:
+                return entry
+        raise FakeMISPError(404, f'Invalid {model}.')
+
+    def _find(self, model: str, **fields) -> Optional[dict[str, Any]]:
+        for entry in self.store[model].values():
+            if all(entry.get(k) == v for k, v in fields.items()):
+                return entry
+        return None
+
+    def _update(self, entry: dict[str, Any], data: dict[str, Any]):
+        for key, value in data.items():
+            if key in ['id', 'uuid'] or isinstance(value, (dict, list)):
+                continue
+            entry[key] = value
+
+    def _unwrap(self, data: Any, model: str) -> dict[str, Any]:
+        if not isinstance(data, dict):
+            return {}
+        return data.get(model, data)
+
+    # # Dispatch
+
+    def handle(self, method: str, path: str, user_id: Optional[str], data: Any) -> tuple[int, Any]:
+        # Get rid of the CakePHP named parameters (scope:all, metadata:1, ...)
+        parts = [p for p in path.strip('/').split('/') if p and ':' not in p]
+        path = '/'.join(parts)
+        endpoint = re.sub(r'/(\d+|[0-9a-f-]{36})(?=/|$)', '', path)
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        delay = self._lookup(self.latency, endpoint)
+        if delay:
+            time.sleep(delay)
+        failure_rate = self._lookup(self.failure_rate, endpoint)
+        if failure_rate and self.random.random() < failure_rate:
+            return 500, 'Injected failure'
+        if user_id is None:
+            return 403, {'name': 'Authentication failed.', 'message': 'Authentication failed.', 'url': f'/{path}'}
+        for route_method, regex, func in self.routes:
+            if route_method != method:
+                continue
+            if match := re.fullmatch(regex, path):
+                try:
+                    with self.lock:
+                        return 200, func(self, user_id, data, *match.groups())
+                except FakeMISPError as e:
+                    return e.status, {'name': e.message, 'message': e.message, 'url': f'/{path}'}
+        return 404, {'name': 'Not Found', 'message': 'Not Found', 'url': f'/{path}'}
+
+    def _lookup(self, values: dict[str, float], endpoint: str) -> float:
+        for prefix in sorted(values, key=len, reverse=True):
+            if prefix != '*' and endpoint.startswith(prefix):
+                return values[prefix]
+        return values.get('*', 0)
+
+    # # Instance
+
+    def r_pymisp_version(self, user_id, data):
+        return {'version': pymisp_version}
+
+    def r_version(self, user_id, data):
+        return {'version': '2.5.0', 'pymisp_recommended_version': pymisp_version, 'perm_sync': True,
+                'perm_sighting': True, 'perm_galaxy_editor': True, 'request_encoding': ['gzip']}
+
+    def r_describe_types(self, user_id, data):
+        with (Path(pymisp.__file__).parent / 'data' / 'describeTypes.json').open() as f:
+            return json.load(f)
+
+    def r_set_setting(self, user_id, data, setting):
+        self.settings[setting] = data.get('value') if isinstance(data, dict) else data
+        return {'saved': True, 'success': True, 'name': 'Field updated', 'message': 'Field updated', 'url': '/servers/serverSettingsEdit'}
+
+    def r_settings(self, user_id, data):
+        return {'finalSettings': [{'setting': k, 'value': v} for k, v in self.settings.items()]}
+
+    def r_update_json(self, user_id, data, kind):
+        return {'name': f'{kind} updated', 'message': f'{kind} updated', 'url': f'/{kind}/update'}
+
+    def r_workers(self, user_id, data):
+        return {q: {'ok': True, 'jobCount': 0, 'workers': [{'pid': 1, 'ok': True}]}
+                for q in ['default', 'email', 'cache', 'prio', 'update']}
+
+    def r_statistics(self, user_id, data, context):
+        events = list(self.store['Event'].values())
+        return {'stats': {'event_count': len(events),
+                          'attribute_count': sum(len(e.get('Attribute', [])) for e in events),
+                          'user_count': len(self.store['User']),
+                          'org_count': len(self.store['Organisation'])}}
+
+    # # Users / Orgs / Roles
+
+    def _user_view(self, user: dict[str, Any], expanded: bool=False) -> dict[str, Any]:
+        to_return = {'User': user, 'Role': self.store['Role'][user['role_id']],
+                     'Organisation': self.store['Organisation'][user['org_id']]}
+        if expanded:
+            to_return['UserSetting'] = {}
+        return to_return
+
+    def r_user_view(self, user_id, data, uid):
+        return self._user_view(self._get('User', user_id if uid == 'me' else uid), expanded=True)
+
+    def r_users(self, user_id, data):
+        return [self._user_view(u) for u in self.store['User'].values()]
+
+    def r_user_add(self, user_id, data):
+        user = self._unwrap(data, 'User')
+        if self._find('User', email=user.get('email')):
+            raise FakeMISPError(403, 'The user could not be saved. An account with this email address already exists.')
+        new_user = self._new('User', email=user['email'], org_id=str(user.get('org_id', '1')),
+                             role_id=str(user.get('role_id', '3')), change_pw=True)
+        return self._user_view(new_user)
+
+    def r_user_edit(self, user_id, data, uid):
+        user = self._get('User', uid)
+        self._update(user, self._unwrap(data, 'User'))
+        user.pop('password', None)
+        user['org_id'], user['role_id'] = str(user['org_id']), str(user['role_id'])
+        return self._user_view(user)
+
+    def r_user_delete(self, user_id, data, uid):
+        self.store['User'].pop(self._get('User', uid)['id'])
+        return {'saved': True, 'success': True, 'name': 'User deleted', 'message': 'User deleted', 'url': '/admin/users/delete'}
+
+    def r_authkey(self, user_id, data, uid):
+        user = self._get('User', user_id if uid == 'me' else uid)
+        key = ''.join(self.random.choices('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789', k=40))
+        self.authkeys[key] = user['id']
+        return {'AuthKey': {'authkey_raw': key, 'user_id': user['id']}}
+
+    def r_authkeys(self, user_id, data):
+        return [{'AuthKey': {'id': str(i), 'authkey_start': key[:4], 'authkey_end': key[-4:], 'user_id': uid}}
+                for i, (key, uid) in enumerate(self.authkeys.items()) if key]
+
+    def r_authkey_delete(self, user_id, data, kid):
+        keys = list(self.authkeys)
+        if not kid.isdigit() or int(kid) >= len(keys) or not keys[int(kid)]:
+            raise FakeMISPError(404, 'Invalid auth key')
+        # Keep the positions, they are the ids
+        self.authkeys[keys[int(kid)]] = ''
+        return {'saved': True, 'success': True, 'name': 'AuthKey deleted', 'message': 'AuthKey deleted', 'url': '/auth_keys/delete'}
+
+    def r_orgs(self, user_id, data):
+        return [{'Organisation': o} for o in self.store['Organisation'].values()]
+
+    def r_org_view(self, user_id, data, oid):
+        return {'Organisation': self._get('Organisation', oid)}
+
+    def r_org_add(self, user_id, data):
+        org = self._unwrap(data, 'Organisation')
+        if self._find('Organisation', name=org.get('name')):
+            raise FakeMISPError(403, 'The organisation could not be saved. An organisation with this name already exists.')
+        return {'Organisation': self._new('Organisation', name=org['name'], uuid=org.get('uuid') or str(uuid.uuid4()),
+                                          local=org.get('local', True))}
+
+    def r_org_edit(self, user_id, data, oid):
+        org = self._get('Organisation', oid)
+        self._update(org, self._unwrap(data, 'Organisation'))
+        return {'Organisation': org}
+
+    def r_org_delete(self, user_id, data, oid):
+        self.store['Organisation'].pop(self._get('Organisation', oid)['id'])
+        return {'saved': True, 'success': True, 'name': 'Organisation deleted', 'message': 'Organisation deleted', 'url': '/admin/organisations/delete'}
+
+    def r_roles(self, user_id, data):
+        return [{'Role': r} for r in self.store['Role'].values()]
+
+    def r_role_default(self, user_id, data, rid):
+        for role in self.store['Role'].values():
+            role['default_role'] = role['id'] == rid
+        return {'saved': True, 'success': True, 'name': 'Default role set', 'message': 'Default role set', 'url': '/admin/roles/set_default'}
+
+    # # Taxonomies / Galaxies / Tags
+
+    def r_taxonomies(self, user_id, data):
+        return [{'Taxonomy': t} for t in self.store['Taxonomy'].values()]
+
+    def r_taxonomy_view(self, user_id, data, tid):
+        return {'Taxonomy': self._get('Taxonomy', tid), 'entries': []}
+
+    def r_taxonomy_enable(self, user_id, data, action, tid):
+        taxonomy = self._get('Taxonomy', tid)
+        if action == 'enable':
+            taxonomy['enabled'] = True
+        return {'saved': True, 'success': True, 'name': 'Taxonomy enabled', 'message': 'Taxonomy enabled', 'url': f'/taxonomies/{action}'}
+
+    def r_galaxies(self, user_id, data):
+        return [{'Galaxy': g} for g in self.store['Galaxy'].values()]
+
+    def r_cluster_add(self, user_id, data, gid):
+        galaxy = self._get('Galaxy', gid)
+        cluster = self._unwrap(data, 'GalaxyCluster')
+        new_cluster = self._new('GalaxyCluster', value=cluster.get('value'), description=cluster.get('description', ''),
+                                galaxy_id=galaxy['id'], type=galaxy['type'], distribution=cluster.get('distribution', 0),
+                                tag_name=f'misp-galaxy:{galaxy["type"]}="{cluster.get("value")}"',
+                                org_id='1', orgc_id='1', default=False)
+        return {'GalaxyCluster': new_cluster}
+
+    def r_tags(self, user_id, data):
+        return {'Tag': list(self.store['Tag'].values())}
+
+    def r_tag_add(self, user_id, data):
+        tag = self._unwrap(data, 'Tag')
+        if self._find('Tag', name=tag.get('name')):
+            raise FakeMISPError(403, 'A tag with this name already exists.')
+        new_tag = self._new('Tag', name=tag['name'], colour=tag.get('colour', '#ffffff'),
+                            exportable=tag.get('exportable', True), org_id=str(tag.get('org_id', '0')), hide_tag=False)
+        return {'Tag': new_tag}
+
+    def r_tag_edit(self, user_id, data, tid):
+        tag = self._get('Tag', tid)
+        self._update(tag, self._unwrap(data, 'Tag'))
+        return {'Tag': tag}
+
+    def _tag_by_name(self, name: str) -> dict[str, Any]:
+        if tag := self._find('Tag', name=name):
+            return tag
+        return self._new('Tag', name=name, colour='#ffffff', exportable=True, org_id='0', hide_tag=False)
+
+    # # Sync
+
+    def _server_view(self, server: dict[str, Any]) -> dict[str, Any]:
+        return {'Server': server, 'Organisation': self.store['Organisation']['1'],
+                'RemoteOrg': self.store['Organisation'].get(server['remote_org_id'], {})}
+
+    def r_servers(self, user_id, data):
+        return [self._server_view(s) for s in self.store['Server'].values()]
+
+    def r_create_sync(self, user_id, data):
+        user = self._get('User', user_id)
+        if user['role_id'] != '5':
+            raise FakeMISPError(403, 'Only sync users can generate a sync configuration.')
+        host_org = self._get('Organisation', str(self.settings.get('MISP.host_org_id', '1')))
+        key = [k for k, u in self.authkeys.items() if u == user['id']][-1]
+        return {'Server': {'name': f'{host_org["name"]} sync', 'url': self.settings.get('MISP.external_baseurl', self.url),
+                           'uuid': str(uuid.uuid4()), 'authkey': key,
+                           'Organisation': {'name': host_org['name'], 'uuid': host_org['uuid']}}}
+
+    def r_server_import(self, user_id, data):
+        server = self._unwrap(data, 'Server')
+        remote_org = server.get('Organisation', {})
+        if not (org := self._find('Organisation', uuid=remote_org.get('uuid'))):
+            org = self._new('Organisation', name=remote_org.get('name'), uuid=remote_org.get('uuid'), local=False)
+        new_server = self._new('Server', name=server.get('name'), url=server.get('url'), authkey=server.get('authkey'),
+                               remote_org_id=org['id'], push=False, pull=False, push_rules='', pull_rules='')
+        return {'Server': new_server}
+
+    def r_server_edit(self, user_id, data, sid):
+        server = self._get('Server', sid)
+        self._update(server, self._unwrap(data, 'Server'))
+        return {'Server': server}
+
+    def r_server_delete(self, user_id, data, sid):
+        self.store['Server'].pop(self._get('Server', sid)['id'])
+        return {'saved': True, 'success': True, 'name': 'Server deleted', 'message': 'Server deleted', 'url': '/servers/delete'}
+
+    def r_server_test(self, user_id, data, sid):
+        self._get('Server', sid)
+        return {'status': 1, 'local_version': '2.5.0', 'version': '2.5.0', 'mismatch': False, 'post': 1}
+
+    def r_server_push(self, user_id, data, sid, eid=None):
+        self._get('Server', sid)
+        if eid:
+            self._get('Event', eid)
+        return {'message': 'Push queued for background execution.'}
+
+    def r_sharing_groups(self, user_id, data):
+        return [{'SharingGroup': sg, 'Organisation': self.store['Organisation'][sg['org_id']],
+                 'SharingGroupOrg': sg['orgs'], 'SharingGroupServer': sg['servers']}
+                for sg in self.store['SharingGroup'].values()]
+
+    def r_sharing_group_add(self, user_id, data):
+        sg = self._unwrap(data, 'SharingGroup')
+        new_sg = self._new('SharingGroup', name=sg.get('name'), releasability=sg.get('releasability', ''),
+                           org_id=self._get('User', user_id)['org_id'], active=True, orgs=[], servers=[])
+        return {'SharingGroup': {k: v for k, v in new_sg.items() if k not in ['orgs', 'servers']}}
+
+    def r_sharing_group_link(self, user_id, data, kind):
+        sg = self._get('SharingGroup', str(data['sg_id']))
+        if kind == 'Server':
+            sg['servers'].append({'server_id': str(data['server_id']), 'all_orgs': False})
+        else:
+            sg['orgs'].append({'org_id': str(data['org_id']), 'extend': False})
+        return {'saved': True, 'success': True, 'name': f'{kind} added to the sharing group.',
+                'message': f'{kind} added to the sharing group.', 'url': f'/sharingGroups/add{kind}'}
+
+    # # Events
+
+    def _event_meta(self, event: dict[str, Any]) -> dict[str, Any]:
+        meta = {k: v for k, v in event.items() if k not in ['Attribute', 'Object', 'EventReport']}
+        meta['attribute_count'] = str(len(event.get('Attribute', []))
+                                      + sum(len(o.get('Attribute', [])) for o in event.get('Object', [])))
+        return meta
+
+    def _matches(self, event: dict[str, Any], query: dict[str, Any]) -> bool:
+        if uuids := query.get('uuid'):
+            if event['uuid'] not in (uuids if isinstance(uuids, list) else [uuids]):
+                return False
+        if eventinfo := query.get('eventinfo'):
+            if eventinfo.strip('%') not in event['info']:
+                return False
+        if query.get('published') is not None and bool(event['published']) != bool(query['published']):
+            return False
+        for key in ['timestamp', 'publish_timestamp']:
+            if query.get(key) is not None:
+                since = query[key][0] if isinstance(query[key], list) else query[key]
+                if int(event[key]) < int(since):
+                    return False
+        if tags := query.get('tags'):
+            wanted = tags if isinstance(tags, list) else tags.get('OR', [])
+            if not {t['name'] for t in event.get('Tag', [])} & set(wanted):
+                return False
+        if org := query.get('org'):
+            if str(org) not in [event['orgc_id'], event['Orgc']['name'], event['Orgc']['uuid']]:
+                return False
+        return True
+
+    def r_search(self, user_id, data):
+        query = data if isinstance(data, dict) else {}
+        events = [e for e in self.store['Event'].values() if self._matches(e, query)]
+        if query.get('limit'):
+            page = int(query.get('page') or 1)
+            # PyMISP pages start at 0 or 1 depending on the caller, MISP treats both as the first page
+            start = (max(page, 1) - 1) * int(query['limit'])
+            events = events[start:start + int(query['limit'])]
+        if query.get('metadata') in [1, '1', True]:
+            return {'response': [{'Event': self._event_meta(e)} for e in events]}
+        return {'response': [{'Event': e} for e in events]}
+
+    def r_index(self, user_id, data):
+        query = data if isinstance(data, dict) else {}
+        events = [self._event_meta(e) for e in self.store['Event'].values() if self._matches(e, query)]
+        if query.get('limit'):
+            start = (max(int(query.get('page') or 1), 1) - 1) * int(query['limit'])
+            events = events[start:start + int(query['limit'])]
+        return events
+
+    def r_event_view(self, user_id, data, eid):
+        return {'Event': self._get('Event', eid)}
+
+    def _prepare_event(self, event: dict[str, Any], org: dict[str, Any]):
+        now = str(int(time.time()))
+        event.setdefault('uuid', str(uuid.uuid4()))
+        event.setdefault('date', datetime.now().date().isoformat())
+        event.setdefault('published', False)
+        event.setdefault('publish_timestamp', '0')
+        event.setdefault('threat_level_id', '4')
+        event.setdefault('analysis', '0')
+        event.setdefault('distribution', '3')
+        event['timestamp'] = str(event.get('timestamp') or now)
+        event['Tag'] = [self._tag_by_name(t['name']) for t in event.get('Tag', [])]
+        attributes = list(event.get('Attribute', []))
+        for obj in event.get('Object', []):
+            for key, value in [('uuid', str(uuid.uuid4())), ('timestamp', now), ('distribution', '5'),
+                               ('sharing_group_id', '0'), ('comment', ''), ('deleted', False)]:
+                obj.setdefault(key, value)
+            attributes += obj.get('Attribute', [])
+        for attribute in attributes:
+            for key, value in [('uuid', str(uuid.uuid4())), ('timestamp', now), ('distribution', '5'),
+                               ('sharing_group_id', '0'), ('comment', ''), ('deleted', False),
+                               ('to_ids', False), ('category', 'Other'), ('disable_correlation', False)]:
+                attribute.setdefault(key, value)
+            attribute['Tag'] = [self._tag_by_name(t['name']) for t in attribute.get('Tag', [])]
+        if 'Orgc' not in event:
+            event['Orgc'] = {'id': org['id'], 'name': org['name'], 'uuid': org['uuid'], 'local': True}
+        event['orgc_id'] = event['Orgc'].get('id', org['id'])
+        event['org_id'] = org['id']
+        event['Org'] = {'id': org['id'], 'name': org['name'], 'uuid': org['uuid'], 'local': True}
+
+    def r_event_add(self, user_id, data):
+        event = self._unwrap(data, 'Event')
+        if event.get('uuid') and (self._find('Event', uuid=event['uuid']) or self._find('EventBlocklist', event_uuid=event['uuid'])):
+            raise FakeMISPError(403, 'Event already exists or is blocklisted.')
+        org = self.store['Organisation'][self._get('User', user_id)['org_id']]
+        self._prepare_event(event, org)
+        self.ids['Event'] = self.ids.get('Event', 0) + 1
+        event['id'] = str(self.ids['Event'])
+        self.store['Event'][event['id']] = event
+        return {'Event': event}
+
+    def r_event_edit(self, user_id, data, eid):
+        event = self._get('Event', eid)
+        new_event = self._unwrap(data, 'Event')
+        new_event['id'], new_event['uuid'] = event['id'], event['uuid']
+        new_event['timestamp'] = None
+        self._prepare_event(new_event, self.store['Organisation'][event['org_id']])
+        self.store['Event'][event['id']] = new_event
+        return {'Event': new_event}
+
+    def r_event_publish(self, user_id, data, eid):
+        event = self._get('Event', eid)
+        event['published'] = True
+        event['publish_timestamp'] = str(int(time.time()))
+        return {'saved': True, 'success': True, 'name': 'Job queued', 'message': 'Job queued', 'url': '/events/publish', 'id': event['id']}
+
+    def r_event_delete(self, user_id, data, eid):
+        event = self.store['Event'].pop(self._get('Event', eid)['id'])
+        self._new('EventBlocklist', event_uuid=event['uuid'], event_info=event['info'], event_orgc=event['Orgc']['name'])
+        return {'saved': True, 'success': True, 'name': 'Event deleted.', 'message': 'Event deleted.', 'url': '/events/delete'}
+
+    def r_events_delete(self, user_id, data):
+        ids = self._unwrap(data, 'Event')['id']
+        for eid in ids if isinstance(ids, list) else [ids]:
+            self.r_event_delete(user_id, data, str(eid))
+        return {'saved': True, 'success': True, 'name': 'Events deleted.', 'message': 'Events deleted.', 'url': '/events/delete'}
+
+    def r_blocklists(self, user_id, data):
+        return [{'EventBlocklist': bl} for bl in self.store['EventBlocklist'].values()]
+
+    def r_blocklist_delete(self, user_id, data, bid):
+        self.store['EventBlocklist'].pop(self._get('EventBlocklist', bid)['id'])
+        return {'saved': True, 'success': True, 'name': 'Blocklist entry removed', 'message': 'Blocklist entry removed', 'url': '/eventBlocklists/delete'}
+
+    # # Feeds (the fetch is only counted, nothing is downloaded)
+
+    def r_feeds(self, user_id, data):
+        return [{'Feed': feed} for feed in self.store['Feed'].values()]
+
+    def r_feed_add(self, user_id, data):
+        feed = self._unwrap(data, 'Feed')
+        return {'Feed': self._new('Feed', **{k: v for k, v in feed.items() if not isinstance(v, (dict, list))},
+                                  fetches=0)}
+
+    def r_feed_edit(self, user_id, data, fid):
+        feed = self._get('Feed', fid)
+        self._update(feed, self._unwrap(data, 'Feed'))
+        return {'Feed': feed}
+
+    def r_feed_fetch(self, user_id, data, fid):
+        feed = self._get('Feed', fid)
+        feed['fetches'] += 1
+        return {'result': 'Pull queued for background execution.'}
+
+    routes: list[tuple[str, str, Callable[..., Any]]] = [
+        ('GET', r'servers/getPyMISPVersion\.json', r_pymisp_version),
+        ('GET', r'servers/getVersion', r_version),
+        ('GET', r'attributes/describeTypes\.json', r_describe_types),
+        ('POST', r'servers/serverSettingsEdit/(.+)', r_set_setting),
+        ('GET', r'servers/serverSettings', r_settings),
+        ('GET', r'servers/getWorkers', r_workers),
+        ('POST', r'(objectTemplates|galaxies|taxonomies|warninglists|noticelists)/update', r_update_json),
+        ('GET', r'users/statistics/(\w+)', r_statistics),
+        ('GET', r'users/view/([\w-]+)', r_user_view),
+        ('GET', r'admin/users/index', r_users),
+        ('POST', r'admin/users/add', r_user_add),
+        ('POST', r'(?:admin/)?users/edit/([\w-]+)', r_user_edit),
+        ('POST', r'admin/users/delete/([\w-]+)', r_user_delete),
+        ('POST', r'auth_keys/add/([\w-]+)', r_authkey),
+        ('GET', r'auth_keys/index', r_authkeys),
+        ('POST', r'auth_keys/delete/([\w-]+)', r_authkey_delete),
+        ('GET', r'organisations/index', r_orgs),
+        ('GET', r'organisations/view/([\w-]+)', r_org_view),
+        ('POST', r'admin/organisations/add', r_org_add),
+        ('POST', r'admin/organisations/edit/([\w-]+)', r_org_edit),
+        ('POST', r'admin/organisations/delete/([\w-]+)', r_org_delete),
+        ('GET', r'roles/index', r_roles),
+        ('POST', r'admin/roles/set_default/([\w-]+)', r_role_default),
+        ('GET', r'taxonomies/index', r_taxonomies),
+        ('GET', r'taxonomies/view/([\w-]+)', r_taxonomy_view),
+        ('POST', r'taxonomies/(enable|addTag)/([\w-]+)', r_taxonomy_enable),
+        ('GET', r'galaxies/index', r_galaxies),
+        ('POST', r'galaxy_clusters/add/([\w-]+)', r_cluster_add),
+        ('GET', r'tags/index', r_tags),
+        ('POST', r'tags/add', r_tag_add),
+        ('POST', r'tags/edit/([\w-]+)', r_tag_edit),
+        ('GET', r'servers/index', r_servers),
+        ('GET', r'servers/createSync', r_create_sync),
+        ('POST', r'servers/import', r_server_import),
+        ('POST', r'servers/edit/([\w-]+)', r_server_edit),
+        ('POST', r'servers/delete/([\w-]+)', r_server_delete),
+        ('POST', r'servers/testConnection/([\w-]+)', r_server_test),
+        ('POST', r'servers/push/([\w-]+)(?:/([\w-]+))?', r_server_push),
+        ('GET', r'sharingGroups/index', r_sharing_groups),
+        ('POST', r'sharingGroups/add', r_sharing_group_add),
+        ('POST', r'sharingGroups/add(Server|Org)', r_sharing_group_link),
+        ('POST', r'events/restSearch', r_search),
+        ('POST', r'events/index', r_index),
+        ('GET', r'events/view/([\w-]+)', r_event_view),
+        ('POST', r'events/view/([\w-]+)', r_event_view),
+        ('POST', r'events/add', r_event_add),
+        ('POST', r'events/edit/([\w-]+)', r_event_edit),
+        ('POST', r'events/publish/([\w-]+)', r_event_publish),
+        ('POST', r'events/delete/([\w-]+)', r_event_delete),
+        ('POST', r'events/delete', r_events_delete),
+        ('GET', r'eventBlocklists/index', r_blocklists),
+        ('POST', r'eventBlocklists/delete/([\w-]+)', r_blocklist_delete),
+        ('GET', r'feeds/index', r_feeds),
+        ('POST', r'feeds/add', r_feed_add),
+        ('POST', r'feeds/edit/([\w-]+)', r_feed_edit),
+        ('POST', r'feeds/fetchFromFeed/([\w-]+)', r_feed_fetch),
+    ]
+
+
+class FakeMISPHandler(BaseHTTPRequestHandler):
+    node: FakeMISPNode
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one go, the response is flushed by handle_one_request
+    wbufsize = 65536
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self, method: str):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        try:
+            data = json.loads(body) if body else None
+        except json.JSONDecodeError:
+            data = None
+        user_id = self.node.authkeys.get(self.headers.get('Authorization', '').strip())
+        status, payload = self.node.handle(method, self.path.split('?')[0], user_id, data)
+        if isinstance(payload, str):
+            content, content_type = payload.encode(), 'text/html'
+        else:
+            content, content_type = json.dumps(payload).encode(), 'application/json'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class FakeMISPEnvironment():
+    '''A central node and number_instances client nodes, with the config files init_misps.py would generate.'''
+
+    def __init__(self, root_dir: Path, number_instances: int, latency: Optional[dict[str, float]]=None,
+                 failure_rate: Optional[dict[str, float]]=None, seed: Optional[int]=None):
+        self.root_dir = root_dir
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        self.nodes: dict[str, FakeMISPNode] = {}
+        width = len(str(number_instances))
+        for instance_id in range(number_instances + 1):
+            admin_key = ''.join(random.Random(f'{seed}{instance_id}').choices('abcdefghijklmnopqrstuvwxyz', k=40))
+            node = FakeMISPNode(admin_key, latency, failure_rate, seed=None if seed is None else seed + instance_id)
+            if instance_id == 0:
+                name = central_node_name
+                orgname = central_node_org_name
+            else:
+                name = f'{prefix_client_node}{instance_id:0{width}}'
+                orgname = f'{client_node_org_name_prefix}{instance_id:0{width}}'
+            hostname = f'{name}{hostname_suffix}'
+            config = {'http_port': node.url.rsplit(':', 1)[1], 'admin_key': admin_key, 'admin_password': 'Password1234',
+                      'baseurl': node.url, 'external_baseurl': node.url, 'hostname': hostname,
+                      'email_site_admin': f'{admin_email_name}@{hostname}',
+                      'email_orgadmin': f'{orgadmin_email_name}@{hostname}', 'admin_orgname': orgname,
+                      'certname': hostname_suffix.lstrip('.')}
+            (self.root_dir / name).mkdir(exist_ok=True)
+            with (self.root_dir / name / 'config.json').open('w') as f:
+                json.dump(config, f, indent=2)
+            self.nodes[name] = node
+
+    def start(self):
+        for node in self.nodes.values():
+            node.start()
+
+    def stop(self):
+        for node in self.nodes.values():
+            node.stop()
+
+
+def parse_per_endpoint(values: list[str]) -> dict[str, float]:
+    '''Parse ["events/restSearch=0.2", "0.01"] into {'events/restSearch': 0.2, '*': 0.01}'''
+    to_return = {}
+    for value in values:
+        if '=' in value:
+            endpoint, v = value.rsplit('=', 1)
+            to_return[endpoint.strip('/')] = float(v)
+        else:
+            to_return['*'] = float(value)
+    return to_return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run fake MISP instances and write their config files (use fake_bin as docker).')
+    parser.add_argument('-n', '--number_instances', type=int, default=2, help='Number of client nodes')
+    parser.add_argument('--root', default='misps_fake', help='Directory where the config files are written')
+    parser.add_argument('--latency', nargs='*', default=[], help='Latency in seconds: "0.01" for all the endpoints, "events/restSearch=0.2" for one')
+    parser.add_argument('--failure_rate', nargs='*', default=[], help='Probability of a 500 error, same format as --latency')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    environment = FakeMISPEnvironment(Path(args.root).resolve(), args.number_instances,
+                                      parse_per_endpoint(args.latency), parse_per_endpoint(args.failure_rate), args.seed)
+    environment.start()
+    for name, node in environment.nodes.items():
+        print(name, node.url)
+    print(f'Config files in {environment.root_dir}, prepend {fake_bin_dir} to your PATH. Ctrl-C to stop.')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        environment.stop()
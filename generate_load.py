@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Populate the instances with synthetic events, to stress-test the sync and the feed export.'''
+
+import argparse
+import ipaddress
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from pymisp import PyMISP, MISPEvent, MISPObject, MISPGalaxyCluster
+
+from generic_config import secure_connection, tag_nodes_to_central, tag_central_to_nodes, max_concurrent_nodes
+from misp_instances import MISPInstances, MISPInstance
+
+attribute_types = ['ip-dst', 'ip-src', 'domain', 'hostname', 'url', 'md5', 'sha256', 'email-src', 'text']
+
+
+def random_value(rng: random.Random, attribute_type: str) -> str:
+    if attribute_type in ['ip-dst', 'ip-src']:
+        return str(ipaddress.IPv4Address(rng.getrandbits(32)))
+    if attribute_type in ['domain', 'hostname']:
+        return f'{rng.getrandbits(48):x}.example.{rng.choice(["com", "org", "net"])}'
+    if attribute_type == 'url':
+        return f'https://{rng.getrandbits(48):x}.example.com/{rng.getrandbits(32):x}'
+    if attribute_type == 'md5':
+        return f'{rng.getrandbits(128):032x}'
+    if attribute_type == 'sha256':
+        return f'{rng.getrandbits(256):064x}'
+    if attribute_type == 'email-src':
+        return f'{rng.getrandbits(32):x}@example.com'
+    return f'Synthetic text {rng.getrandbits(64):x}'
+
+
+class LoadGenerator():
+
+    def __init__(self, node: MISPInstance, is_central: bool, args):
+        self.node = node
+        self.is_central = is_central
+        self.args = args
+        # Same seed + same node name => same dataset, whatever the scheduling of the workers
+        self.rng = random.Random(f'{args.seed}-{node.owner_orgname}')
+        self.authkey = node.config.get('site_admin_authkey')
+        self._local = threading.local()
+
+    @property
+    def connector(self) -> PyMISP:
+        '''One connection per worker thread'''
+        if not hasattr(self._local, 'connector'):
+            self._local.connector = PyMISP(self.node.baseurl, self.authkey, ssl=secure_connection, timeout=300)
+        return self._local.connector
+
+    def create_galaxy_clusters(self) -> list[str]:
+        galaxies = self.node.owner_site_admin.galaxies()
+        if not galaxies or not self.args.clusters:
+            return []
+        for galaxy in galaxies:
+            if galaxy.type == 'threat-actor':  # type: ignore
+                break
+        else:
+            galaxy = galaxies[0]  # type: ignore
+        tag_names = []
+        for i in range(self.args.clusters):
+            cluster = MISPGalaxyCluster()
+            cluster.value = f'Synthetic cluster {self.args.seed}-{i}'
+            cluster.description = 'Generated by generate_load.py'
+            cluster.distribution = 3
+            cluster = self.node.owner_site_admin.add_galaxy_cluster(galaxy, cluster)  # type: ignore
+            if isinstance(cluster, MISPGalaxyCluster):
+                tag_names.append(cluster.tag_name)
+        return tag_names
+
+    def build_event(self, i: int, cluster_tags: list[str]) -> MISPEvent:
+        event = MISPEvent()
+        event.info = f'Synthetic event {self.args.seed}-{i} ({self.node.owner_orgname})'
+        event.distribution = 3
+        event.threat_level_id = self.rng.randint(1, 4)
+        event.analysis = self.rng.randint(0, 2)
+        for _ in range(self.args.attributes):
+            attribute_type = self.rng.choice(attribute_types)
+            event.add_attribute(attribute_type, random_value(self.rng, attribute_type),
+                                to_ids=attribute_type != 'text')
+        for _ in range(self.args.objects):
+            obj = MISPObject('domain-ip')
+            obj.add_attribute('domain', random_value(self.rng, 'domain'))
+            obj.add_attribute('ip', random_value(self.rng, 'ip-dst'))
+            event.add_object(obj)
+        if self.rng.random() < self.args.sync_ratio:
+            event.add_tag(self.rng.choice(tag_central_to_nodes if self.is_central else tag_nodes_to_central))
+        for tag_id in self.rng.sample(range(self.args.tag_pool), min(self.args.tags, self.args.tag_pool)):
+            event.add_tag(f'synthetic:tag="{tag_id}"')
+        if cluster_tags:
+            event.add_tag(self.rng.choice(cluster_tags))
+        return event
+
+    def add_event(self, event: MISPEvent) -> int:
+        '''One request per event (MISP creates one event per call), with all its attributes, objects and tags'''
+        for attempt in range(3):
+            try:
+                new_event = self.connector.add_event(event, pythonify=True)
+                break
+            except requests.exceptions.ConnectionError as e:
+                if attempt == 2:
+                    print(f'Unable to add event on {self.node}: {e}')
+                    return 0
+                print(f'Error on {self.node}, retrying: {e}')
+                time.sleep(1)
+            except Exception as e:
+                # Ex. a timeout: the event may have been created anyway, a retry would duplicate it
+                print(f'Unable to add event on {self.node}: {e}')
+                return 0
+        if not isinstance(new_event, MISPEvent):
+            print(f'Unable to add event on {self.node}: {new_event}')
+            return 0
+        if self.args.publish:
+            try:
+                self.connector.publish(new_event)
+            except Exception as e:
+                print(f'Unable to publish {new_event.uuid} on {self.node}: {e}')
+        return len(event.attributes) + sum(len(o.attributes) for o in event.objects)
+
+    def run(self) -> tuple[int, int, float]:
+        # Make sure the owner site admin exists and its key is in the config
+        self.authkey = self.node.owner_site_admin.key
+        cluster_tags = self.create_galaxy_clusters()
+        events = [self.build_event(i, cluster_tags) for i in range(self.args.events)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.workers) as executor:
+            attributes = list(executor.map(self.add_event, events))
+        return len([a for a in attributes if a]), sum(attributes), time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Populate the instances with synthetic events.')
+    parser.add_argument('--root', default='misps', help='Directory with the config files of the instances')
+    parser.add_argument('--nodes', nargs='+', help='Name of the admin org of the nodes to populate (default: all)')
+    parser.add_argument('--events', type=int, default=100, help='Events per node')
+    parser.add_argument('--attributes', type=int, default=20, help='Attributes per event')
+    parser.add_argument('--objects', type=int, default=2, help='Objects per event')
+    parser.add_argument('--tags', type=int, default=2, help='Tags per event, taken from a pool of --tag_pool tags')
+    parser.add_argument('--tag_pool', type=int, default=50)
+    parser.add_argument('--clusters', type=int, default=5, help='Galaxy clusters created per node, one is attached to each event')
+    parser.add_argument('--sync_ratio', type=float, default=0.5, help='Proportion of events with a sync tag')
+    parser.add_argument('--publish', default=False, action='store_true', help='Publish the events')
+    parser.add_argument('--workers', type=int, default=4, help='Concurrent writers per node')
+    parser.add_argument('--max_workers', type=int, default=max_concurrent_nodes, help='Nodes populated at the same time')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    instances = MISPInstances(root_misps=args.root, bootstrap=False)
+    nodes = {instances.central_node.owner_orgname: instances.central_node, **instances.client_nodes}
+    if args.nodes:
+        nodes = {name: node for name, node in nodes.items() if name in args.nodes}
+        if not nodes:
+            raise Exception(f'Available instances: {[instances.central_node.owner_orgname, *instances.client_nodes]}')
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(args.max_workers, len(nodes))) as executor:
+        results = dict(zip(nodes.keys(), executor.map(lambda node: LoadGenerator(node, node == instances.central_node, args).run(),
+                                                          nodes.values())))
+    total_time = time.perf_counter() - start
+
+    print(f'{"Node":<30} {"events":>8} {"attributes":>11} {"events/s":>10} {"attributes/s":>13}')
+    for name, (events, attributes, duration) in results.items():
+        print(f'{name:<30} {events:>8} {attributes:>11} {events / duration:>10.1f} {attributes / duration:>13.1f}')
+    total_events = sum(r[0] for r in results.values())
+    total_attributes = sum(r[1] for r in results.values())
+    print(f'{"Total":<30} {total_events:>8} {total_attributes:>11} {total_events / total_time:>10.1f} {total_attributes / total_time:>13.1f}')
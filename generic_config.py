@@ -2,6 +2,56 @@
 # -*- coding: utf-8 -*-
 
 internal_network_name = 'custom_misp_training_environment'
+# The internal network starts at this address and is sized for the number of instances (/24 at least)
+internal_network_base = '172.24.0.0'
+# Addresses kept on the internal network for the containers that aren't MISP instances (proxy, shared services, ...)
+internal_network_reserved = 32
+# Each instance gets its own subnet of this size in the pool for its docker compose network,
+# instead of the docker default pools (~30 networks)
+instances_subnet_pool = '10.128.0.0/16'
+instances_subnet_prefix = 27
+# Services run once for all the instances instead of once per instance, to save memory: any of
+# 'misp-modules', 'db' (one schema and user per instance) and 'redis' (two DB indexes per instance).
+# They run in the stack generated in <root>/shared, on the internal network.
+# NOTE: with 'redis', the DB indexes of an instance are set by the entrypoint of misp-core (customize_misp.sh of
+#       misp-docker) when the container starts, and checked again when it is set up by MISPInstance (setup_sync.py).
+shared_services: list[str] = []
+# Limits and tuning of the containers, by profile and service: cpus/memory go to the compose
+# deploy.resources.limits, environment is added to the service, command_args are appended to its command.
+resource_profiles: dict[str, dict[str, dict]] = {
+    'tiny': {
+        'misp-core': {'cpus': '1', 'memory': '1G',
+                      'environment': {'PHP_MEMORY_LIMIT': '512M', 'PHP_FCGI_CHILDREN': 3,
+                                      'PHP_FCGI_START_SERVERS': 1, 'PHP_FCGI_SPARE_SERVERS': 1}},
+        'db': {'memory': '384M', 'command_args': ['--innodb-buffer-pool-size=64M', '--max-connections=30']},
+        'redis': {'memory': '96M', 'command_args': ['--maxmemory', '64mb', '--maxmemory-policy', 'volatile-lru']},
+        'misp-modules': {'memory': '384M'},
+    },
+    'trainee': {
+        'misp-core': {'cpus': '2', 'memory': '2G',
+                      'environment': {'PHP_MEMORY_LIMIT': '1024M', 'PHP_FCGI_CHILDREN': 6,
+                                      'PHP_FCGI_START_SERVERS': 2, 'PHP_FCGI_SPARE_SERVERS': 2}},
+        'db': {'memory': '768M', 'command_args': ['--innodb-buffer-pool-size=256M', '--max-connections=60']},
+        'redis': {'memory': '192M', 'command_args': ['--maxmemory', '128mb', '--maxmemory-policy', 'volatile-lru']},
+        'misp-modules': {'memory': '512M'},
+    },
+    'central': {
+        'misp-core': {'cpus': '4', 'memory': '6G',
+                      'environment': {'PHP_MEMORY_LIMIT': '2048M', 'PHP_FCGI_CHILDREN': 20,
+                                      'PHP_FCGI_START_SERVERS': 5, 'PHP_FCGI_SPARE_SERVERS': 5}},
+        'db': {'memory': '3G', 'command_args': ['--innodb-buffer-pool-size=2G', '--max-connections=200']},
+        'redis': {'memory': '512M'},
+        'misp-modules': {'memory': '1G'},
+    },
+}
+# Profile of each kind of instance (None: no limits, the defaults of misp-docker), can be overridden per
+# instance with resource_profile_override in its config.json. The shared services use shared_services_resource_profile.
+central_node_resource_profile: str | None = None
+client_node_resource_profile: str | None = None
+shared_services_resource_profile: str | None = None
+# Host ports: instance N uses http_port_base + N and https_port_base + N (or the next free ones)
+http_port_base = 8000
+https_port_base = 9000
 
 # NOTE: There will be an extra instances (the central node), where all the client synchronize with (push)
 number_instances = 2
@@ -26,11 +76,30 @@ orgadmin_email_name = 'orgadmin'
 tag_central_to_nodes = ['push_to_nodes', 'push_to_nodes_alt']
 tag_nodes_to_central = ['push_to_central', 'push_to_central_alt']
 
+# How the central node distributes the events tagged with tag_central_to_nodes:
+# 'sync': pushed to each client node over its sync connection (the work of the central node grows with the class)
+# 'feed': exported once as a static MISP feed served by nginx-proxy, the client nodes fetch it (trigger_sync.py)
+central_distribution = 'sync'
+# 'feed': the feed of the central node, in <root>/central_feed, served by nginx-proxy on this path of the central node
+central_feed_name = 'Central node'
+central_feed_location = '/central-feed/'
+
 # #### Other config
 enabled_taxonomies = ['tlp']
 enabled_taxonomies_central_node = []
 unpublish_on_sync = False
 
+# #### nginx-proxy
+# Generate the performance profile of the proxy in setup_nginx.py (compression, static files cache, buffers, HTTP/2)
+nginx_performance_profile = True
+# Idle keepalive connections kept by the proxy to each MISP instance (label on misp-core, 0 to disable)
+nginx_upstream_keepalive = 32
+# Size of the cache of the static files (css, js, images, fonts) of all the instances
+nginx_static_cache_size = '1g'
+
+# Number of nodes the tooling talks to at the same time
+max_concurrent_nodes = 10
+
 central_node_server_settings = {
 }
 
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Create instances from a snapshot of a fully initialised one, instead of initialising each of them.
+
+1. Initialise one instance (init_misps.py, then MISPInstances and update_all_instances), before setting up the sync
+2. ./golden_image.py snapshot --template misp-1
+3. ./init_misps.py with more instances (only generates the new stacks), then ./golden_image.py clone --nodes misp-2 ...
+   Each clone gets the data of the template, then its own admin key and password, instance and org UUIDs,
+   org name, users, baseurl and MISP.host_org_id.
+'''
+
+import argparse
+import json
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import yaml
+
+from pymisp import PyMISP
+
+from docker_helpers import docker_command, check
+from generic_config import secure_connection, max_concurrent_nodes, shared_services
+from misp_instances import MISPInstance
+from tracing import tracer
+
+# Image used to copy the volumes
+helper_image = 'alpine:3'
+cake = 'sudo docker compose exec -T -u www-data misp-core /var/www/MISP/app/Console/cake'
+
+
+def data_mounts(project_dir: Path) -> dict[str, str]:
+    '''Writable mounts of the stack, {"<service>:<path in the container>": <volume name or host directory>}'''
+    with (project_dir / 'docker-compose.yml').open() as f:
+        docker_content = yaml.safe_load(f)
+    named_volumes = docker_content.get('volumes') or {}
+    mounts = {}
+    for service, definition in docker_content['services'].items():
+        for volume in definition.get('volumes', []):
+            if isinstance(volume, dict):
+                source, target, read_only = volume.get('source'), volume['target'], volume.get('read_only')
+            else:
+                source, target, *mode = volume.split(':')
+                read_only = mode == ['ro']
+            if not source or read_only:
+                continue
+            if source.startswith('.'):
+                path = (project_dir / source).resolve()
+                # Only the directories of the instance (not misp-refresh, the custom objects, ...)
+                if project_dir.resolve() not in path.parents:
+                    continue
+                mounts[f'{service}:{target}'] = str(path)
+            elif not source.startswith('/'):
+                name = (named_volumes.get(source) or {}).get('name', f'{project_dir.name}_{source}')
+                mounts[f'{service}:{target}'] = name
+    return mounts
+
+
+def snapshot(template_dir: Path, golden_dir: Path):
+    golden_dir.mkdir(parents=True, exist_ok=True)
+    with (template_dir / 'config.json').open() as f:
+        config = json.load(f)
+    mounts = data_mounts(template_dir)
+    check(docker_command('sudo docker compose stop', template_dir.name, cwd=template_dir), 'Stopping the template')
+    try:
+        archives = {}
+        for i, (key, source) in enumerate(sorted(mounts.items())):
+            archive = f'{i}.tar'
+            print(f'Snapshot of {key} ({source})')
+            check(docker_command(f'sudo docker run --rm -v {source}:/data:ro -v {golden_dir.resolve()}:/golden {helper_image} '
+                                 f'tar -C /data -cf /golden/{archive} .', template_dir.name), f'Snapshot of {key}')
+            archives[key] = archive
+    finally:
+        check(docker_command('sudo docker compose start', template_dir.name, cwd=template_dir), 'Restarting the template')
+    golden = {'template': template_dir.name, 'created': time.time(), 'archives': archives,
+              'admin_key': config['admin_key'], 'admin_orgname': config['admin_orgname'],
+              'email_site_admin': config['email_site_admin'], 'email_orgadmin': config['email_orgadmin']}
+    with (golden_dir / 'golden.json').open('w') as f:
+        json.dump(golden, f, indent=2)
+    print(f'Golden image of {template_dir.name} in {golden_dir}: {len(archives)} volume(s)')
+
+
+def restore(node_dir: Path, golden_dir: Path, golden: dict):
+    mounts = data_mounts(node_dir)
+    if missing := set(golden['archives']) - set(mounts):
+        raise Exception(f'{node_dir.name} has no mount for {missing}, was it generated with the same docker-compose.yml?')
+    check(docker_command('sudo docker compose down', node_dir.name, cwd=node_dir), f'Stopping {node_dir.name}')
+    for key, archive in golden['archives'].items():
+        if mounts[key].startswith('/'):
+            Path(mounts[key]).mkdir(parents=True, exist_ok=True)
+        check(docker_command(f'sudo docker run --rm -v {mounts[key]}:/data -v {golden_dir.resolve()}:/golden:ro {helper_image} '
+                             f'sh -c "find /data -mindepth 1 -delete && tar -C /data -xf /golden/{archive}"', node_dir.name),
+              f'Restore of {key} on {node_dir.name}')
+    check(docker_command('sudo docker compose up -d', node_dir.name, cwd=node_dir), f'Starting {node_dir.name}')
+
+
+def rewrite(node_dir: Path, golden: dict):
+    '''Give its own identity to a clone'''
+    config_file = node_dir / 'config.json'
+    with config_file.open() as f:
+        config = json.load(f)
+
+    # Through the container: the admin key in the DB is the one of the template.
+    for _ in range(60):
+        returncode, _, errs = docker_command(f'{cake} user change_authkey admin@admin.test {config["admin_key"]}', config['hostname'], cwd=node_dir)
+        if returncode == 0:
+            break
+        print(f'Waiting for {config["hostname"]}: {errs.decode().strip()}')
+        tracer.sleep(5, config['hostname'])
+    else:
+        raise Exception(f'{config["hostname"]} did not start.')
+    check(docker_command(f'{cake} user change_pw admin@admin.test {config["admin_password"]}', config['hostname'], cwd=node_dir),
+          'Admin password')
+    for setting, value in [('MISP.uuid', str(uuid.uuid4())), ('MISP.baseurl', config['baseurl']), ('MISP.org', config['admin_orgname'])]:
+        check(docker_command(f'{cake} Admin setSetting {setting} "{value}"', config['hostname'], cwd=node_dir), setting)
+
+    connector = PyMISP(config['baseurl'], config['admin_key'], ssl=secure_connection, timeout=300)
+    connector.toggle_global_pythonify()
+    for org in connector.organisations(scope='local'):
+        if org.name == golden['admin_orgname']:  # type: ignore
+            org.name = config['admin_orgname']  # type: ignore
+            org.uuid = str(uuid.uuid4())  # type: ignore
+            connector.update_organisation(org)  # type: ignore
+            break
+    user_ids = []
+    for user in connector.users():
+        for key in ['email_site_admin', 'email_orgadmin']:
+            if user.email == golden[key]:  # type: ignore
+                user.email = config[key]  # type: ignore
+                connector.update_user(user)  # type: ignore
+                user_ids.append(str(user.id))  # type: ignore
+    # The keys of the template users must not work on the clone
+    for auth_key in connector.direct_call('auth_keys/index'):
+        if str(auth_key['AuthKey']['user_id']) in user_ids:
+            connector.direct_call(f'auth_keys/delete/{auth_key["AuthKey"]["id"]}', {})
+
+    # New keys and passwords are created by MISPInstance
+    for key in ['site_admin_authkey', 'site_admin_password', 'orgadmin_authkey', 'orgadmin_password',
+                'sync_push_timestamp', 'sync_push_uuids', 'last_push', 'last_push_duration']:
+        config.pop(key, None)
+    config['golden_image'] = golden['template']
+    with config_file.open('w') as f:
+        json.dump(config, f, indent=2)
+    # Sets the external baseurl, MISP.host_org_id, the users, ...
+    MISPInstance(config_file)
+
+
+def clone(node_dir: Path, golden_dir: Path, golden: dict) -> str:
+    start = time.time()
+    restore(node_dir, golden_dir, golden)
+    restored = time.time()
+    rewrite(node_dir, golden)
+    return f'{node_dir.name}: restored in {restored - start:.0f}s, rewritten in {time.time() - restored:.0f}s'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Snapshot an initialised instance and create new ones from it.',
+                                     epilog=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('action', choices=['snapshot', 'clone'])
+    parser.add_argument('--root', default='misps', help='Directory with the config files of the instances')
+    parser.add_argument('--golden', default='golden', help='Directory of the snapshot, relative to the root directory')
+    parser.add_argument('--template', help='snapshot: directory name of the instance to snapshot (ex. misp-1)')
+    parser.add_argument('--nodes', nargs='+', help='clone: directory names of the instances to overwrite (ex. misp-2 misp-3)')
+    parser.add_argument('--max_workers', type=int, default=max_concurrent_nodes, help='clone: instances cloned at the same time')
+    args = parser.parse_args()
+
+    if 'db' in shared_services:
+        raise Exception('The golden images need the database in the stack of each instance (shared_services in generic_config).')
+    misp_instances_dir = Path(__file__).resolve().parent / args.root
+    golden_dir = misp_instances_dir / args.golden
+    if args.action == 'snapshot':
+        if not args.template:
+            parser.error('snapshot needs --template')
+        snapshot(misp_instances_dir / args.template, golden_dir)
+    else:
+        if not args.nodes:
+            parser.error('clone needs --nodes')
+        with (golden_dir / 'golden.json').open() as f:
+            golden = json.load(f)
+        if golden['template'] in args.nodes:
+            parser.error(f'{golden["template"]} is the template')
+        with ThreadPoolExecutor(max_workers=min(args.max_workers, len(args.nodes))) as executor:
+            for result in executor.map(lambda name: clone(misp_instances_dir / name, golden_dir, golden), args.nodes):
+                print(result)
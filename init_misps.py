@@ -1,24 +1,91 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import argparse
+import hashlib
+import ipaddress
 import json
+import math
 from pathlib import Path
 import git
 from subprocess import Popen, PIPE
 import shlex
 import os
 import random
+import shutil
 import string
+import sys
 import yaml
+from typing import Optional
 
 from generic_config import (internal_network_name, number_instances, central_node_name,
                             hostname_suffix, prefix_client_node, admin_email_name, orgadmin_email_name,
-                            central_node_org_name, client_node_org_name_prefix, url_scheme)
-
-
-def _print_output(command):
-    p = Popen(command, stdout=PIPE, stderr=PIPE)
-    out, err = p.communicate()
+                            central_node_org_name, client_node_org_name_prefix, url_scheme,
+                            internal_network_base, internal_network_reserved, instances_subnet_pool,
+                            instances_subnet_prefix, http_port_base, https_port_base, shared_services,
+                            resource_profiles, central_node_resource_profile, client_node_resource_profile,
+                            shared_services_resource_profile, nginx_upstream_keepalive)
+from metadata_cache import metadata_dir, metadata_mounts, current_version as current_metadata_version
+from tracing import tracer, command_name
+
+# Directories mounted in the misp-core containers, relative to the root of the repository
+custom_directories = ['objects', 'taxonomies', 'dashboards', 'eventwarnings']
+# Keys of the config used in docker-compose.yml and .env
+compose_config_keys = ['http_port', 'https_port', 'subnet', 'hostname', 'certname', 'admin_key', 'admin_password',
+                       'db_name', 'db_user', 'db_password', 'resource_profile', 'metadata_cache_version', 'redis_database']
+# Name of the shared services on the internal network
+shared_services_hostnames = {'misp-modules': 'misp-shared-modules', 'db': 'misp-shared-db', 'redis': 'misp-shared-redis'}
+
+
+def _set_environment(service: dict, key: str, value: str):
+    '''Set a variable in the environment of a compose service (list or mapping)'''
+    environment = service.get('environment', [])
+    if isinstance(environment, dict):
+        environment[key] = value
+    else:
+        environment = [e for e in environment if e.split('=', 1)[0] != key] + [f'{key}={value}']
+    service['environment'] = environment
+
+
+def _apply_resource_profile(services: dict, profile_name: Optional[str]):
+    '''Limits and tuning of the services, from resource_profiles in generic_config'''
+    if not profile_name:
+        return
+    if profile_name not in resource_profiles:
+        raise Exception(f'Unknown resource profile {profile_name}, available: {list(resource_profiles)}')
+    for service, resources in resource_profiles[profile_name].items():
+        if service not in services:
+            continue
+        definition = services[service]
+        limits = {key: resources[key] for key in ['cpus', 'memory'] if key in resources}
+        if limits:
+            definition.setdefault('deploy', {}).setdefault('resources', {})['limits'] = limits
+        for key, value in resources.get('environment', {}).items():
+            _set_environment(definition, key, str(value))
+        if command_args := resources.get('command_args'):
+            # For mysqld and redis-server, the last occurrence of an option wins
+            command = definition.get('command')
+            if isinstance(command, str):
+                definition['command'] = f'{command} {shlex.join(command_args)}'
+            else:
+                definition['command'] = (command or []) + command_args
+
+
+def _redis_database(instance_id: int) -> int:
+    '''First of the two DB indexes of an instance on the shared redis (MISP, then the background jobs).
+    0, 1 and 13 are left out: 13 and 1 are the MISP defaults, used by an instance until its setting is applied.'''
+    index = 2 + 2 * instance_id
+    return index + 2 if index >= 12 else index
+
+
+def _random_password(length: int=32) -> str:
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
+
+
+def _print_output(command, node: str=''):
+    with tracer.span('docker', command_name(command), node):
+        p = Popen(command, stdout=PIPE, stderr=PIPE)
+        out, err = p.communicate()
     print(command)
     if out:
         print('stdout:', out.decode())
@@ -26,9 +93,72 @@ def _print_output(command):
         print('stderr:', err.decode())
 
 
+class AddressAllocator():
+    '''Host ports and subnets of the instances. The allocations already in the config files are kept,
+    unless they collide with another instance.'''
+
+    def __init__(self, root_dir: Path, number_instances: int):
+        configs = {}
+        for config_file in sorted(root_dir.glob('*/config.json'), key=lambda p: (p.parent.name != central_node_name, p.parent.name)):
+            with config_file.open() as f:
+                configs[config_file.parent.name] = json.load(f)
+        # Value -> name of the instance using it, the first one wins
+        self.claims: dict[str, dict[str, str]] = {'http_port': {}, 'https_port': {}, 'subnet': {}}
+        for name, config in configs.items():
+            for key, claims in self.claims.items():
+                if config.get(key):
+                    claims.setdefault(str(config[key]), name)
+
+        needed = number_instances + 1 + internal_network_reserved + 3  # network, gateway, broadcast
+        prefix = min(24, 32 - math.ceil(math.log2(needed)))
+        self.internal_subnet = str(ipaddress.ip_network(f'{internal_network_base}/{prefix}', strict=False))
+        for config in configs.values():
+            if existing := config.get('internal_subnet'):
+                if ipaddress.ip_network(existing).num_addresses >= needed:
+                    self.internal_subnet = existing
+                else:
+                    print(f'The internal network ({existing}) is too small for {number_instances} instances. '
+                          f'Stop all the instances and remove it (sudo docker network rm {internal_network_name}) '
+                          f'to get a {self.internal_subnet} network.')
+                break
+        self.subnets = list(ipaddress.ip_network(instances_subnet_pool).subnets(new_prefix=instances_subnet_prefix))
+
+    def _valid(self, key: str, value: str) -> bool:
+        if key == 'subnet':
+            return ipaddress.ip_network(value).subnet_of(ipaddress.ip_network(instances_subnet_pool))  # type: ignore
+        return 0 < int(value) < 65536
+
+    def _candidates(self, key: str, instance_id: int):
+        if key == 'subnet':
+            for subnet in self.subnets[instance_id:] + self.subnets[:instance_id]:
+                yield str(subnet)
+            raise Exception(f'No subnet left in {instances_subnet_pool}')
+        base = http_port_base if key == 'http_port' else https_port_base
+        for port in range(base + instance_id, 65536):
+            yield str(port)
+        raise Exception(f'No {key} left after {base + instance_id}')
+
+    def allocate(self, name: str, instance_id: int, config: dict) -> dict[str, str]:
+        allocation = {'internal_subnet': self.internal_subnet}
+        for key, claims in self.claims.items():
+            value = str(config[key]) if config.get(key) else None
+            if not value or claims.get(value) != name or not self._valid(key, value):
+                value = next(v for v in self._candidates(key, instance_id) if v not in claims)
+                claims[value] = name
+            allocation[key] = value
+        return allocation
+
+
 class MISPDocker():
 
-    def __init__(self, root_dir: Path, instance_id: int, instances_number_width: int, url_scheme: str):
+    def __init__(self, root_dir: Path, instance_id: int, instances_number_width: int, url_scheme: str,
+                 allocator: AddressAllocator, force: bool=False, pull: bool=True, update: bool=False):
+        '''If force is False and the inputs of docker-compose.yml and .env didn't change since the last run,
+        they are not regenerated and the containers are not recreated.
+        If pull is False, the images are pulled later, once for all the instances (rolling_update.py).
+        If update is True, the misp-docker repository of an existing instance is pulled from upstream first
+        (one network round trip per instance).'''
+        self.pull = pull
         self.instance_id = instance_id
         self.url_scheme = url_scheme
         if self.instance_id == 0:
@@ -41,11 +171,28 @@ class MISPDocker():
             self.config = config
         else:
             self.config = {
-                'http_port': f'80{self.instance_id}',
-                'https_port': f'443{self.instance_id}',
                 'admin_password': ''.join(random.choices(string.ascii_uppercase + string.digits, k=40)),
                 'admin_key': ''.join(random.choices(string.ascii_letters, k=40))
             }
+        # An instance created before the subnets were allocated has to be taken down to move its network
+        self.move_network = bool(config) and self.config.get('subnet') is None
+        self.config.update(allocator.allocate(self.misp_docker_dir.name, instance_id, self.config))
+        if 'db' in shared_services and not self.config.get('db_password'):
+            self.config['db_name'] = self.config['db_user'] = self.misp_docker_dir.name.replace('-', '_')
+            self.config['db_password'] = _random_password()
+        # Follows generic_config, unless the instance has its own profile
+        if 'resource_profile_override' in self.config:
+            self.config['resource_profile'] = self.config['resource_profile_override']
+        else:
+            self.config['resource_profile'] = central_node_resource_profile if instance_id == 0 else client_node_resource_profile
+        if metadata_version := current_metadata_version():
+            self.config['metadata_cache_version'] = metadata_version
+        else:
+            self.config.pop('metadata_cache_version', None)
+        if 'redis' in shared_services:
+            self.config['redis_database'] = _redis_database(instance_id)
+        else:
+            self.config.pop('redis_database', None)
 
         if self.instance_id == 0:
             self.config['baseurl'] = f'{url_scheme}://{central_node_name}{hostname_suffix}'
@@ -62,20 +209,53 @@ class MISPDocker():
             self.config['admin_orgname'] = f'{client_node_org_name_prefix}{instance_id:0{instances_number_width}}'
             self.config['certname'] = f'{hostname_suffix[1:]}'  # get rid of the .
 
+        generated_compose = None
         if self.misp_docker_dir.exists():
             self.instance_repo = git.Repo(self.misp_docker_dir)
+            if (self.misp_docker_dir / '.env').exists():
+                generated_compose = (self.misp_docker_dir / 'docker-compose.yml').read_bytes()
             self.instance_repo.git.checkout('docker-compose.yml')
-            self.instance_repo.remote('origin').pull(rebase='false')
+            if update:
+                self.instance_repo.remote('origin').pull(rebase='false')
         else:
             self.instance_repo = git.repo.base.Repo.clone_from('https://github.com/MISP/misp-docker.git', str(self.misp_docker_dir))
 
         print("Docker path", self.misp_docker_dir, instance_id)
-        self._prepare_docker_compose()
+        self.inputs_hash = self._inputs_hash()
+        self.unchanged = not force and generated_compose is not None and self.config.get('compose_hash') == self.inputs_hash
+        if self.unchanged:
+            print(f'{self.config["hostname"]}: nothing changed since the last run, keeping docker-compose.yml and .env')
+            (self.misp_docker_dir / 'docker-compose.yml').write_bytes(generated_compose)  # type: ignore
+        else:
+            if generated_compose is not None and 'pending_compose_hash' not in self.config:
+                # Deployed version, for a rollback by rolling_update.py
+                (self.misp_docker_dir / 'docker-compose.yml.previous').write_bytes(generated_compose)
+                shutil.copyfile(self.misp_docker_dir / '.env', self.misp_docker_dir / '.env.previous')
+            self._prepare_docker_compose()
 
     @property
     def hostsfile_entry(self):
         return f"127.0.0.1    {self.config['hostname']}"
 
+    def _inputs_hash(self) -> str:
+        '''Hash of everything used to generate docker-compose.yml and .env (templates from the upstream repository,
+        config, custom directories)'''
+        inputs_hash = hashlib.sha256()
+        for name in ['docker-compose.yml', 'template.env']:
+            inputs_hash.update(name.encode())
+            inputs_hash.update((self.misp_docker_dir / name).read_bytes())
+        config = {key: self.config.get(key) for key in compose_config_keys}
+        profile = resource_profiles.get(self.config['resource_profile']) if self.config['resource_profile'] else None
+        inputs_hash.update(json.dumps([config, internal_network_name, shared_services, profile, nginx_upstream_keepalive],
+                                      sort_keys=True).encode())
+        root_dir = (self.misp_docker_dir / '..' / '..').resolve()
+        for directory in custom_directories:
+            for path in sorted((root_dir / directory).rglob('*')):
+                if path.is_file():
+                    inputs_hash.update(str(path.relative_to(root_dir)).encode())
+                    inputs_hash.update(path.read_bytes())
+        return inputs_hash.hexdigest()
+
     def _prepare_docker_compose(self):
         with (self.misp_docker_dir / 'docker-compose.yml').open() as f:
             docker_content = yaml.safe_load(f.read())
@@ -88,23 +268,31 @@ class MISPDocker():
             # Add misp-refresh
             docker_content['services']['misp-core']['volumes'].append('../../misp-refresh:/var/www/MISP/misp-refresh/')
 
-        # Add user defined objects
-        user_defined_objects_path = (self.misp_docker_dir / '..' / '..' / 'objects').resolve()
-        for obj_dir in user_defined_objects_path.glob('*'):
-            if not obj_dir.is_dir():
-                continue
-            to_append = f'{obj_dir}:/var/www/MISP/app/files/misp-objects/objects/{obj_dir.name}/:ro'
-            if to_append not in docker_content['services']['misp-core']['volumes']:
-                docker_content['services']['misp-core']['volumes'].append(to_append)
-
-        # Add user defined taxonomies
-        user_defined_taxonomies_path = (self.misp_docker_dir / '..' / '..' / 'taxonomies').resolve()
-        for tax_dir in user_defined_taxonomies_path.glob('*'):
-            if not tax_dir.is_dir():
-                continue
-            to_append = f'{tax_dir}:/var/www/MISP/app/files/taxonomies/{tax_dir.name}/:ro'
-            if to_append not in docker_content['services']['misp-core']['volumes']:
-                docker_content['services']['misp-core']['volumes'].append(to_append)
+        # Shared metadata cache (metadata_cache.py), it already contains the user defined objects and taxonomies
+        if self.config.get('metadata_cache_version'):
+            version_dir = metadata_dir / self.config['metadata_cache_version']
+            for name, container_path in metadata_mounts.items():
+                to_append = f'{version_dir / name}:{container_path}/:ro'
+                if to_append not in docker_content['services']['misp-core']['volumes']:
+                    docker_content['services']['misp-core']['volumes'].append(to_append)
+        else:
+            # Add user defined objects
+            user_defined_objects_path = (self.misp_docker_dir / '..' / '..' / 'objects').resolve()
+            for obj_dir in user_defined_objects_path.glob('*'):
+                if not obj_dir.is_dir():
+                    continue
+                to_append = f'{obj_dir}:/var/www/MISP/app/files/misp-objects/objects/{obj_dir.name}/:ro'
+                if to_append not in docker_content['services']['misp-core']['volumes']:
+                    docker_content['services']['misp-core']['volumes'].append(to_append)
+
+            # Add user defined taxonomies
+            user_defined_taxonomies_path = (self.misp_docker_dir / '..' / '..' / 'taxonomies').resolve()
+            for tax_dir in user_defined_taxonomies_path.glob('*'):
+                if not tax_dir.is_dir():
+                    continue
+                to_append = f'{tax_dir}:/var/www/MISP/app/files/taxonomies/{tax_dir.name}/:ro'
+                if to_append not in docker_content['services']['misp-core']['volumes']:
+                    docker_content['services']['misp-core']['volumes'].append(to_append)
 
         # Add user defined dashboards
         user_defined_dashboards_path = (self.misp_docker_dir / '..' / '..' / 'dashboards').resolve()
@@ -145,6 +333,22 @@ class MISPDocker():
             # do not bother with the modules
             # docker_content['services'].pop('misp-modules')
 
+        docker_content.setdefault('networks', {})['default'] = {'ipam': {'config': [{'subnet': self.config['subnet']}]}}
+
+        if nginx_upstream_keepalive:
+            # Pool of connections from nginx-proxy to the instance
+            labels = docker_content['services']['misp-core'].get('labels') or {}
+            keepalive_label = 'com.github.nginx-proxy.nginx-proxy.keepalive'
+            if isinstance(labels, dict):
+                labels[keepalive_label] = str(nginx_upstream_keepalive)
+            else:
+                labels = [label for label in labels if not label.startswith(keepalive_label)] + [f'{keepalive_label}={nginx_upstream_keepalive}']
+            docker_content['services']['misp-core']['labels'] = labels
+
+        if shared_services:
+            self._use_shared_services(docker_content)
+        _apply_resource_profile(docker_content['services'], self.config['resource_profile'])
+
         with (self.misp_docker_dir / 'docker-compose.yml').open('w') as f:
             f.write(yaml.dump(docker_content, default_flow_style=False))
 
@@ -169,13 +373,50 @@ class MISPDocker():
         os.chdir(self.misp_docker_dir)
         # check env
         command = shlex.split('sudo cat ./.env')
-        _print_output(command)
+        _print_output(command, self.config['hostname'])
         # Build the dockers
-        command = shlex.split('sudo docker compose pull')
-        p = Popen(command)
-        p.wait()
+        if self.pull:
+            command = shlex.split('sudo docker compose pull')
+            with tracer.span('docker', command_name(command), self.config['hostname']):
+                p = Popen(command)
+                p.wait()
         os.chdir(cur_dir)
 
+    def _use_shared_services(self, docker_content: dict):
+        '''Remove the shared services from the stack and point misp-core to the ones on the internal network'''
+        services = docker_content['services']
+        for service in shared_services:
+            services.pop(service, None)
+        for definition in services.values():
+            depends_on = definition.get('depends_on')
+            if isinstance(depends_on, dict):
+                definition['depends_on'] = {k: v for k, v in depends_on.items() if k not in shared_services}
+            elif isinstance(depends_on, list):
+                definition['depends_on'] = [d for d in depends_on if d not in shared_services]
+            if depends_on is not None and not definition['depends_on']:
+                definition.pop('depends_on')
+
+        misp_core = services['misp-core']
+        if 'misp-modules' in shared_services:
+            _set_environment(misp_core, 'MISP_MODULES_FQDN', f'http://{shared_services_hostnames["misp-modules"]}')
+        if 'db' in shared_services:
+            _set_environment(misp_core, 'MYSQL_HOST', shared_services_hostnames['db'])
+            _set_environment(misp_core, 'MYSQL_DATABASE', self.config['db_name'])
+            _set_environment(misp_core, 'MYSQL_USER', self.config['db_user'])
+            _set_environment(misp_core, 'MYSQL_PASSWORD', self.config['db_password'])
+        if 'redis' in shared_services:
+            _set_environment(misp_core, 'REDIS_HOST', shared_services_hostnames['redis'])
+            # Applied by the entrypoint of misp-core at each start, before the workers
+            script = self.misp_docker_dir / 'redis_databases.sh'
+            script.write_text('#!/bin/bash\n'
+                              '# Generated by init_misps.py: DB indexes of the instance on the shared redis\n'
+                              f'sudo -u www-data /var/www/MISP/app/Console/cake Admin setSetting MISP.redis_database {self.config["redis_database"]}\n'
+                              f'sudo -u www-data /var/www/MISP/app/Console/cake Admin setSetting SimpleBackgroundJobs.redis_database {self.config["redis_database"] + 1}\n')
+            script.chmod(0o755)
+            to_append = f'./{script.name}:/custom/files/customize_misp.sh:ro'
+            if to_append not in misp_core.setdefault('volumes', []):
+                misp_core['volumes'].append(to_append)
+
     def dump_config(self):
         print(json.dumps(self.config, indent=2))
         with (self.misp_docker_dir / 'config.json').open('w') as f:
@@ -190,21 +431,103 @@ class MISPDocker():
     def run(self):
         cur_dir = os.getcwd()
         os.chdir(self.misp_docker_dir)
-        # Run the dockers
-        command = shlex.split('sudo docker compose up -d --force-recreate')
-        _print_output(command)
+        if self.move_network:
+            _print_output(shlex.split('sudo docker compose down'), self.config['hostname'])
+        # Run the dockers (only starts the stopped containers if nothing changed)
+        if self.unchanged:
+            command = shlex.split('sudo docker compose up -d')
+        else:
+            command = shlex.split('sudo docker compose up -d --force-recreate')
+        _print_output(command, self.config['hostname'])
         # Get IP on docker
         # # Get thing to inspect
         command = shlex.split('sudo docker compose ps -q misp-core')
-        p = Popen(command, stdout=PIPE, stderr=PIPE)
-        thing = p.communicate()[0].decode().strip()
+        with tracer.span('docker', command_name(command), self.config['hostname']):
+            p = Popen(command, stdout=PIPE, stderr=PIPE)
+            thing = p.communicate()[0].decode().strip()
         # Yes, 4 {, we need 2 in the output string
         command = shlex.split(f'sudo docker inspect -f "{{{{.NetworkSettings.Networks.{internal_network_name}.IPAddress}}}}"')
         command.append(thing)
-        p = Popen(command, stdout=PIPE, stderr=PIPE)
-        ip = p.communicate()[0].decode().strip()
+        with tracer.span('docker', command_name(command), self.config['hostname']):
+            p = Popen(command, stdout=PIPE, stderr=PIPE)
+            ip = p.communicate()[0].decode().strip()
         os.chdir(cur_dir)
         self.config['external_baseurl'] = f'http://{ip}'
+        self.config['compose_hash'] = self.inputs_hash
+        self.config.pop('pending_compose_hash', None)
+
+
+class SharedServices():
+    '''Stack in <root>/shared with the services shared by all the instances (shared_services in generic_config),
+    generated from the upstream docker-compose.yml of the central node.'''
+
+    def __init__(self, root_dir: Path, template_dir: Path, number_instances: int):
+        self.shared_dir = root_dir / 'shared'
+        self.shared_dir.mkdir(exist_ok=True)
+        self.config_file = self.shared_dir / 'shared_config.json'
+        self.config = {}
+        if self.config_file.exists():
+            with self.config_file.open() as f:
+                self.config = json.load(f)
+        self.config.setdefault('db_root_password', _random_password())
+        with self.config_file.open('w') as f:
+            json.dump(self.config, f, indent=2)
+
+        template = yaml.safe_load(git.Repo(template_dir).git.show('HEAD:docker-compose.yml'))
+        services = {}
+        for service in shared_services:
+            definition = template['services'][service]
+            definition.pop('depends_on', None)
+            definition.pop('ports', None)
+            definition['networks'] = {'misp-test-sync': {'aliases': [shared_services_hostnames[service]]}}
+            services[service] = definition
+        if 'db' in services:
+            _set_environment(services['db'], 'MYSQL_ROOT_PASSWORD', self.config['db_root_password'])
+        if 'redis' in services:
+            # Two indexes per instance (MISP and the background jobs), at least the 16 of the default
+            # configuration: MISP selects 13 until the index of the instance is set
+            databases = ['--databases', str(max(16, _redis_database(number_instances) + 2))]
+            command = services['redis'].get('command')
+            if isinstance(command, str):
+                services['redis']['command'] = f'{command} {" ".join(databases)}'
+            else:
+                services['redis']['command'] = (command or []) + databases
+        docker_content = {'services': services,
+                          'networks': {'misp-test-sync': {'external': {'name': internal_network_name}}}}
+        _apply_resource_profile(services, shared_services_resource_profile)
+        if template.get('volumes'):
+            docker_content['volumes'] = template['volumes']
+        with (self.shared_dir / 'docker-compose.yml').open('w') as f:
+            f.write(yaml.dump(docker_content, default_flow_style=False))
+        # Image names and tags
+        (self.shared_dir / '.env').write_bytes((template_dir / 'template.env').read_bytes())
+
+    def run(self, configs: list[dict]):
+        cur_dir = os.getcwd()
+        os.chdir(self.shared_dir)
+        _print_output(shlex.split('sudo docker compose up -d'), 'shared')
+        if 'db' in shared_services:
+            self._create_schemas(configs)
+        os.chdir(cur_dir)
+
+    def _create_schemas(self, configs: list[dict]):
+        '''One schema and user per instance, before the instances start'''
+        statements = []
+        for config in configs:
+            statements.append(f"CREATE DATABASE IF NOT EXISTS `{config['db_name']}`;")
+            statements.append(f"CREATE USER IF NOT EXISTS '{config['db_user']}'@'%' IDENTIFIED BY '{config['db_password']}';")
+            statements.append(f"GRANT ALL PRIVILEGES ON `{config['db_name']}`.* TO '{config['db_user']}'@'%';")
+        command = ['sudo', 'docker', 'compose', 'exec', '-T', 'db',
+                   'mariadb', '-uroot', f'-p{self.config["db_root_password"]}', '-e', ' '.join(statements)]
+        for _ in range(60):
+            with tracer.span('docker', command_name(command), 'shared'):
+                p = Popen(command, stdout=PIPE, stderr=PIPE)
+                _, err = p.communicate()
+            if p.returncode == 0:
+                return
+            print('Waiting for the shared database:', err.decode().strip())
+            tracer.sleep(5, 'shared')
+        raise Exception('Unable to create the schemas on the shared database.')
 
 
 class MISPDockerManager():
@@ -229,11 +552,12 @@ class MISPDockerManager():
         self.width = len(str(self.number_instances))
         # NOTE: self.misp_dockers[0] is the central node.
         self.misp_dockers = []
+        self.allocator = AddressAllocator(self.misp_instances_dir, self.number_instances)
         self._create_docker_internal_network()
 
     def _create_docker_internal_network(self):
         # Initialize network (does nothing if already existing)
-        command = shlex.split(f'sudo docker network create {self.internal_network_name} --subnet=172.24.0.0/24')
+        command = shlex.split(f'sudo docker network create {self.internal_network_name} --subnet={self.allocator.internal_subnet}')
         _print_output(command)
 
     @property
@@ -243,20 +567,48 @@ class MISPDockerManager():
             for_hostsfile += misp_docker.hostsfile_entry + '\n'
         return for_hostsfile
 
-    def initialize_config_files(self):
+    def initialize_config_files(self, force: bool=False, pull: bool=True, update: bool=False):
         for instance_id in range(self.number_instances + 1):
-            misp_docker = MISPDocker(self.misp_instances_dir, instance_id, self.width, self.url_scheme)
+            misp_docker = MISPDocker(self.misp_instances_dir, instance_id, self.width, self.url_scheme,
+                                     self.allocator, force, pull, update)
             self.misp_dockers.append(misp_docker)
 
+    def stage_config_files(self):
+        '''Keep the containers running, rolling_update.py recreates the instances with a pending change'''
+        for misp_docker in self.misp_dockers:
+            if not misp_docker.unchanged:
+                misp_docker.config['pending_compose_hash'] = misp_docker.inputs_hash
+            misp_docker.dump_config()
+
     def run_dockers(self):
+        if shared_services:
+            shared = SharedServices(self.misp_instances_dir, self.misp_dockers[0].misp_docker_dir, self.number_instances)
+            shared.run([misp_docker.config for misp_docker in self.misp_dockers])
         for misp_docker in self.misp_dockers:
             misp_docker.run()
             misp_docker.dump_config()
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Initialize the MISP dockers.')
+    parser.add_argument('--trace', help='Write a Chrome/Perfetto trace of the docker calls in this file')
+    parser.add_argument('--force', default=False, action='store_true',
+                        help='Regenerate docker-compose.yml and .env, pull the images and recreate the containers even if nothing changed')
+    parser.add_argument('--no_start', default=False, action='store_true',
+                        help='Only regenerate the config files, docker-compose.yml and .env, without pulling the images '
+                             'nor touching the containers. Then run rolling_update.py')
+    parser.add_argument('--update', default=False, action='store_true',
+                        help='Pull the latest misp-docker (templates of docker-compose.yml and .env) in the existing instances first')
+    args = parser.parse_args()
+    if args.trace:
+        tracer.enable(args.trace)
+
     manager = MISPDockerManager()
-    manager.initialize_config_files()
+    manager.initialize_config_files(args.force, pull=not args.no_start, update=args.update)
+    if args.no_start:
+        manager.stage_config_files()
+        print('Config files generated, run rolling_update.py to apply them.')
+        sys.exit(0)
     manager.run_dockers()
 
     print('Entries for /etc/hosts:')
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Host-side cache of the MISP JSON metadata (objects, galaxies, taxonomies, warninglists, noticelists).
+
+The upstream repositories are fetched once in metadata/repositories, and each new combination of their commits and of the
+custom objects/taxonomies of this repository becomes a read-only version in metadata/<version>. init_misps.py mounts
+the current version in all the containers, MISPInstance.update_all_json only imports it on the nodes that didn't yet.'''
+
+import argparse
+import hashlib
+import json
+import shutil
+
+from pathlib import Path
+from typing import Optional
+
+import git
+
+root_dir = Path(__file__).resolve().parent
+metadata_dir = root_dir / 'metadata'
+
+# Name in the cache: upstream repository
+metadata_repositories = {
+    'misp-objects': 'https://github.com/MISP/misp-objects.git',
+    'misp-galaxy': 'https://github.com/MISP/misp-galaxy.git',
+    'taxonomies': 'https://github.com/MISP/misp-taxonomies.git',
+    'warninglists': 'https://github.com/MISP/misp-warninglists.git',
+    'noticelists': 'https://github.com/MISP/misp-noticelist.git',
+}
+# Name in the cache: path in the misp-core container
+metadata_mounts = {
+    'misp-objects': '/var/www/MISP/app/files/misp-objects',
+    'misp-galaxy': '/var/www/MISP/app/files/misp-galaxy',
+    'taxonomies': '/var/www/MISP/app/files/taxonomies',
+    'warninglists': '/var/www/MISP/app/files/warninglists',
+    'noticelists': '/var/www/MISP/app/files/noticelists',
+}
+# Custom directories of this repository merged in the cache: directory in the cache
+custom_metadata = {
+    'objects': 'misp-objects/objects',
+    'taxonomies': 'taxonomies',
+}
+
+
+def current_version() -> Optional[str]:
+    '''Version to mount, None if there is no cache'''
+    if not (metadata_dir / 'VERSION.json').exists():
+        return None
+    with (metadata_dir / 'VERSION.json').open() as f:
+        return json.load(f)['version']
+
+
+def fetch_repositories() -> dict[str, str]:
+    '''Clone or pull the repositories, returns their commits'''
+    commits = {}
+    for name, url in metadata_repositories.items():
+        repo_dir = metadata_dir / 'repositories' / name
+        if repo_dir.exists():
+            repo = git.Repo(repo_dir)
+            repo.remote('origin').pull(rebase='false')
+        else:
+            repo = git.repo.base.Repo.clone_from(url, str(repo_dir), depth=1)
+        commits[name] = repo.head.commit.hexsha
+        print(f'{name}: {commits[name]}')
+    return commits
+
+
+def custom_files() -> list[Path]:
+    return sorted(path for directory in custom_metadata for path in (root_dir / directory).rglob('*') if path.is_file())
+
+
+def update_cache(keep: int=2) -> str:
+    metadata_dir.mkdir(exist_ok=True)
+    commits = fetch_repositories()
+    version_hash = hashlib.sha256(json.dumps(commits, sort_keys=True).encode())
+    for path in custom_files():
+        version_hash.update(str(path.relative_to(root_dir)).encode())
+        version_hash.update(path.read_bytes())
+    version = version_hash.hexdigest()[:16]
+
+    version_dir = metadata_dir / version
+    if not version_dir.exists():
+        tmp_dir = metadata_dir / f'.{version}.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        for name in metadata_repositories:
+            shutil.copytree(metadata_dir / 'repositories' / name, tmp_dir / name, ignore=shutil.ignore_patterns('.git'))
+        for directory, destination in custom_metadata.items():
+            for custom_dir in (root_dir / directory).glob('*'):
+                if custom_dir.is_dir():
+                    shutil.copytree(custom_dir, tmp_dir / destination / custom_dir.name, dirs_exist_ok=True)
+        tmp_dir.rename(version_dir)
+
+    versions = {}
+    if (metadata_dir / 'VERSION.json').exists():
+        with (metadata_dir / 'VERSION.json').open() as f:
+            versions = json.load(f)
+    history = [v for v in versions.get('history', []) if v != version] + [version]
+    # The versions still mounted by containers that weren't recreated yet are kept
+    for old in history[:-keep]:
+        shutil.rmtree(metadata_dir / old, ignore_errors=True)
+    with (metadata_dir / 'VERSION.json').open('w') as f:
+        json.dump({'version': version, 'commits': commits, 'history': history[-keep:]}, f, indent=2)
+    return version
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fetch the MISP JSON metadata once for all the instances.',
+                                     epilog='Then run init_misps.py to mount the new version and update_jsons.py to import it.')
+    parser.add_argument('--keep', type=int, default=2, help='Number of versions to keep in the cache')
+    args = parser.parse_args()
+    print('Current version:', update_cache(args.keep))
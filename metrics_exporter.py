@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Prometheus metrics for all the instances, served on http://<bind>:<port>/metrics.
+Every collector is cached per node with its own TTL, a scrape only refreshes the expired ones.
+The nodes are queried with plain HTTP requests and a timeout (api_helpers): a node that is down doesn't block the
+exporter nor the scrapes. The sync collector (one connection test per sync server) is refreshed in the background.'''
+
+import argparse
+import json
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable
+
+from api_helpers import NodeStatus
+from config_helpers import config_files
+from generic_config import max_concurrent_nodes
+
+# (name, labels, value)
+Sample = tuple[str, dict[str, str], float]
+
+metrics_help = {
+    'misp_up': ('gauge', 'The API answered'),
+    'misp_api_latency_seconds': ('gauge', 'Time to get the version of the instance'),
+    'misp_info': ('gauge', 'Version of the instance'),
+    'misp_events': ('gauge', 'Number of events'),
+    'misp_attributes': ('gauge', 'Number of attributes'),
+    'misp_users': ('gauge', 'Number of users'),
+    'misp_organisations': ('gauge', 'Number of organisations'),
+    'misp_workers': ('gauge', 'Number of workers alive, per queue'),
+    'misp_queue_jobs': ('gauge', 'Number of jobs in the queue'),
+    'misp_queue_ok': ('gauge', 'The queue is healthy'),
+    'misp_sync_server_up': ('gauge', 'The connection test to the sync server succeeded'),
+    'misp_last_push_timestamp_seconds': ('gauge', 'End of the last push triggered by the tooling'),
+    'misp_last_push_duration_seconds': ('gauge', 'Duration of the last push triggered by the tooling'),
+    'misp_collector_errors': ('gauge', 'The last run of the collector failed'),
+}
+
+
+class NodeMetrics(NodeStatus):
+    '''The connection is only opened by the first collector'''
+
+    def __init__(self, config_file: Path, timeout: float):
+        self.config_file = config_file
+        with config_file.open() as f:
+            super().__init__(json.load(f), timeout)
+
+
+def collect_api(node: NodeMetrics) -> list[Sample]:
+    start = time.time()
+    version = node.call('servers/getVersion')
+    latency = time.time() - start
+    if 'version' not in version:
+        return [('misp_up', {}, 0)]
+    return [('misp_up', {}, 1), ('misp_api_latency_seconds', {}, latency),
+            ('misp_info', {'version': version['version']}, 1)]
+
+
+def collect_stats(node: NodeMetrics) -> list[Sample]:
+    stats = node.call('users/statistics/data')['stats']
+    return [('misp_events', {}, float(stats['event_count'])),
+            ('misp_attributes', {}, float(stats['attribute_count'])),
+            ('misp_users', {}, float(stats['user_count'])),
+            ('misp_organisations', {}, float(stats['org_count']))]
+
+
+def collect_workers(node: NodeMetrics) -> list[Sample]:
+    samples: list[Sample] = []
+    for queue, details in node.call('servers/getWorkers').items():
+        if not isinstance(details, dict) or 'workers' not in details:
+            continue
+        workers = details['workers'] if isinstance(details['workers'], list) else []
+        samples.append(('misp_workers', {'queue': queue}, len([w for w in workers if w.get('ok')])))
+        samples.append(('misp_queue_jobs', {'queue': queue}, float(details.get('jobCount', 0))))
+        samples.append(('misp_queue_ok', {'queue': queue}, 1 if details.get('ok') else 0))
+    return samples
+
+
+def collect_sync(node: NodeMetrics) -> list[Sample]:
+    servers = node.call('servers/index')
+    if not servers:
+        return []
+
+    def test(server: dict[str, Any]) -> Sample:
+        try:
+            ok = node.call(f'servers/testConnection/{server["Server"]["id"]}', post=True).get('status') == 1
+        except Exception:
+            ok = False
+        return ('misp_sync_server_up', {'server': server['Server']['name']}, 1 if ok else 0)
+    # Each test is a round trip to the remote node, the central node has one server per client node
+    with ThreadPoolExecutor(max_workers=min(len(servers), max_concurrent_nodes)) as executor:
+        return list(executor.map(test, servers))
+
+
+def collect_push(node: NodeMetrics) -> list[Sample]:
+    # Written by sync_push_all / sync_push_changed, possibly in another process.
+    with node.config_file.open() as f:
+        config = json.load(f)
+    if 'last_push' not in config:
+        return []
+    return [('misp_last_push_timestamp_seconds', {}, config['last_push']),
+            ('misp_last_push_duration_seconds', {}, config['last_push_duration'])]
+
+
+# name: (collector, default TTL in seconds)
+collectors: dict[str, tuple[Callable[[NodeMetrics], list[Sample]], int]] = {
+    'api': (collect_api, 15),
+    'stats': (collect_stats, 60),
+    'workers': (collect_workers, 30),
+    'sync': (collect_sync, 300),
+    'push': (collect_push, 15),
+}
+# Too slow for a scrape: refreshed by a background thread, the scrapes only read the cache
+background_collectors = ['sync']
+
+
+class MetricsCache():
+
+    def __init__(self, nodes: dict[str, NodeMetrics], ttls: dict[str, int]):
+        self.nodes = nodes
+        self.ttls = ttls
+        # (node, collector) -> (last update, samples)
+        self.cache: dict[tuple[str, str], tuple[float, list[Sample]]] = {}
+        self.locks = {(name, collector): threading.Lock() for name in self.nodes for collector in collectors}
+
+    def refresh_node(self, name: str, node: NodeMetrics, names: list[str]):
+        for collector in names:
+            func, _ = collectors[collector]
+            # A collector is refreshed by one scrape at a time, the other ones use the cache.
+            with self.locks[(name, collector)]:
+                last_update, _samples = self.cache.get((name, collector), (0, []))
+                if time.time() - last_update < self.ttls[collector]:
+                    continue
+                try:
+                    samples = func(node) + [('misp_collector_errors', {'collector': collector}, 0)]
+                except Exception as e:
+                    print(f'Collector {collector} failed on {name}: {e}')
+                    samples = [('misp_collector_errors', {'collector': collector}, 1)]
+                    if collector == 'api':
+                        samples.append(('misp_up', {}, 0))
+                self.cache[(name, collector)] = (time.time(), samples)
+
+    def refresh(self, names: list[str]):
+        with ThreadPoolExecutor(max_workers=max(min(max_concurrent_nodes, len(self.nodes)), 1)) as executor:
+            for name, node in self.nodes.items():
+                executor.submit(self.refresh_node, name, node, names)
+
+    def refresh_background(self, interval: float):
+        while True:
+            self.refresh(background_collectors)
+            time.sleep(interval)
+
+    def render(self) -> str:
+        self.refresh([collector for collector in collectors if collector not in background_collectors])
+        by_metric: dict[str, list[str]] = {}
+        # Copy: the background thread may add entries
+        for (name, collector), (_, samples) in list(self.cache.items()):
+            for metric, labels, value in samples:
+                labels = {'node': name, **labels}
+                label_str = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels.items())
+                by_metric.setdefault(metric, []).append(f'{metric}{{{label_str}}} {value}')
+        lines: list[str] = []
+        for metric, values in sorted(by_metric.items()):
+            metric_type, help_text = metrics_help.get(metric, ('gauge', ''))
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} {metric_type}')
+            lines += values
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    cache: MetricsCache
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        content = self.cache.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve Prometheus metrics for all the instances.')
+    parser.add_argument('--root', default='misps', help='Directory with the config files of the instances')
+    parser.add_argument('--bind', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9120)
+    parser.add_argument('--timeout', type=float, default=5, help='Timeout of each API call, in seconds')
+    parser.add_argument('--ttl', nargs='*', default=[],
+                        help=f'Override the cache TTL of a collector, ex. "sync=600". Collectors: {", ".join(collectors)}')
+    args = parser.parse_args()
+
+    ttls: dict[str, Any] = {name: ttl for name, (_, ttl) in collectors.items()}
+    for override in args.ttl:
+        name, ttl = override.split('=')
+        ttls[name] = int(ttl)
+
+    # Read only: everything goes through the admin key from config.json, nothing is contacted before the first scrape
+    nodes = {}
+    for config_file in config_files(Path(__file__).resolve().parent / args.root):
+        # The central node is listed even before it is initialized
+        if config_file.exists():
+            node = NodeMetrics(config_file, args.timeout)
+            nodes[node.config['admin_orgname']] = node
+    MetricsHandler.cache = MetricsCache(nodes, ttls)
+    threading.Thread(target=MetricsHandler.cache.refresh_background, args=(5,), daemon=True).start()
+    httpd = ThreadingHTTPServer((args.bind, args.port), MetricsHandler)
+    print(f'Serving metrics on http://{args.bind}:{args.port}/metrics')
+    httpd.serve_forever()
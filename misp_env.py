@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''One entry point for the day-to-day commands: ./misp-env <command> (or ./misp_env.py <command>).
+
+"misp-env daemon" connects to all the nodes once and keeps the connections: the other commands are then run by the
+daemon, through a Unix socket in the root directory, instead of importing PyMISP and connecting to every node again.
+Without a daemon, the commands run in the current process. "misp-env reload" reconnects the daemon to the nodes
+(ex. after init_misps.py).'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+root_dir = Path(__file__).resolve().parent
+socket_name = '.misp-env.sock'
+
+
+def socket_path(root: str) -> Path:
+    return root_dir / root / socket_name
+
+
+# # Commands: func(instances, args), the MISPInstances is None for the ones that don't need it
+
+def cmd_status(instances, args):
+    from status import status
+    for result in status(root_dir / args.root, args.timeout, args.test_connections):
+        latency = f'{result["latency"] * 1000:.0f}ms' if 'latency' in result else ''
+        print(f'{result["node"]:<20} {result["containers"]:<24} {result["api"]:<16} {latency:>6} {result.get("version", ""):<8} '
+              f'{result.get("workers", "")}')
+
+
+def cmd_timeouts(instances, args):
+    instances.run_concurrently(lambda node: node.change_session_timeout(args.timeout))
+    print(f'Session timeout set to {args.timeout} on {len(instances.all_nodes)} node(s)')
+
+
+def cmd_update_jsons(instances, args):
+    instances.run_concurrently(lambda node: node.update_all_json(args.force))
+
+
+def cmd_reset_password(instances, args):
+    nodes = instances.all_nodes
+    if args.node:
+        if args.node not in nodes:
+            raise Exception(f'Available instances: {list(nodes)}')
+        nodes = {args.node: nodes[args.node]}
+    instances.run_concurrently(lambda node: node.init_default_user(args.email), nodes)
+    print(f'{args.email} created/updated on {", ".join(nodes)}')
+
+
+def cmd_cleanup(instances, args):
+    instances.cleanup_all_blacklisted_event()
+
+
+def cmd_push(instances, args):
+    if args.changed_only:
+        instances.sync_push_changed()
+    else:
+        instances.sync_push_all()
+
+
+def cmd_feeds(instances, args):
+    instances.dump_all_events()
+    print(f'Feeds in {instances.misp_instances_dir / "feeds"}')
+
+
+def cmd_stats(instances, args):
+    from stats_store import StatsStore
+    stored = instances.collect_stats(StatsStore(instances.misp_instances_dir / args.store), args.contexts)
+    print(f'{stored} samples stored')
+
+
+def cmd_call(instances, args):
+    payload = json.loads(args.data) if args.data else None
+    results = instances.broadcast(args.url, payload, args.nodes, args.stop_on_failure)
+    print(f'{"Node":<30} {"status":<8} {"latency (s)":>11}  response')
+    for name, result in results.items():
+        response = json.dumps(result['response'], default=str)
+        print(f'{name:<30} {result["status"]:<8} {result["latency"]:>11.2f}  {response[:80]}')
+
+
+commands: dict[str, Callable[[Any, argparse.Namespace], None]] = {
+    'status': cmd_status,
+    'timeouts': cmd_timeouts,
+    'update-jsons': cmd_update_jsons,
+    'reset-password': cmd_reset_password,
+    'cleanup': cmd_cleanup,
+    'push': cmd_push,
+    'feeds': cmd_feeds,
+    'stats': cmd_stats,
+    'call': cmd_call,
+}
+
+
+def setup_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='misp-env', description='Manage the MISP instances of the training environment.',
+                                     epilog=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--root', default='misps', help='Directory with the config files of the instances')
+    parser.add_argument('--local', action='store_true', help='Do not use the daemon')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add(name: str, help: str, needs_instances: bool=True) -> argparse.ArgumentParser:
+        subparser = subparsers.add_parser(name, help=help, description=help)
+        subparser.set_defaults(needs_instances=needs_instances)
+        return subparser
+
+    daemon = add('daemon', 'Keep the connections to all the nodes open and run the commands sent on the socket')
+    daemon.add_argument('--stop', action='store_true', help='Stop the running daemon')
+    add('reload', 'Reconnect the daemon to the nodes (new nodes, new keys)')
+    status = add('status', 'Containers, API, version and workers of all the nodes (read only)', needs_instances=False)
+    status.add_argument('--timeout', type=float, default=2, help='Timeout of each API call, in seconds')
+    status.add_argument('--test_connections', action='store_true', help='Test the connection of each sync server')
+    timeouts = add('timeouts', 'Set the session timeout on all the nodes')
+    timeouts.add_argument('--timeout', type=int, default=300, help='Session timeout, in minutes')
+    update_jsons = add('update-jsons', 'Import the JSON metadata (objects, galaxies, taxonomies, ...) on all the nodes')
+    update_jsons.add_argument('--force', action='store_true', help='Even if the metadata cache version was already imported')
+    reset_password = add('reset-password', 'Reset the password of a user / create the user')
+    reset_password.add_argument('-e', '--email', required=True, help='Email address of the user, login name')
+    reset_password.add_argument('--node', help='Name of the admin org of the node (default: all the nodes)')
+    add('cleanup', 'Delete the blocklisted events on all the nodes')
+    push = add('push', 'Push the sync-tagged events (or distribute the feed of the central node)')
+    push.add_argument('--changed_only', action='store_true', help='Only push the events published since the last run')
+    add('feeds', 'Export the events of all the nodes as MISP feeds')
+    stats = add('stats', 'Collect the statistics of all the nodes once')
+    stats.add_argument('--store', default='stats/stats.jsonl', help='Path of the store, relative to the root directory')
+    stats.add_argument('--contexts', nargs='+', default=['data'], help='Statistics to collect')
+    call = add('call', 'Send the same API call to all the nodes, concurrently')
+    call.add_argument('url', help='Path of the API endpoint, ${orgname}, ${hostname} and ${baseurl} are replaced')
+    call.add_argument('-d', '--data', help='JSON payload (POST), default: GET')
+    call.add_argument('--nodes', nargs='+', help='Name of the admin org of the nodes to call (default: all)')
+    call.add_argument('--stop_on_failure', action='store_true', help='Do not call the remaining nodes after a failure')
+    return parser
+
+
+# # Daemon
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    server: 'DaemonServer'
+
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        output = io.StringIO()
+        error = None
+        # One command at a time: the output of the command is the stdout of the daemon
+        with self.server.lock, contextlib.redirect_stdout(output):
+            try:
+                if request['command'] == 'daemon':
+                    threading.Thread(target=self.server.shutdown).start()
+                    print('Daemon stopped')
+                elif request['command'] == 'reload':
+                    self.server.connect()
+                else:
+                    args = argparse.Namespace(**request['args'])
+                    commands[request['command']](self.server.instances, args)
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+        self.wfile.write(json.dumps({'output': output.getvalue(), 'error': error}).encode())
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, root: str):
+        self.root = root
+        self.lock = threading.Lock()
+        self.instances: Any = None
+        self.connect()
+        path = socket_path(root)
+        path.unlink(missing_ok=True)
+        super().__init__(str(path), CommandHandler)
+        # Admin access to all the nodes
+        os.chmod(path, 0o600)
+
+    def connect(self):
+        from misp_instances import MISPInstances
+        start = time.time()
+        self.instances = MISPInstances(root_misps=self.root, bootstrap=False)
+        print(f'Connected to {len(self.instances.all_nodes)} node(s) in {time.time() - start:.1f}s')
+
+
+def send(root: str, command: str, args: dict[str, Any]) -> Optional[dict[str, Any]]:
+    '''Run the command in the daemon, None if there is no daemon'''
+    path = socket_path(root)
+    if not path.exists():
+        return None
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(str(path))
+        except (ConnectionRefusedError, FileNotFoundError):
+            # Left by a daemon that didn't stop cleanly
+            return None
+        s.sendall(json.dumps({'command': command, 'args': args}).encode() + b'\n')
+        s.shutdown(socket.SHUT_WR)
+        response = b''
+        while chunk := s.recv(65536):
+            response += chunk
+    return json.loads(response)
+
+
+def main():
+    args = setup_parser().parse_args()
+    if args.command == 'daemon' and not args.stop:
+        server = DaemonServer(args.root)
+        print(f'Listening on {socket_path(args.root)}')
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            socket_path(args.root).unlink(missing_ok=True)
+        return
+
+    if not args.local and (args.needs_instances or args.command == 'daemon'):
+        response = send(args.root, args.command, vars(args))
+        if response is not None:
+            print(response['output'], end='')
+            if response['error']:
+                print(response['error'], file=sys.stderr)
+                sys.exit(1)
+            return
+    if args.command in ['daemon', 'reload']:
+        print('No daemon running.')
+        return
+
+    instances = None
+    if args.needs_instances:
+        from misp_instances import MISPInstances
+        instances = MISPInstances(root_misps=args.root, bootstrap=False)
+    commands[args.command](instances, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,18 +6,23 @@ import os
 import random
 import shlex
 import string
+import threading
 import time
 
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import Popen, PIPE
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Optional
 
-from pymisp import PyMISP, MISPUser, MISPTag, MISPOrganisation, MISPSharingGroup, MISPEvent
+from pymisp import PyMISP, MISPUser, MISPTag, MISPOrganisation, MISPSharingGroup, MISPEvent, MISPFeed
 
-from generic_config import (central_node_name, prefix_client_node, secure_connection,
+from generic_config import (central_node_name, prefix_client_node, hostname_suffix, secure_connection,
                             internal_network_name, enabled_taxonomies, enabled_taxonomies_central_node,
                             unpublish_on_sync, tag_central_to_nodes, tag_nodes_to_central, local_tags_central,
-                            reserved_tags_central, local_tags_clients, central_node_server_settings)
+                            reserved_tags_central, local_tags_clients, central_node_server_settings,
+                            max_concurrent_nodes, central_distribution, central_feed_name, central_feed_location)
+from stats_store import StatsStore
+from tracing import tracer, command_name, TracedPyMISP
 
 
 def create_or_update_site_admin(connector: PyMISP, user: MISPUser) -> MISPUser:
@@ -35,11 +40,23 @@ def create_or_update_site_admin(connector: PyMISP, user: MISPUser) -> MISPUser:
         raise Exception(f'Unable to create {user.email}: {to_return_user}')
 
 
+def render_template(value: Any, variables: dict[str, str]) -> Any:
+    '''Substitute ${orgname}, ${hostname}, ... in all the strings of a (JSON) payload'''
+    if isinstance(value, str):
+        return string.Template(value).safe_substitute(variables)
+    if isinstance(value, list):
+        return [render_template(v, variables) for v in value]
+    if isinstance(value, dict):
+        return {render_template(k, variables): render_template(v, variables) for k, v in value.items()}
+    return value
+
+
 class MISPInstance():
     owner_orgname: str
     site_admin: PyMISP
     _owner_site_admin: Optional[PyMISP] = None
     _owner_orgadmin: Optional[PyMISP] = None
+    _misp_container_name: Optional[str] = None
 
     @property
     def host_org(self) -> MISPOrganisation:
@@ -81,12 +98,12 @@ class MISPInstance():
             self.config['site_admin_password'] = user.password
         while True:
             try:
-                self._owner_site_admin = PyMISP(self.baseurl, user.authkey,  # type: ignore
-                                                ssl=secure_connection, debug=False, timeout=300)
+                self._owner_site_admin = TracedPyMISP(self.baseurl, user.authkey,  # type: ignore
+                                                      ssl=secure_connection, debug=False, timeout=300, node=self.hostname)
                 break
             except Exception as e:
                 print(e)
-                time.sleep(5)
+                tracer.sleep(5, self.hostname)
         self._owner_site_admin.toggle_global_pythonify()
         if dump_config:
             with self.config_file.open('w') as f:
@@ -129,19 +146,21 @@ class MISPInstance():
         # This user might have been disabled by the users
         while True:
             try:
-                self._owner_orgadmin = PyMISP(self.baseurl, user.authkey,  # type: ignore
-                                              ssl=secure_connection, debug=False, timeout=300)
+                self._owner_orgadmin = TracedPyMISP(self.baseurl, user.authkey,  # type: ignore
+                                                    ssl=secure_connection, debug=False, timeout=300, node=self.hostname)
                 break
             except Exception as e:
                 print(f'Unable to connect to {self.baseurl}', e)
-                time.sleep(5)
+                tracer.sleep(5, self.hostname)
         self._owner_orgadmin.toggle_global_pythonify()
         if dump_config:
             with self.config_file.open('w') as f:
                 json.dump(self.config, f, indent=2)
         return self._owner_orgadmin
 
-    def __init__(self, config_file: Path, force_reset_passwords: bool=False):
+    def __init__(self, config_file: Path, force_reset_passwords: bool=False, bootstrap: bool=True):
+        '''If bootstrap is False, only connect as site admin and skip the setup of the instance. The owner site admin
+        (and its key in the config file) is still created on first use of owner_site_admin if it doesn't exist.'''
         self.config_file = config_file
         self.force_reset_passwords = force_reset_passwords
         self.docker_compose_root = self.config_file.parent
@@ -152,26 +171,20 @@ class MISPInstance():
         self.hostname = self.config['hostname']
         while True:
             try:
-                self.site_admin = PyMISP(self.baseurl, self.config['admin_key'],
-                                         ssl=secure_connection, debug=False, timeout=300)
+                self.site_admin = TracedPyMISP(self.baseurl, self.config['admin_key'],
+                                               ssl=secure_connection, debug=False, timeout=300, node=self.hostname)
                 break
             except Exception as e:
                 print(f'Unable to connect to {self.baseurl}', e)
                 print("##################### Please wait #####################")
-                time.sleep(5)
+                tracer.sleep(5, self.hostname)
 
         self.site_admin.toggle_global_pythonify()
+        if not bootstrap:
+            return
         admin_user = self.site_admin.get_user()
         self.site_admin.update_user({'change_pw': 0}, admin_user.id)  # type: ignore
 
-        # Get container name
-        cur_dir = os.getcwd()
-        os.chdir(self.docker_compose_root)
-        command = shlex.split('sudo docker compose ps -q misp-core')
-        p = Popen(command, stdout=PIPE, stderr=PIPE)
-        self.misp_container_name = p.communicate()[0].decode().strip()
-        os.chdir(cur_dir)
-
         # Make sure the external baseurl is set
         self.update_external_baseurl(force=True)
         # init the orgadmin (not site) user
@@ -189,14 +202,22 @@ class MISPInstance():
         self.owner_site_admin.set_server_setting('MISP.host_org_id', self.host_org.id)
         # self.owner_site_admin.set_server_setting('Security.rest_client_baseurl', 'http://127.0.0.1')
         self.change_session_timeout(6000)
+        if self.config.get('redis_database') is not None:
+            self.use_redis_databases(self.config['redis_database'])
+
+    @property
+    def misp_container_name(self) -> str:
+        if not self._misp_container_name:
+            outs, errs = self.pass_command_to_docker('sudo docker compose ps -q misp-core')
+            self._misp_container_name = outs.decode().strip()
+        return self._misp_container_name
 
     def pass_command_to_docker(self, command):
-        cur_dir = os.getcwd()
-        os.chdir(self.docker_compose_root)
+        # No os.chdir: the instances are handled in threads, the working directory is shared by the process
         c = shlex.split(command)
-        p = Popen(c, stdout=PIPE, stderr=PIPE)
-        to_return = p.communicate()
-        os.chdir(cur_dir)
+        with tracer.span('docker', command_name(c), self.hostname):
+            p = Popen(c, stdout=PIPE, stderr=PIPE, cwd=self.docker_compose_root)
+            to_return = p.communicate()
         return to_return
 
     def copy_file(self, src, dst):
@@ -231,13 +252,31 @@ class MISPInstance():
     def direct_call(self, url_path, payload=None):
         return self.owner_site_admin.direct_call(url_path, payload)
 
+    @property
+    def template_variables(self) -> dict[str, str]:
+        return {'orgname': self.owner_orgname, 'hostname': self.hostname, 'baseurl': self.baseurl}
+
+    def use_redis_databases(self, index: int):
+        '''With a shared redis, each instance uses its own pair of DB indexes (MISP and background jobs)'''
+        current = self.owner_site_admin.get_server_setting('MISP.redis_database')
+        if str(current.get('value')) == str(index):  # type: ignore
+            return
+        self.owner_site_admin.set_server_setting('MISP.redis_database', index, force=True)
+        self.owner_site_admin.set_server_setting('SimpleBackgroundJobs.redis_database', index + 1, force=True)
+        self.owner_site_admin.restart_workers()
+
     def update_misp(self):
         print('Not Updatable')
         # response = self.owner_site_admin.update_misp()
         # if response['results'][0]['status'] != 0:
         #    print(json.dumps(response, indent=2))
 
-    def update_all_json(self):
+    def update_all_json(self, force: bool=False):
+        '''With the metadata cache (metadata_cache.py), only import when the mounted version wasn't imported yet'''
+        cache_version = self.config.get('metadata_cache_version')
+        if not force and cache_version and self.config.get('metadata_version') == cache_version:
+            print(f'{self}: metadata {cache_version} already imported')
+            return
         while True:
             try:
                 self.owner_site_admin.update_object_templates()
@@ -248,11 +287,66 @@ class MISPInstance():
                 break
             except Exception as e:
                 print(f'Unable to update something: {e}')
-                time.sleep(5)
+                tracer.sleep(5, self.hostname)
+        if cache_version:
+            self.config['metadata_version'] = cache_version
+            with self.config_file.open('w') as f:
+                json.dump(self.config, f, indent=2)
+
+    def _record_push(self, start: float):
+        '''Keep track of the last push in the config file (used by the metrics exporter)'''
+        self.config['last_push'] = time.time()
+        self.config['last_push_duration'] = self.config['last_push'] - start
+        with self.config_file.open('w') as f:
+            json.dump(self.config, f, indent=2)
 
     def sync_push_all(self):
+        start = time.time()
         for server in self.owner_site_admin.servers():
             self.owner_site_admin.server_push(server)
+        self._record_push(start)
+
+    def sync_push_changed(self, from_central_node: bool=False) -> int:
+        '''Push only the sync-tagged events published since the last call, one by one.
+        Only the tags pushed by this node (like in configure_sync): the central node doesn't look at the events it got from the clients.
+        Returns the number of events pushed, the node is not touched if nothing changed.'''
+        last_timestamp = self.config.get('sync_push_timestamp', 0)
+        # uuids already pushed with publish_timestamp == last_timestamp (the filter is inclusive)
+        last_uuids = set(self.config.get('sync_push_uuids', []))
+        start = time.time()
+        events = self.owner_site_admin.search(metadata=True, published=True,  # type: ignore
+                                              tags=tag_central_to_nodes if from_central_node else tag_nodes_to_central,
+                                              publish_timestamp=last_timestamp if last_timestamp else None)
+        to_push = []
+        for event in events:
+            published = int(event.publish_timestamp.timestamp())  # type: ignore
+            if published == last_timestamp and event.uuid in last_uuids:  # type: ignore
+                continue
+            to_push.append((published, event))
+        if not to_push:
+            return 0
+
+        servers = self.owner_site_admin.servers()
+        pushed = 0
+        for published, event in sorted(to_push, key=lambda p: p[0]):
+            try:
+                results = [self.owner_site_admin.server_push(server, event) for server in servers]  # type: ignore
+                errors = [r['errors'] for r in results if isinstance(r, dict) and 'errors' in r]
+            except Exception as e:
+                errors = [e]
+            if errors:
+                # The mark stays before this event: it is pushed again on the next call, with the ones after it
+                print(f'{self}: push of {event.uuid} failed, retried on the next call: {errors[0]}')  # type: ignore
+                break
+            if published > last_timestamp:
+                last_timestamp = published
+                last_uuids = set()
+            last_uuids.add(event.uuid)  # type: ignore
+            self.config['sync_push_timestamp'] = last_timestamp
+            self.config['sync_push_uuids'] = sorted(last_uuids)
+            pushed += 1
+        self._record_push(start)
+        return pushed
 
     def delete_events(self, events):
         for e in events:
@@ -348,6 +442,104 @@ class MISPInstance():
         with (feed_dir / 'manifest.json').open('w') as manifest_file:
             json.dump(manifest, manifest_file, indent=2)
 
+    def export_feed(self, feed_dir: Path, tags: list[str], full: bool=False) -> int:
+        '''Add the events with one of the tags, published since the last call (all of them if full), to the static
+        feed in feed_dir, and remove the ones deleted or without the tags anymore. Like sync_push_changed, but the work
+        doesn't depend on the number of nodes fetching the feed.
+        Returns the number of events exported or removed.'''
+        start = time.time()
+        feed_dir.mkdir(parents=True, exist_ok=True)
+        last_timestamp = 0 if full else self.config.get('feed_export_timestamp', 0)
+        last_uuids = set() if full else set(self.config.get('feed_export_uuids', []))
+        manifest = {}
+        if not full and (feed_dir / 'manifest.json').exists():
+            with (feed_dir / 'manifest.json').open() as f:
+                manifest = json.load(f)
+        hashes: dict[str, list[str]] = {}
+        if not full and (feed_dir / 'hashes.csv').exists():
+            with (feed_dir / 'hashes.csv').open() as f:
+                for line in f:
+                    h, event_uuid = line.strip().split(',')
+                    hashes.setdefault(event_uuid, []).append(h)
+
+        def _write(name: str, write):
+            # nginx serves the feed while it is written
+            tmp_path = feed_dir / f'.{name}.tmp'
+            with tmp_path.open('w') as f:
+                write(f)
+            os.replace(tmp_path, feed_dir / name)
+
+        # All the events with the tags (metadata only): the new ones are exported, the ones of the feed not listed
+        # anymore are removed (the nodes keep their copy, they just don't get it from the feed)
+        events = self.owner_site_admin.search(metadata=True, tags=tags)  # type: ignore
+        listed = {event.uuid for event in events}  # type: ignore
+        removed = [event_uuid for event_uuid in set(manifest) | set(hashes) if event_uuid not in listed]
+        for event_uuid in removed:
+            manifest.pop(event_uuid, None)
+            hashes.pop(event_uuid, None)
+        if full:
+            removed += [path.stem for path in feed_dir.glob('*.json')
+                        if path.name != 'manifest.json' and path.stem not in listed]
+        exported = 0
+        for event in sorted((e for e in events if e.published and e.publish_timestamp), key=lambda e: e.publish_timestamp):  # type: ignore
+            published = int(event.publish_timestamp.timestamp())  # type: ignore
+            if published < last_timestamp:
+                continue
+            if published == last_timestamp and event.uuid in last_uuids:  # type: ignore
+                continue
+            e: MISPEvent = self.owner_site_admin.get_event(event.uuid, pythonify=True)  # type: ignore
+            # Local tags and distribution are not sent by the sync either
+            e_feed = e.to_feed(with_meta=True, with_local_tags=False, with_event_reports=True)
+            hashes[e.uuid] = e_feed['Event'].pop('_hashes')  # type: ignore
+            manifest.update(e_feed['Event'].pop('_manifest'))
+            _write(f'{e.uuid}.json', lambda f: json.dump(e_feed, f))
+            exported += 1
+            if published > last_timestamp:
+                last_timestamp = published
+                last_uuids = set()
+            last_uuids.add(e.uuid)
+        if not exported and not removed and not full:
+            return 0
+        _write('hashes.csv', lambda f: f.writelines(f'{h},{event_uuid}\n' for event_uuid, event_hashes in hashes.items()
+                                                    for h in event_hashes))
+        # Last, the nodes fetch the events listed in the manifest
+        _write('manifest.json', lambda f: json.dump(manifest, f))
+        # Not in the manifest anymore, nobody fetches them
+        for event_uuid in set(removed):
+            (feed_dir / f'{event_uuid}.json').unlink(missing_ok=True)
+        self.config['feed_export_timestamp'] = last_timestamp
+        self.config['feed_export_uuids'] = sorted(last_uuids)
+        self._record_push(start)
+        return exported + len(set(removed))
+
+    def configure_feed(self, name: str, url: str, provider: str):
+        '''Create or update a MISP feed, enabled, fetched by fetch_feed'''
+        feed = MISPFeed()
+        feed.name = name
+        feed.provider = provider
+        feed.url = url
+        feed.source_format = 'misp'
+        feed.input_source = 'network'
+        feed.enabled = True
+        feed.caching_enabled = False
+        # Same as MISP.default_event_distribution
+        feed.distribution = 3
+        for existing in self.owner_site_admin.feeds(pythonify=True):
+            if existing.name == name:  # type: ignore
+                result = self.owner_site_admin.update_feed(feed, existing.id)  # type: ignore
+                break
+        else:
+            result = self.owner_site_admin.add_feed(feed)
+        if not isinstance(result, MISPFeed):
+            raise Exception(f'Unable to configure the feed {name} on {self}: {result}')
+
+    def fetch_feed(self, name: str):
+        '''Queue the fetch of the feed on the node'''
+        for feed in self.owner_site_admin.feeds(pythonify=True):
+            if feed.name == name:  # type: ignore
+                return self.owner_site_admin.fetch_feed(feed)  # type: ignore
+        raise Exception(f'No feed {name} on {self}, run setup_sync.py')
+
     def create_tag(self, name: str, exportable: bool, reserved: bool):
         tag = MISPTag()
         tag.name = name
@@ -371,7 +563,8 @@ class MISPInstance():
         sync_user = self.create_or_update_user(user)
         sync_user.authkey = self.owner_site_admin.get_new_authkey(sync_user)
 
-        sync_user_connector = PyMISP(self.owner_site_admin.root_url, sync_user.authkey, ssl=secure_connection, debug=False)
+        sync_user_connector = TracedPyMISP(self.owner_site_admin.root_url, sync_user.authkey, ssl=secure_connection,
+                                           debug=False, node=self.hostname)
         return sync_user_connector.get_sync_config(pythonify=True)
 
     def configure_sync(self, server_sync_config, from_central_node=False):
@@ -441,9 +634,10 @@ class MISPInstances():
     central_node_name = central_node_name
     prefix_client_node = prefix_client_node
 
-    def __init__(self, root_misps: str='misps', force_reset_passwords: bool=False):
+    def __init__(self, root_misps: str='misps', force_reset_passwords: bool=False, bootstrap: bool=True):
         self.misp_instances_dir = Path(__file__).resolve().parent / root_misps
-        self.central_node = MISPInstance(self.misp_instances_dir / self.central_node_name / 'config.json', force_reset_passwords)
+        self.central_node = MISPInstance(self.misp_instances_dir / self.central_node_name / 'config.json',
+                                         force_reset_passwords, bootstrap)
 
         self.client_nodes = {}
         for path in self.misp_instances_dir.glob(f'{self.prefix_client_node}*'):
@@ -451,12 +645,29 @@ class MISPInstances():
                 continue
             while True:
                 try:
-                    instance = MISPInstance(path / 'config.json', force_reset_passwords)
+                    instance = MISPInstance(path / 'config.json', force_reset_passwords, bootstrap)
                     self.client_nodes[instance.owner_orgname] = instance
                     break
                 except Exception as e:
                     print(f'Error connecting to {path}', e)
-                    time.sleep(5)
+                    tracer.sleep(5, f'{path.name}{hostname_suffix}')
+
+    @property
+    def all_nodes(self) -> dict[str, MISPInstance]:
+        '''All the nodes, central node first, by admin org name'''
+        return {self.central_node.owner_orgname: self.central_node, **self.client_nodes}
+
+    def run_concurrently(self, func: Callable[[MISPInstance], Any], nodes: Optional[dict[str, MISPInstance]]=None,
+                         max_workers: int=max_concurrent_nodes) -> dict[str, Any]:
+        '''Call func on each node (all of them by default), one thread per node at most.
+        Returns the results by node name, the exceptions are raised.'''
+        if nodes is None:
+            nodes = self.all_nodes
+        if not nodes:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(nodes))) as executor:
+            futures = {name: executor.submit(func, node) for name, node in nodes.items()}
+        return {name: future.result() for name, future in futures.items()}
 
     def setup_instances(self):
         self.central_node.update_misp()
@@ -495,7 +706,7 @@ class MISPInstances():
                     break
                 except Exception as e:
                     print(f'Error updating {instance}', e)
-                    time.sleep(30)
+                    tracer.sleep(30, instance.hostname)
 
             for tagname in local_tags_clients:
                 instance.create_tag(tagname, False, True)
@@ -535,6 +746,16 @@ class MISPInstances():
                 remote_sync_config.name = f'Sync with {remote_sync_config.Organisation["name"]}'
                 instance.configure_sync(remote_sync_config)
 
+    def setup_sync(self):
+        '''Setup of setup_sync.py: the instances and the sync between them'''
+        self.setup_instances()
+        # Mesh sync
+        # self.setup_sync_all()
+        # Central only sync
+        self.setup_sync_central_only()
+        if central_distribution == 'feed':
+            self.setup_feed_distribution()
+
     def create_or_update_user_everywhere(self, user: MISPUser):
         self.central_node.create_or_update_user(user)
         for instance in self.client_nodes.values():
@@ -546,18 +767,84 @@ class MISPInstances():
         for instance in self.client_nodes.values():
             instance.init_default_user(email, password, role_id)
 
+    def broadcast(self, url_path: str, payload: Any=None, nodes: Optional[list[str]]=None,
+                  stop_on_failure: bool=False, max_workers: int=max_concurrent_nodes) -> dict[str, dict[str, Any]]:
+        '''Direct call on all the nodes (or the ones in nodes, by admin org name) concurrently.
+        ${orgname}, ${hostname} and ${baseurl} are replaced by the values of each node in the url and the payload.
+        Returns {node: {'status': 'ok'|'error'|'skipped', 'latency': seconds, 'response': ...}}.
+        With stop_on_failure, the nodes not contacted yet when a call fails are skipped.'''
+        failed = threading.Event()
+
+        def _call(node: MISPInstance) -> dict[str, Any]:
+            if stop_on_failure and failed.is_set():
+                return {'status': 'skipped', 'latency': 0, 'response': None}
+            start = time.time()
+            try:
+                response = node.direct_call(render_template(url_path, node.template_variables),
+                                            render_template(payload, node.template_variables))
+                status = 'error' if isinstance(response, dict) and 'errors' in response else 'ok'
+            except Exception as e:
+                response, status = str(e), 'error'
+            if status == 'error':
+                failed.set()
+            return {'status': status, 'latency': time.time() - start, 'response': response}
+
+        selected = self.all_nodes
+        if nodes:
+            selected = {name: node for name, node in selected.items() if name in nodes}
+        return self.run_concurrently(_call, selected, max_workers)
+
     def sync_push_all(self):
         for instance in self.client_nodes.values():
             instance.sync_push_all()
-        self.central_node.sync_push_all()
+        if central_distribution == 'feed':
+            self.distribute_feed(full=True)
+        else:
+            self.central_node.sync_push_all()
 
-    def refresh_external_baseurls(self):
+    def sync_push_changed(self):
+        for instance in self.client_nodes.values():
+            if pushed := instance.sync_push_changed():
+                print(f'{instance}: pushed {pushed} event(s)')
+        if central_distribution == 'feed':
+            pushed = self.distribute_feed()
+        else:
+            pushed = self.central_node.sync_push_changed(from_central_node=True)
+        if pushed:
+            print(f'{self.central_node}: pushed {pushed} event(s)')
+
+    @property
+    def central_feed_dir(self) -> Path:
+        return self.misp_instances_dir / 'central_feed'
+
+    def setup_feed_distribution(self):
+        '''The client nodes get the events of the central node from its feed (central_distribution = 'feed')'''
+        url = f'{self.central_node.baseurl.rstrip("/")}{central_feed_location}'
+        self.run_concurrently(lambda node: node.configure_feed(central_feed_name, url, self.central_node.owner_orgname),
+                              self.client_nodes)
+        # The central node doesn't push anymore, its sync servers are only used to pull from the client nodes
+        for server in self.central_node.owner_site_admin.servers():
+            if server.push:  # type: ignore
+                server.push = False
+                self.central_node.owner_site_admin.update_server(server)
+        # The clients can fetch it right away
+        self.central_node.export_feed(self.central_feed_dir, tag_central_to_nodes, full=True)
+
+    def distribute_feed(self, full: bool=False) -> int:
+        '''Export the new events of the central node in its feed once, then queue a fetch on the client nodes.
+        Returns the number of events exported.'''
+        exported = self.central_node.export_feed(self.central_feed_dir, tag_central_to_nodes, full)
+        if exported or full:
+            self.run_concurrently(lambda node: node.fetch_feed(central_feed_name), self.client_nodes)
+        return exported
+
+    def refresh_external_baseurls(self, force=False):
         '''When the docker containers restart, the internal IPs may change.
-        This method update the the config files and the sync links'''
-        central_node_external_baseurl = self.central_node.update_external_baseurl()
+        This method update the the config files and the sync links (force: even if the config file has the current IP)'''
+        central_node_external_baseurl = self.central_node.update_external_baseurl(force)
         nodes_external_baseurls = {self.central_node.owner_orgname: central_node_external_baseurl}
         for name, instance in self.client_nodes.items():
-            nodes_external_baseurls[name] = instance.update_external_baseurl()
+            nodes_external_baseurls[name] = instance.update_external_baseurl(force)
 
         for server in self.central_node.owner_site_admin.servers():
             instance_name = ' '.join(server.name.split(' ')[-2:])
@@ -586,7 +873,7 @@ class MISPInstances():
                     break
                 except Exception as e:
                     print('Unable to connect', e)
-                    time.sleep(5)
+                    tracer.sleep(5, instance.hostname)
             instance.update_all_json()
 
     def cleanup_all_blacklisted_event(self):
@@ -604,20 +891,33 @@ class MISPInstances():
         for instance in self.client_nodes.values():
             instance.delete_events(to_delete_on_bts)
 
-    def dump_all_stats(self, dump_to: str):
+    def collect_stats(self, store: StatsStore, contexts: Optional[list[str]]=None) -> int:
+        '''Query the statistics on all the nodes concurrently and append them to the store (default context: data).
+        Returns the number of samples stored.'''
+        if contexts is None:
+            contexts = ['data']
+        def _collect(node: MISPInstance) -> dict[str, Any]:
+            stats = {}
+            for context in contexts:
+                try:
+                    stats[context] = node.user_statistics(context)
+                except Exception as e:
+                    print(f'Unable to get the {context} statistics of {node}: {e}')
+            return stats
+
+        timestamp = time.time()
+        samples = []
+        for name, stats in self.run_concurrently(_collect).items():
+            for context, data in stats.items():
+                samples.append({'ts': timestamp, 'node': name, 'context': context, 'data': data})
+        store.append(samples)
+        return len(samples)
+
+    def dump_all_stats(self, dump_to: str, contexts: Optional[list[str]]=None):
+        '''Append a timestamped sample of the statistics of all the nodes to <dump_to>/stats.jsonl (default context: data)'''
         dest_dir = self.misp_instances_dir / dump_to
         dest_dir.mkdir(exist_ok=True)
-        central_node_stats = self.central_node.user_statistics()
-
-        with (dest_dir / f'{self.central_node.owner_orgname}.json').open('w') as f:
-            json.dump(central_node_stats, f)
-
-        client_nodes_stats = {}
-        for name, instance in self.client_nodes.items():
-            client_nodes_stats[name] = instance.user_statistics()
-
-        with (dest_dir / 'clients.json').open('w') as f:
-            json.dump(client_nodes_stats, f)
+        self.collect_stats(StatsStore(dest_dir / 'stats.jsonl'), contexts)
 
     def dump_all_events(self):
         root_dir = self.misp_instances_dir / 'feeds'
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Load test of the instances through nginx-proxy: N clients with keepalive connections,
+each one requesting the login page, static files and an API call in a loop.
+Run it before and after setup_nginx.py + start_nginx.py, the results are compared with the previous run.'''
+
+import argparse
+import json
+import math
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import requests
+
+from generic_config import secure_connection
+from misp_instances import MISPInstances
+
+# (name, path, needs the API key)
+requests_mix = [
+    ('login page', '/users/login', False),
+    ('css', '/css/bootstrap.css', False),
+    ('js', '/js/jquery.js', False),
+    ('api version', '/servers/getVersion', True),
+]
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return math.nan
+    values = sorted(values)
+    return values[max(math.ceil(p / 100 * len(values)), 1) - 1]
+
+
+class Client():
+
+    def __init__(self, baseurl: str, authkey: str, deadline: float, results: dict[str, list[tuple[int, float, int]]],
+                 lock: threading.Lock):
+        self.baseurl = baseurl.rstrip('/')
+        self.deadline = deadline
+        self.results = results
+        self.lock = lock
+        self.session = requests.Session()
+        self.session.verify = secure_connection
+        self.session.headers.update({'Accept-Encoding': 'gzip, br'})
+        self.api_headers = {'Authorization': authkey, 'Accept': 'application/json'}
+
+    def run(self):
+        local: dict[str, list[tuple[int, float, int]]] = {}
+        while time.time() < self.deadline:
+            for name, path, api in requests_mix:
+                start = time.perf_counter()
+                try:
+                    r = self.session.get(f'{self.baseurl}{path}', headers=self.api_headers if api else None, timeout=30, stream=True)
+                    # Bytes on the wire (compressed)
+                    size = len(r.raw.read(decode_content=False))
+                    status = r.status_code
+                except requests.RequestException:
+                    size, status = 0, 0
+                local.setdefault(name, []).append((status, time.perf_counter() - start, size))
+        with self.lock:
+            for name, values in local.items():
+                self.results.setdefault(name, []).extend(values)
+
+
+def run(baseurls: dict[str, tuple[str, str]], clients: int, duration: int) -> dict[str, Any]:
+    results: dict[str, list[tuple[int, float, int]]] = {}
+    lock = threading.Lock()
+    deadline = time.time() + duration
+    targets = list(baseurls.values())
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        for i in range(clients):
+            # Clients spread on the instances
+            baseurl, authkey = targets[i % len(targets)]
+            executor.submit(Client(baseurl, authkey, deadline, results, lock).run)
+    elapsed = time.time() - start
+    summary: dict[str, Any] = {}
+    for name, values in results.items():
+        latencies = [v[1] for v in values]
+        summary[name] = {'requests': len(values), 'rps': len(values) / elapsed,
+                         'errors': len([v for v in values if not 200 <= v[0] < 400]),
+                         'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95),
+                         'bytes': sum(v[2] for v in values) / max(len(values), 1)}
+    total = sum(s['requests'] for s in summary.values())
+    summary['total'] = {'requests': total, 'rps': total / elapsed,
+                        'errors': sum(s['errors'] for s in summary.values()),
+                        'p50': percentile([v[1] for values in results.values() for v in values], 50),
+                        'p95': percentile([v[1] for values in results.values() for v in values], 95),
+                        'bytes': sum(v[2] for values in results.values() for v in values) / max(total, 1)}
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the instances through nginx-proxy.', epilog=__doc__)
+    parser.add_argument('--root', default='misps', help='Directory with the config files of the instances')
+    parser.add_argument('--nodes', nargs='+', help='Name of the admin org of the nodes to test (default: all)')
+    parser.add_argument('--clients', type=int, default=50, help='Concurrent clients (a classroom)')
+    parser.add_argument('--duration', type=int, default=30, help='Duration of the test in seconds')
+    parser.add_argument('--label', default='', help='Name of the run, ex. "before" or "after"')
+    parser.add_argument('--results', default='nginx_loadtest.jsonl', help='Results of the runs, relative to the root directory')
+    args = parser.parse_args()
+
+    instances = MISPInstances(root_misps=args.root, bootstrap=False)
+    baseurls = {name: (node.baseurl, node.config['admin_key']) for name, node in instances.all_nodes.items()
+                if not args.nodes or name in args.nodes}
+    if not baseurls:
+        raise Exception(f'Available instances: {list(instances.all_nodes)}')
+    summary = run(baseurls, args.clients, args.duration)
+
+    results_file = instances.misp_instances_dir / args.results
+    previous = None
+    if results_file.exists():
+        with results_file.open() as f:
+            lines = f.readlines()
+        if lines:
+            previous = json.loads(lines[-1])
+    with results_file.open('a') as f:
+        f.write(json.dumps({'ts': time.time(), 'label': args.label, 'clients': args.clients, 'summary': summary}) + '\n')
+
+    print(f'{"Request":<14} {"req/s":>9} {"errors":>7} {"p50 (ms)":>9} {"p95 (ms)":>9} {"bytes":>9}')
+    for name, s in summary.items():
+        print(f'{name:<14} {s["rps"]:>9.1f} {s["errors"]:>7} {s["p50"] * 1000:>9.1f} {s["p95"] * 1000:>9.1f} {s["bytes"]:>9.0f}')
+    if previous:
+        before = previous['summary']['total']['rps']
+        print(f'Total: {summary["total"]["rps"]:.1f} req/s, previous run ({previous["label"] or "no label"}, '
+              f'{previous["clients"]} clients): {before:.1f} req/s ({(summary["total"]["rps"] / before - 1) * 100 if before else math.nan:+.0f}%)')
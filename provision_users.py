@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Create the organisations and users listed in a roster on the instances.
+
+Roster: CSV with a header, or a JSON list of objects, with the keys:
+    email     (required)
+    org       Organisation of the user, created if missing (default: the host org of the node)
+    role      Role name or id (default: User)
+    node      Admin org name of the node, "all" or empty for all the nodes
+    password  "random" (default): new random password, "keep": random for new users, unchanged for
+              existing ones, anything else is used as password
+'''
+
+import argparse
+import csv
+import json
+import random
+import string
+import time
+
+from pathlib import Path
+from typing import Any, Optional
+
+from pymisp import MISPUser, MISPOrganisation, MISPRole
+
+from config_helpers import dump_atomic
+from misp_instances import MISPInstances, MISPInstance
+
+
+def load_roster(path: Path) -> list[dict[str, str]]:
+    with path.open() as f:
+        if path.suffix == '.json':
+            entries = json.load(f)
+        else:
+            entries = list(csv.DictReader(f))
+    for entry in entries:
+        if not entry.get('email'):
+            raise Exception(f'Missing email in {entry}')
+    return entries
+
+
+def random_password() -> str:
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=16))
+
+
+class NodeProvisioner():
+    '''Writes on one node, with the users, organisations and roles downloaded once'''
+
+    def __init__(self, node: MISPInstance):
+        self.node = node
+        self.connector = node.owner_site_admin
+        self.users: dict[str, MISPUser] = {u.email.lower(): u for u in self.connector.users()}  # type: ignore
+        self.orgs: dict[str, MISPOrganisation] = {o.name: o for o in self.connector.organisations(scope='all')}  # type: ignore
+        self.roles: dict[str, MISPRole] = {r.name.lower(): r for r in self.connector.roles()}  # type: ignore
+        self.roles.update({str(r.id): r for r in list(self.roles.values())})  # type: ignore
+
+    def org_id(self, name: Optional[str]) -> Any:
+        if not name:
+            name = self.node.owner_orgname
+        if name not in self.orgs:
+            # Missing from the index: created directly, without downloading the organisations again
+            organisation = MISPOrganisation()
+            organisation.name = name
+            result = self.connector.add_organisation(organisation)
+            if not isinstance(result, MISPOrganisation):
+                raise Exception(f'Unable to create {name} on {self.node}: {result}')
+            self.orgs[name] = result
+        return self.orgs[name].id
+
+    def provision(self, entry: dict[str, str]) -> dict[str, str]:
+        email = entry['email'].strip()
+        role_name = (entry.get('role') or 'User').strip().lower()
+        if role_name not in self.roles:
+            raise Exception(f'Unknown role {entry.get("role")} on {self.node}')
+        user = MISPUser()
+        user.email = email
+        user.org_id = self.org_id(entry.get('org'))
+        user.role_id = self.roles[role_name].id  # type: ignore
+
+        policy = entry.get('password') or 'random'
+        existing = self.users.get(email.lower())
+        password = 'unchanged'
+        if not existing or policy != 'keep':
+            password = random_password() if policy in ['random', 'keep'] else policy
+            user.password = password
+
+        if existing:
+            result = self.connector.update_user(user, existing.id)  # type: ignore
+        else:
+            result = self.connector.add_user(user)
+        if not isinstance(result, MISPUser):
+            raise Exception(f'Unable to {"update" if existing else "create"} {email} on {self.node}: {result}')
+        self.users[email.lower()] = result
+        return {'node': self.node.owner_orgname, 'url': self.node.baseurl, 'login': email,
+                'org': entry.get('org') or self.node.owner_orgname, 'role': self.roles[role_name].name,
+                'password': password, 'status': 'updated' if existing else 'created'}
+
+    def run(self, entries: list[dict[str, str]]) -> list[dict[str, str]]:
+        results = []
+        for entry in entries:
+            try:
+                results.append(self.provision(entry))
+            except Exception as e:
+                print(e)
+                results.append({'node': self.node.owner_orgname, 'url': self.node.baseurl, 'login': entry['email'],
+                                'org': entry.get('org', ''), 'role': entry.get('role', ''), 'password': '', 'status': 'failed'})
+        return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create the organisations and users of a roster (CSV or JSON) on the instances.',
+                                     epilog=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('roster', help='Path to the roster')
+    parser.add_argument('--root', default='misps', help='Directory with the config files of the instances')
+    parser.add_argument('--output', default='users.csv', help='Credentials of the provisioned users, relative to the root directory (CSV, or JSON if it ends with .json)')
+    args = parser.parse_args()
+
+    entries = load_roster(Path(args.roster))
+    instances = MISPInstances(root_misps=args.root, bootstrap=False)
+    per_node: dict[str, list[dict[str, str]]] = {name: [] for name in instances.all_nodes}
+    for entry in entries:
+        node_name = (entry.get('node') or 'all').strip()
+        if node_name == 'all':
+            for node_entries in per_node.values():
+                node_entries.append(entry)
+        elif node_name in per_node:
+            per_node[node_name].append(entry)
+        else:
+            raise Exception(f'Unknown node {node_name}, available: {list(per_node)}')
+
+    start = time.time()
+    nodes = {name: node for name, node in instances.all_nodes.items() if per_node[name]}
+    results = instances.run_concurrently(lambda node: NodeProvisioner(node).run(per_node[node.owner_orgname]), nodes)
+    to_dump = [r for node_results in results.values() for r in node_results]
+
+    output = instances.misp_instances_dir / args.output
+    if output.suffix == '.json':
+        dump_atomic(output, lambda f: json.dump(to_dump, f, indent=2))
+    else:
+        def write_csv(csvfile):
+            writer = csv.DictWriter(csvfile, fieldnames=['node', 'url', 'login', 'org', 'role', 'password', 'status'])
+            writer.writeheader()
+            writer.writerows(to_dump)
+        dump_atomic(output, write_csv)
+
+    statuses = [r['status'] for r in to_dump]
+    print(f'{statuses.count("created")} created, {statuses.count("updated")} updated, {statuses.count("failed")} failed '
+          f'on {len(nodes)} node(s) in {time.time() - start:.1f}s, credentials in {output}')
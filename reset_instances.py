@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Put all the instances back to a baseline between two sessions, without reinstalling them.
+
+1. After setup_sync.py: ./reset_instances.py snapshot
+   Dumps the database and copies config.php of each instance in <root>/baselines/<instance>, with the users,
+   organisations and sync servers of the baseline (baseline.json).
+2. Between the sessions: ./reset_instances.py reset
+   Restores the dumps concurrently (misp-core is stopped during the restore).
+   Without a dump (or with --purge), the events, blocklists, and the users, organisations and sync servers that are
+   not in the baseline are deleted through the API, then the setup of setup_sync.py is applied again.
+'''
+
+import argparse
+import gzip
+import json
+import shlex
+import shutil
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from subprocess import Popen, PIPE, DEVNULL
+from typing import Any, Optional
+
+from api_helpers import wait_ready
+from config_helpers import config_files, user_keys
+from docker_helpers import docker_command, check
+from generic_config import shared_services, max_concurrent_nodes
+from misp_instances import MISPInstances, MISPInstance
+from tracing import tracer, command_name
+
+config_php = '/var/www/MISP/app/Config/config.php'
+# State of the sync kept in config.json by the tooling, meaningless after a reset
+sync_state_keys = ['sync_push_timestamp', 'sync_push_uuids', 'last_push', 'last_push_duration',
+                   'feed_export_timestamp', 'feed_export_uuids']
+
+
+class NodeBaseline():
+
+    def __init__(self, config_file: Path, baselines_dir: Path):
+        self.config_file = config_file
+        self.node_dir = config_file.parent
+        self.baseline_dir = baselines_dir / self.node_dir.name
+        with config_file.open() as f:
+            self.config = json.load(f)
+        if 'db' in shared_services:
+            self.db_dir = self.node_dir.parent / 'shared'
+            credentials = f'-u{self.config["db_user"]} -p{self.config["db_password"]}'
+            self.dump_command = f'mariadb-dump {credentials} --single-transaction --add-drop-database --databases {self.config["db_name"]}'
+            self.restore_command = f'mariadb {credentials}'
+        else:
+            # The credentials are in the environment of the db container
+            self.db_dir = self.node_dir
+            self.dump_command = ('sh -c \'exec mariadb-dump -u"$MYSQL_USER" -p"$MYSQL_PASSWORD" --single-transaction '
+                                 '--add-drop-database --databases "$MYSQL_DATABASE"\'')
+            self.restore_command = 'sh -c \'exec mariadb -u"$MYSQL_USER" -p"$MYSQL_PASSWORD"\''
+
+    @property
+    def has_snapshot(self) -> bool:
+        return (self.baseline_dir / 'db.sql.gz').exists()
+
+    def _db_exec(self, command: str) -> list[str]:
+        return shlex.split('sudo docker compose exec -T db') + shlex.split(command)
+
+    def snapshot(self):
+        self.baseline_dir.mkdir(parents=True, exist_ok=True)
+        command = self._db_exec(self.dump_command)
+        # Streamed, the dump doesn't fit in memory once there are events
+        with tracer.span('docker', command_name(command), self.config['hostname']):
+            p = Popen(command, stdout=PIPE, stderr=PIPE, cwd=self.db_dir)
+            with gzip.open(self.baseline_dir / '.db.sql.gz.tmp', 'wb') as f:
+                shutil.copyfileobj(p.stdout, f)  # type: ignore
+            _, errs = p.communicate()
+        if p.returncode != 0:
+            raise Exception(f'Dump of {self.node_dir.name} failed: {errs.decode().strip()}')
+        (self.baseline_dir / '.db.sql.gz.tmp').replace(self.baseline_dir / 'db.sql.gz')
+        check(docker_command(f'sudo docker compose cp misp-core:{config_php} {self.baseline_dir / "config.php"}',
+                             self.config['hostname'], cwd=self.node_dir), f'Copy of config.php of {self.node_dir.name}')
+
+        node = MISPInstance(self.config_file, bootstrap=False)
+        baseline = {'created': time.time(),
+                    'users': [u.email for u in node.owner_site_admin.users()],
+                    'organisations': [o.name for o in node.owner_site_admin.organisations(scope='all')],
+                    'servers': [s.name for s in node.owner_site_admin.servers()],
+                    'config': {key: node.config[key] for key in user_keys if key in node.config}}
+        with (self.baseline_dir / 'baseline.json').open('w') as f:
+            json.dump(baseline, f, indent=2)
+
+    def restore(self, ready_timeout: int):
+        check(docker_command('sudo docker compose stop misp-core', self.config['hostname'], cwd=self.node_dir),
+              f'Stopping {self.node_dir.name}')
+        command = self._db_exec(self.restore_command)
+        with tracer.span('docker', command_name(command), self.config['hostname']):
+            p = Popen(command, stdin=PIPE, stdout=DEVNULL, stderr=PIPE, cwd=self.db_dir)
+            with gzip.open(self.baseline_dir / 'db.sql.gz', 'rb') as f:
+                shutil.copyfileobj(f, p.stdin)  # type: ignore
+            p.stdin.close()  # type: ignore
+            errs = p.stderr.read()  # type: ignore
+            p.wait()
+        if p.returncode != 0:
+            raise Exception(f'Restore of {self.node_dir.name} failed: {errs.decode().strip()}')
+        check(docker_command(f'sudo docker compose cp {self.baseline_dir / "config.php"} misp-core:{config_php}',
+                             self.config['hostname'], cwd=self.node_dir), f'Copy of config.php of {self.node_dir.name}')
+        check(docker_command('sudo docker compose start misp-core', self.config['hostname'], cwd=self.node_dir),
+              f'Starting {self.node_dir.name}')
+        # The keys in the database are the ones of the snapshot
+        with (self.baseline_dir / 'baseline.json').open() as f:
+            self.config.update(json.load(f)['config'])
+        self.reset_sync_state()
+        wait_ready(self.config, ready_timeout)
+
+    def reset_sync_state(self):
+        for key in sync_state_keys:
+            self.config.pop(key, None)
+        with self.config_file.open('w') as f:
+            json.dump(self.config, f, indent=2)
+
+    def purge(self, node: MISPInstance, batch_size: int) -> dict[str, int]:
+        baseline: dict[str, Any] = {}
+        if (self.baseline_dir / 'baseline.json').exists():
+            with (self.baseline_dir / 'baseline.json').open() as f:
+                baseline = json.load(f)
+        connector = node.owner_site_admin
+        counts = {'events': 0, 'blocklists': 0, 'users': 0, 'organisations': 0, 'servers': 0}
+        while True:
+            ids = [e.id for e in connector.search(metadata=True, limit=batch_size, page=1)]  # type: ignore
+            if not ids:
+                break
+            result = connector.direct_call('events/delete', {'id': ids})
+            if isinstance(result, dict) and 'errors' in result:
+                raise Exception(f'Unable to delete the events on {node}: {result}')
+            counts['events'] += len(ids)
+        # Or the events of the next session with the same UUIDs are refused
+        for blocklist in connector.event_blocklists():
+            connector.delete_event_blocklist(blocklist)  # type: ignore
+            counts['blocklists'] += 1
+
+        # Without a snapshot: the users and organisations created by the tooling
+        keep_users = set(baseline.get('users', ['admin@admin.test', node.config['email_site_admin'], node.config['email_orgadmin']]))
+        keep_orgs = set(baseline.get('organisations', [node.owner_orgname]))
+        keep_servers = set(baseline.get('servers', []))
+        for user in connector.users():
+            if user.email in keep_users or (not baseline and user.email.startswith('sync_user@')):  # type: ignore
+                continue
+            connector.delete_user(user)  # type: ignore
+            counts['users'] += 1
+        if baseline:
+            for server in connector.servers():
+                if server.name not in keep_servers:  # type: ignore
+                    connector.delete_server(server)  # type: ignore
+                    counts['servers'] += 1
+        for organisation in connector.organisations(scope='local'):
+            if organisation.name not in keep_orgs and str(organisation.id) != str(node.host_org.id):  # type: ignore
+                result = connector.delete_organisation(organisation)  # type: ignore
+                # Organisations still used by a sync server or a sharing group are kept
+                if not (isinstance(result, dict) and 'errors' in result):
+                    counts['organisations'] += 1
+        self.reset_sync_state()
+        return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Snapshot the instances after the setup, reset them to it between the sessions.',
+                                     epilog=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('action', choices=['snapshot', 'reset'])
+    parser.add_argument('--root', default='misps', help='Directory with the config files of the instances')
+    parser.add_argument('--purge', action='store_true', help='reset: purge through the API even if there is a snapshot')
+    parser.add_argument('--batch_size', type=int, default=500, help='reset: events deleted per call when purging')
+    parser.add_argument('--ready_timeout', type=int, default=600, help='reset: time for an instance to answer after the restore, in seconds')
+    parser.add_argument('--max_workers', type=int, default=max_concurrent_nodes, help='Instances handled at the same time')
+    args = parser.parse_args()
+
+    start = time.time()
+    misp_instances_dir = Path(__file__).resolve().parent / args.root
+    files = config_files(misp_instances_dir)
+    # config_files always lists the central node, even before it is initialized
+    baselines = [NodeBaseline(config_file, misp_instances_dir / 'baselines') for config_file in files if config_file.exists()]
+    if not baselines:
+        print(f'No instance in {args.root}.')
+        sys.exit(0)
+    if args.action == 'snapshot':
+        with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+            list(executor.map(NodeBaseline.snapshot, baselines))
+        print(f'Snapshot of {len(baselines)} instance(s) in {misp_instances_dir / "baselines"}, in {time.time() - start:.0f}s')
+    else:
+        # Exported again by the setup or the next trigger_sync.py
+        feed_dir = misp_instances_dir / 'central_feed'
+        if feed_dir.exists():
+            shutil.rmtree(feed_dir)
+        to_restore = [b for b in baselines if b.has_snapshot and not args.purge]
+        with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+            list(executor.map(lambda b: b.restore(args.ready_timeout), to_restore))
+        for baseline in to_restore:
+            print(f'{baseline.node_dir.name}: restored')
+        # Nothing to set up again on the instances, they are back to their state after the setup
+        instances: Optional[MISPInstances] = None
+        if files[0].exists():
+            instances = MISPInstances(root_misps=args.root, bootstrap=False)
+            nodes = {node.config_file.parent.name: node for node in instances.all_nodes.values()}
+        else:
+            # Without the central node, there is no sync to refresh or to set up again
+            nodes = {b.node_dir.name: MISPInstance(b.config_file, bootstrap=False) for b in baselines}
+        if to_restore:
+            # The external baseurls and the sync server URLs of the dumps are the IPs of the snapshot
+            if instances:
+                instances.refresh_external_baseurls(force=True)
+            else:
+                for baseline in to_restore:
+                    nodes[baseline.node_dir.name].update_external_baseurl(force=True)
+        if to_purge := {b.node_dir.name: b for b in baselines if b not in to_restore}:
+            with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+                purged = dict(zip(to_purge, executor.map(lambda name: to_purge[name].purge(nodes[name], args.batch_size), to_purge)))
+            for name, counts in purged.items():
+                print(f'{name}: purged {", ".join(f"{v} {k}" for k, v in counts.items())}')
+            # Desired state: the setup of setup_sync.py, on all the instances (the sync servers point to each other)
+            if instances:
+                instances.setup_sync()
+        print(f'{len(baselines)} instance(s) reset in {time.time() - start:.0f}s')
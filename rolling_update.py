@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Update the instances a few at a time, the others stay available.
+
+1. ./init_misps.py --no_start (optional): regenerates docker-compose.yml and .env without touching the containers
+2. ./rolling_update.py --wave 2
+   The images are pulled once for all the instances, then the instances running an older image or with a pending
+   docker-compose.yml are recreated in waves (central node first, alone). After each wave, the API and the workers
+   of the recreated instances must answer before the next wave starts, then only the settings that depend on
+   what changed (external baseurl, JSON metadata, redis databases) are re-applied.
+   If a wave fails, the update stops. With --rollback, the instances of the failed wave are put back on their previous
+   images, pinned by ID in their docker-compose.override.yml (the tags are left alone, they are shared by all the
+   instances), and on their previous docker-compose.yml/.env if they were regenerated. The next update removes the pin.
+
+The shared services stack (shared_services in generic_config) is not updated.
+'''
+
+import argparse
+import json
+import shutil
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Optional
+
+import yaml
+
+from api_helpers import wait_ready
+from config_helpers import config_files
+from docker_helpers import docker_command, container_images, image_id, check
+from generic_config import max_concurrent_nodes
+from misp_instances import MISPInstance
+
+
+# Written by a rollback, merged by docker compose with docker-compose.yml
+override_file = 'docker-compose.override.yml'
+
+
+def compose_images(node_dir: Path) -> dict[str, str]:
+    '''{service: image reference} of the generated docker-compose.yml (without the images pinned by a rollback)'''
+    _, outs, _ = docker_command('sudo docker compose -f docker-compose.yml config --format json', node_dir.name, cwd=node_dir)
+    if not outs.strip():
+        return {}
+    return {service: definition['image'] for service, definition in json.loads(outs)['services'].items()
+            if definition.get('image')}
+
+
+def pull_images(references: set[str]) -> dict[str, tuple[Optional[str], Optional[str]]]:
+    '''Pull each image once, returns {reference: (previous ID, new ID)}'''
+    ids = {}
+    for reference in sorted(references):
+        previous = image_id(reference)
+        print(f'Pulling {reference}')
+        check(docker_command(f'sudo docker pull {reference}'), f'Pulling {reference}')
+        ids[reference] = (previous, image_id(reference))
+    return ids
+
+
+class NodeUpdate():
+
+    def __init__(self, config_file: Path, references: dict[str, str], running: dict[str, str],
+                 ids: dict[str, tuple[Optional[str], Optional[str]]]):
+        self.config_file = config_file
+        self.node_dir = config_file.parent
+        with config_file.open() as f:
+            self.config = json.load(f)
+        self.new_images = {service for service, reference in references.items() if running.get(service) != ids[reference][1]}
+        self.new_compose = 'pending_compose_hash' in self.config
+        self.pinned = (self.node_dir / override_file).exists()
+        # Images running before the update, to go back to
+        self.previous_images = {service: image for service, image in running.items() if service in references}
+
+    @property
+    def outdated(self) -> bool:
+        return bool(self.new_images or self.new_compose or self.pinned)
+
+    def __str__(self) -> str:
+        changes = []
+        if self.new_images:
+            changes.append(f'new images for {" ".join(sorted(self.new_images))}')
+        if self.new_compose:
+            changes.append('new docker-compose.yml')
+        if self.pinned:
+            changes.append('pinned by a rollback')
+        return f'{self.node_dir.name}: {", ".join(changes) or "up to date"}'
+
+    def recreate(self, ready_timeout: int):
+        (self.node_dir / override_file).unlink(missing_ok=True)
+        # Compose only recreates the services with a new image or definition
+        check(docker_command('sudo docker compose up -d', self.node_dir.name, cwd=self.node_dir), f'Recreating {self.node_dir.name}')
+        wait_ready(self.config, ready_timeout)
+        self.reapply()
+
+    def reapply(self):
+        node = MISPInstance(self.config_file, bootstrap=False)
+        # The IP of misp-core changes if it was recreated
+        node.update_external_baseurl()
+        # Only imports when the mounted metadata changed
+        node.update_all_json()
+        if node.config.get('redis_database') is not None:
+            node.use_redis_databases(node.config['redis_database'])
+        if self.new_compose:
+            node.config['compose_hash'] = node.config.pop('pending_compose_hash')
+            with self.config_file.open('w') as f:
+                json.dump(node.config, f, indent=2)
+
+    def rollback(self, ready_timeout: int):
+        if self.new_compose and (self.node_dir / 'docker-compose.yml.previous').exists():
+            shutil.copyfile(self.node_dir / 'docker-compose.yml.previous', self.node_dir / 'docker-compose.yml')
+            shutil.copyfile(self.node_dir / '.env.previous', self.node_dir / '.env')
+        # The previous images of this instance only, by ID
+        override = {'services': {service: {'image': image} for service, image in self.previous_images.items()}}
+        with (self.node_dir / override_file).open('w') as f:
+            yaml.dump(override, f, default_flow_style=False)
+        check(docker_command('sudo docker compose up -d', self.node_dir.name, cwd=self.node_dir), f'Rolling back {self.node_dir.name}')
+        wait_ready(self.config, ready_timeout)
+
+
+def run_wave(updates: list[NodeUpdate], func, max_workers: int) -> dict[str, str]:
+    '''Errors by node'''
+    def safe(update: NodeUpdate):
+        try:
+            func(update)
+        except Exception as e:
+            return str(e)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        errors = dict(zip([u.node_dir.name for u in updates], executor.map(safe, updates)))
+    return {name: error for name, error in errors.items() if error}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rolling, health-gated update of the instances.',
+                                     epilog=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--root', default='misps', help='Directory with the config files of the instances')
+    parser.add_argument('--wave', type=int, default=2, help='Maximum number of instances recreated at the same time')
+    parser.add_argument('--ready_timeout', type=int, default=600, help='Time for an instance to be ready after its recreation, in seconds')
+    parser.add_argument('--rollback', action='store_true', help='Put the previous images back on the instances of a failed wave')
+    parser.add_argument('--no_pull', action='store_true', help='Only apply the pending docker-compose.yml and the images already pulled')
+    parser.add_argument('--max_workers', type=int, default=max_concurrent_nodes, help='Instances inspected at the same time')
+    args = parser.parse_args()
+
+    start = time.time()
+    files = [f for f in config_files(Path(__file__).resolve().parent / args.root) if f.exists()]
+    if not files:
+        print(f'No instance in {args.root}.')
+        sys.exit(0)
+    with ThreadPoolExecutor(max_workers=min(args.max_workers, len(files))) as executor:
+        references = dict(zip(files, executor.map(lambda config_file: compose_images(config_file.parent), files)))
+    all_references = {reference for node_references in references.values() for reference in node_references.values()}
+    if args.no_pull:
+        ids = {reference: (image_id(reference), image_id(reference)) for reference in all_references}
+    else:
+        ids = pull_images(all_references)
+    running = container_images()
+
+    updates = [NodeUpdate(config_file, references[config_file], running.get(config_file.parent.name, {}), ids)
+               for config_file in files]
+    for update in updates:
+        print(update)
+    outdated = [update for update in updates if update.outdated]
+    if not outdated:
+        print('Nothing to update.')
+        sys.exit(0)
+
+    # The central node (files[0]) alone first: it is the hub of the sync
+    waves = [outdated[:1]] if outdated[0].config_file == files[0] else []
+    clients = outdated[len(waves):]
+    waves += [clients[i:i + args.wave] for i in range(0, len(clients), args.wave)]
+    for i, wave in enumerate(waves, 1):
+        wave_start = time.time()
+        print(f'Wave {i}/{len(waves)}: {" ".join(u.node_dir.name for u in wave)}')
+        errors = run_wave(wave, lambda u: u.recreate(args.ready_timeout), args.wave)
+        if not errors:
+            print(f'Wave {i} ready in {time.time() - wave_start:.0f}s')
+            continue
+        for name, error in errors.items():
+            print(f'{name}: {error}')
+        if args.rollback:
+            failed = [u for u in wave if u.node_dir.name in errors]
+            rollback_errors = run_wave(failed, lambda u: u.rollback(args.ready_timeout), args.wave)
+            for name in errors:
+                print(f'{name}: {"rollback failed: " + rollback_errors[name] if name in rollback_errors else "rolled back"}')
+        not_updated = [u.node_dir.name for w in waves[i:] for u in w]
+        print(f'Update stopped at wave {i}, not updated: {" ".join(not_updated) or "-"}')
+        sys.exit(1)
+    print(f'{len(outdated)} instance(s) updated in {time.time() - start:.0f}s')
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Load the events of an exercise scenario on the instances, from a MISP feed directory (ex. misps/feeds/<org>
+exported by feeds.py).
+
+Re-running it is cheap: the events already on a node with the same or a newer timestamp are skipped, the older ones
+are updated. ${orgname}, ${hostname} and ${baseurl} in --org and --sync_tags are replaced by the values of each node.'''
+
+import argparse
+import copy
+import json
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import requests
+
+from pymisp import PyMISP, MISPEvent, MISPOrganisation
+from pymisp.exceptions import MISPServerError
+
+from generic_config import secure_connection, max_concurrent_nodes, tag_central_to_nodes, tag_nodes_to_central
+from misp_instances import MISPInstances, MISPInstance, render_template
+from tracing import tracer
+
+sync_tags = set(tag_central_to_nodes + tag_nodes_to_central)
+
+
+def load_scenario(feed_dir: Path) -> list[dict[str, Any]]:
+    '''Events of the feed, in the order of the manifest'''
+    if (feed_dir / 'manifest.json').exists():
+        with (feed_dir / 'manifest.json').open() as f:
+            paths = [feed_dir / f'{event_uuid}.json' for event_uuid in json.load(f)]
+    else:
+        paths = sorted(p for p in feed_dir.glob('*.json') if p.name != 'manifest.json')
+    events = []
+    for path in paths:
+        with path.open() as f:
+            events.append(json.load(f)['Event'])
+    return events
+
+
+class TransientError(Exception):
+    pass
+
+
+# Worth retrying: the node is restarting or overloaded. Anything else (bad payload, ...) fails at once.
+transient_errors = (requests.exceptions.ConnectionError, requests.exceptions.Timeout, MISPServerError, TransientError)
+
+
+class ScenarioSeeder():
+
+    def __init__(self, node: MISPInstance, args):
+        self.node = node
+        self.args = args
+        self.authkey = node.config.get('site_admin_authkey')
+        self._local = threading.local()
+        self.orgc: Optional[MISPOrganisation] = None
+        self.counts = {'added': 0, 'updated': 0, 'skipped': 0, 'failed': 0}
+
+    @property
+    def connector(self) -> PyMISP:
+        '''One connection per worker thread'''
+        if not hasattr(self._local, 'connector'):
+            self._local.connector = PyMISP(self.node.baseurl, self.authkey, ssl=secure_connection, timeout=300)
+        return self._local.connector
+
+    def with_retries(self, func: Callable[[], Any], what: str) -> Any:
+        for attempt in range(self.args.retries + 1):
+            try:
+                result = func()
+                if isinstance(result, dict) and 'errors' in result:
+                    status = result['errors'][0] if isinstance(result['errors'], (list, tuple)) else 0
+                    if isinstance(status, int) and (status >= 500 or status == 429):
+                        raise TransientError(result['errors'])
+                return result
+            except transient_errors as e:
+                if attempt == self.args.retries:
+                    raise
+                print(f'{self.node}: {what} failed ({e}), retrying')
+                tracer.sleep(min(2 ** attempt, 30), self.node.hostname)
+
+    def prepare(self, event_dict: dict[str, Any]) -> MISPEvent:
+        event = MISPEvent()
+        # load() consumes the dict, the events are shared by the nodes
+        event.load({'Event': copy.deepcopy(event_dict)})
+        variables = self.node.template_variables
+        if self.orgc:
+            event.Orgc = self.orgc
+            event.orgc_id = self.orgc.id
+        if self.args.distribution is not None:
+            event.distribution = self.args.distribution
+        if self.args.sync_tags is not None:
+            event.tags = [tag for tag in event.tags if tag.name not in sync_tags]
+            for tag in self.args.sync_tags:
+                event.add_tag(render_template(tag, variables))
+        return event
+
+    def seed(self, event_dict: dict[str, Any], existing: dict[str, int]) -> str:
+        event_uuid = event_dict['uuid']
+        if existing.get(event_uuid, -1) >= int(event_dict['timestamp']):
+            return 'skipped'
+        event = self.prepare(event_dict)
+        try:
+            if event_uuid in existing:
+                result = self.with_retries(lambda: self.connector.update_event(event, event_uuid, pythonify=True), f'update of {event_uuid}')
+            else:
+                result = self.with_retries(lambda: self.connector.add_event(event, pythonify=True), f'add of {event_uuid}')
+            if not isinstance(result, MISPEvent):
+                raise Exception(result)
+            if self.args.publish:
+                self.with_retries(lambda: self.connector.publish(result), f'publish of {event_uuid}')
+        except Exception as e:
+            print(f'{self.node}: unable to seed {event_uuid}: {e}')
+            return 'failed'
+        return 'updated' if event_uuid in existing else 'added'
+
+    def run(self, events: list[dict[str, Any]]) -> dict[str, Any]:
+        # Make sure the owner site admin exists and its key is in the config
+        self.authkey = self.node.owner_site_admin.key
+        if self.args.org:
+            organisation = MISPOrganisation()
+            organisation.name = render_template(self.args.org, self.node.template_variables)
+            self.orgc = self.node.create_or_update_organisation(organisation)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.workers) as executor:
+            for i in range(0, len(events), self.args.batch_size):
+                batch = events[i:i + self.args.batch_size]
+                # One search per batch for the events already there
+                found = self.with_retries(lambda: self.connector.search(uuid=[e['uuid'] for e in batch], metadata=True,  # type: ignore
+                                                                        pythonify=True), 'search')
+                existing = {e.uuid: int(e.timestamp.timestamp()) for e in found}  # type: ignore
+                for status in executor.map(lambda e: self.seed(e, existing), batch):
+                    self.counts[status] += 1
+        return {**self.counts, 'duration': time.perf_counter() - start}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Seed the events of a scenario (MISP feed directory) on the instances.',
+                                     epilog=__doc__)
+    parser.add_argument('feed_dir', help='Directory with manifest.json and the <uuid>.json of the events')
+    parser.add_argument('--root', default='misps', help='Directory with the config files of the instances')
+    parser.add_argument('--nodes', nargs='+', help='Name of the admin org of the nodes to seed (default: all)')
+    parser.add_argument('--org', help='Creator org of the events (created if missing), ex. "${orgname}" (default: the one of the feed)')
+    parser.add_argument('--distribution', type=int, choices=range(5), help='Distribution of the events (default: the one of the feed)')
+    parser.add_argument('--sync_tags', nargs='*', help='Replace the sync tags of the events by these ones (none: remove them)')
+    parser.add_argument('--publish', action='store_true', help='Publish the events')
+    parser.add_argument('--batch_size', type=int, default=100, help='Events looked up and seeded together on a node')
+    parser.add_argument('--workers', type=int, default=4, help='Concurrent writers per node')
+    parser.add_argument('--retries', type=int, default=3, help='Retries on a connection error or a 5xx')
+    parser.add_argument('--max_workers', type=int, default=max_concurrent_nodes, help='Nodes seeded at the same time')
+    args = parser.parse_args()
+
+    events = load_scenario(Path(args.feed_dir))
+    instances = MISPInstances(root_misps=args.root, bootstrap=False)
+    nodes = instances.all_nodes
+    if args.nodes:
+        nodes = {name: node for name, node in nodes.items() if name in args.nodes}
+
+    start = time.perf_counter()
+    results = instances.run_concurrently(lambda node: ScenarioSeeder(node, args).run(events), nodes, args.max_workers)
+    print(f'{"Node":<30} {"added":>7} {"updated":>8} {"skipped":>8} {"failed":>7} {"events/s":>9}')
+    for name, result in results.items():
+        seeded = result['added'] + result['updated']
+        print(f'{name:<30} {result["added"]:>7} {result["updated"]:>8} {result["skipped"]:>8} {result["failed"]:>7} '
+              f'{seeded / result["duration"] if result["duration"] else 0:>9.1f}')
+    print(f'{len(events)} event(s) on {len(nodes)} node(s) in {time.perf_counter() - start:.1f}s')
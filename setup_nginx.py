@@ -2,11 +2,71 @@
 # -*- coding: utf-8 -*-
 
 from pathlib import Path
-from generic_config import internal_network_name, cert_name
+from generic_config import (internal_network_name, cert_name, nginx_performance_profile, nginx_static_cache_size,
+                            central_distribution, central_node_name, hostname_suffix, central_feed_location)
 import yaml
 
 docker_compose_file = Path('nginx-proxy/docker-compose.yml')
 
+# http context, in conf.d: only what can't be set per server. nginx.conf of the image and the default.conf generated by
+# nginx-proxy already set keepalive_timeout and gzip_types there, a second one is a duplicate directive.
+performance_conf = f'''# Generated by setup_nginx.py (nginx_performance_profile in generic_config.py)
+proxy_cache_path /var/cache/nginx/misp levels=1:2 keys_zone=misp_static:20m max_size={nginx_static_cache_size} inactive=7d use_temp_path=off;
+# Only the static files are cached
+map $uri $misp_no_cache {{
+    default 1;
+    ~*\\.(css|js|png|jpe?g|gif|svg|ico|woff2?|ttf|eot)$ 0;
+}}
+'''
+
+# Server context of every vhost without its own vhost.d/<host> (the ones with their own file include it)
+default_server = '''# Generated by setup_nginx.py (nginx_performance_profile in generic_config.py)
+keepalive_timeout 65s;
+keepalive_requests 1000;
+
+gzip on;
+gzip_vary on;
+gzip_proxied any;
+gzip_comp_level 5;
+gzip_min_length 1024;
+gzip_types application/json application/javascript application/xml text/css text/javascript text/plain text/xml image/svg+xml;
+
+client_body_buffer_size 1m;
+proxy_buffering on;
+proxy_buffer_size 16k;
+proxy_buffers 32 16k;
+proxy_busy_buffers_size 64k;
+proxy_connect_timeout 10s;
+proxy_read_timeout 300s;
+proxy_send_timeout 300s;
+'''
+
+# Included in the location / of every vhost without its own vhost.d/<host>_location
+default_location = '''# Generated by setup_nginx.py (nginx_performance_profile in generic_config.py)
+proxy_cache misp_static;
+proxy_cache_key $scheme$host$request_uri;
+proxy_cache_bypass $misp_no_cache;
+proxy_no_cache $misp_no_cache;
+proxy_cache_valid 200 301 302 1h;
+proxy_cache_use_stale error timeout updating;
+proxy_cache_lock on;
+'''
+
+# Server context of the central node: its feed (central_distribution = 'feed') is served from disk
+feed_vhost = f'''# Generated by setup_nginx.py (central_distribution in generic_config.py)
+location {central_feed_location} {{
+    alias /usr/share/nginx/central-feed/;
+    default_type application/json;
+    gzip on;
+    gzip_types application/json text/csv;
+    # The nodes revalidate with the ETag: the unchanged files are a 304
+    etag on;
+    add_header Cache-Control "no-cache";
+    open_file_cache max=10000 inactive=60s;
+    open_file_cache_valid 10s;
+}}
+'''
+
 with docker_compose_file.open() as f:
     a = f.read()
     docker_content = yaml.safe_load(a)
@@ -27,6 +87,36 @@ if Path('nginx.tmpl').exists() and '../nginx.tmpl:/app/nginx.tmpl' not in docker
 if Path('nginx-local.conf').exists() and '../nginx-local.conf:/etc/nginx/conf.d/nginx-local.conf:ro' not in docker_content['services']['nginx-proxy']['volumes']:
     docker_content['services']['nginx-proxy']['volumes'].append('../nginx-local.conf:/etc/nginx/conf.d/nginx-local.conf:ro')
 
+if nginx_performance_profile:
+    Path('nginx-performance.conf').write_text(performance_conf)
+    Path('nginx-vhost.d').mkdir(exist_ok=True)
+    Path('nginx-vhost.d/default').write_text(default_server)
+    Path('nginx-vhost.d/default_location').write_text(default_location)
+    for volume in ['../nginx-performance.conf:/etc/nginx/conf.d/nginx-performance.conf:ro', '../nginx-vhost.d:/etc/nginx/vhost.d:ro']:
+        if volume not in docker_content['services']['nginx-proxy']['volumes']:
+            docker_content['services']['nginx-proxy']['volumes'].append(volume)
+    if not docker_content['services']['nginx-proxy'].get('environment'):
+        docker_content['services']['nginx-proxy']['environment'] = []
+    if 'ENABLE_HTTP2=true' not in docker_content['services']['nginx-proxy']['environment']:
+        docker_content['services']['nginx-proxy']['environment'].append('ENABLE_HTTP2=true')
+
+if central_distribution == 'feed':
+    central_hostname = f'{central_node_name}{hostname_suffix}'
+    Path('misps/central_feed').mkdir(parents=True, exist_ok=True)
+    Path('nginx-vhost.d').mkdir(exist_ok=True)
+    # Replaces vhost.d/default for the central node
+    include_default = 'include /etc/nginx/vhost.d/default;\n' if nginx_performance_profile else ''
+    Path(f'nginx-vhost.d/{central_hostname}').write_text(feed_vhost + include_default)
+    for volume in ['../misps/central_feed:/usr/share/nginx/central-feed:ro', '../nginx-vhost.d:/etc/nginx/vhost.d:ro']:
+        if volume not in docker_content['services']['nginx-proxy']['volumes']:
+            docker_content['services']['nginx-proxy']['volumes'].append(volume)
+    # The client nodes reach the central node through the proxy (and its feed) on the internal network
+    networks = docker_content['services']['nginx-proxy']['networks']
+    if isinstance(networks, list):
+        networks = {name: {} for name in networks}
+    networks['misp-test-sync'] = {'aliases': [central_hostname]}
+    docker_content['services']['nginx-proxy']['networks'] = networks
+
 if cert_name:
     if not docker_content['services']['nginx-proxy'].get('environment'):
         docker_content['services']['nginx-proxy']['environment'] = []
@@ -1,13 +1,17 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import argparse
+
 from misp_instances import MISPInstances
+from tracing import tracer
 
 
 if __name__ == '__main__':
-    instances = MISPInstances()
-    instances.setup_instances()
-    # Mesh sync
-    # instances.setup_sync_all()
-    # Central only sync
-    instances.setup_sync_central_only()
+    parser = argparse.ArgumentParser(description='Setup the instances and the sync between them.')
+    parser.add_argument('--trace', help='Write a Chrome/Perfetto trace of the docker and PyMISP calls in this file')
+    args = parser.parse_args()
+    if args.trace:
+        tracer.enable(args.trace)
+
+    MISPInstances().setup_sync()
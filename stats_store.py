@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+
+class StatsStore():
+    '''Append-only store of statistics samples, one compact JSON line per (time, node, context):
+
+        {"ts": 1700000000.0, "node": "Node 01", "context": "data", "data": {...}}
+    '''
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def append(self, samples: list[dict[str, Any]]):
+        if not samples:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        lines = ''.join(json.dumps(sample, separators=(',', ':')) + '\n' for sample in samples)
+        # One write per collection pass, so concurrent readers never see half a pass.
+        with self.path.open('a') as f:
+            f.write(lines)
+
+    def samples(self, node: Optional[str]=None, context: Optional[str]=None,
+                since: Optional[float]=None) -> Iterator[dict[str, Any]]:
+        if not self.path.exists():
+            return
+        with self.path.open() as f:
+            for line in f:
+                try:
+                    sample = json.loads(line)
+                except json.JSONDecodeError:
+                    # Interrupted write
+                    continue
+                if node and sample['node'] != node:
+                    continue
+                if context and sample['context'] != context:
+                    continue
+                if since and sample['ts'] < since:
+                    continue
+                yield sample
+
+    def trend(self, key: str, context: str='data', node: Optional[str]=None,
+              since: Optional[float]=None) -> dict[str, list[tuple[float, Any]]]:
+        '''Values of a key over time, per node. The key is a dotted path in the data (ex. stats.event_count)'''
+        to_return: dict[str, list[tuple[float, Any]]] = {}
+        for sample in self.samples(node, context, since):
+            value = sample['data']
+            for part in key.split('.'):
+                if not isinstance(value, dict) or part not in value:
+                    value = None
+                    break
+                value = value[part]
+            if value is not None:
+                to_return.setdefault(sample['node'], []).append((sample['ts'], value))
+        return to_return
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Status of all the instances in one pass: containers, API, version, workers, sync servers and events.
+Read only: nothing is changed on the nodes, and a node that is down doesn't block the others
+(plain HTTP requests with a short timeout, see api_helpers, not MISPInstance that waits for the node to be up).'''
+
+import argparse
+import json
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+from api_helpers import NodeStatus
+from config_helpers import config_files
+from docker_helpers import compose_containers
+from generic_config import max_concurrent_nodes
+
+
+def containers_state(services: dict[str, str]) -> str:
+    if not services:
+        return 'no container'
+    running = [s for s, state in services.items() if state == 'running']
+    stopped = sorted(f'{s}:{state}' for s, state in services.items() if state != 'running')
+    return f'{len(running)}/{len(services)} running' + (f' ({" ".join(stopped)})' if stopped else '')
+
+
+def status(misp_instances_dir: Path, timeout: float, test_connections: bool=False) -> list[dict[str, Any]]:
+    configs = []
+    # config_files always lists the central node, even before it is initialized
+    for config_file in [f for f in config_files(misp_instances_dir) if f.exists()]:
+        with config_file.open() as f:
+            configs.append((config_file.parent.name, json.load(f)))
+    with ThreadPoolExecutor(max_workers=min(max_concurrent_nodes, len(configs)) + 1) as executor:
+        # One docker query for all the nodes, while the APIs are queried
+        containers = executor.submit(compose_containers)
+        results = list(executor.map(lambda c: NodeStatus(c[1], timeout, test_connections).run(), configs))
+        try:
+            per_project = containers.result()
+        except Exception as e:
+            print(f'Unable to get the containers: {e}')
+            per_project = {}
+    for (project, _), result in zip(configs, results):
+        result['containers'] = containers_state(per_project.get(project, {}))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Status of all the instances, without changing anything.', epilog=__doc__)
+    parser.add_argument('--root', default='misps', help='Directory with the config files of the instances')
+    parser.add_argument('--timeout', type=float, default=2, help='Timeout of each API call, in seconds')
+    parser.add_argument('--test_connections', action='store_true', help='Test the connection of each sync server (one call per server)')
+    parser.add_argument('--json', action='store_true', help='Print the status as JSON')
+    args = parser.parse_args()
+
+    start = time.time()
+    results = status(Path(__file__).resolve().parent / args.root, args.timeout, args.test_connections)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        columns = [('node', 'Node', 20), ('containers', 'Containers', 24), ('api', 'API', 16), ('latency', 'ms', 6),
+                   ('version', 'Version', 8), ('workers', 'Workers', 22), ('sync', 'Sync', 12), ('events', 'Events', 6)]
+        print(' '.join(f'{title:<{width}}' for _, title, width in columns))
+        for result in results:
+            values = {k: result.get(k, '') for k, _, _ in columns}
+            if 'latency' in result:
+                values['latency'] = f'{result["latency"] * 1000:.0f}'
+            print(' '.join(f'{values[k]!s:<{width}}' for k, _, width in columns))
+        print(f'{len([r for r in results if r["api"] == "up"])}/{len(results)} node(s) up, in {time.time() - start:.1f}s')
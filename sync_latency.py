@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import math
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from pymisp import MISPEvent
+
+from misp_instances import MISPInstances, MISPInstance
+from generic_config import tag_nodes_to_central, tag_central_to_nodes
+
+
+def percentile(values: list[float], pct: float) -> float:
+    '''Nearest-rank percentile'''
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def create_canary(node: MISPInstance, tagname: str) -> tuple[str, float]:
+    event = MISPEvent()
+    event.info = f'Sync latency canary ({datetime.now().isoformat()})'
+    event.distribution = 2  # Connected communities
+    event.add_attribute('text', f'Canary from {node.owner_orgname}')
+    event.add_tag(tagname)
+    event = node.owner_site_admin.add_event(event)  # type: ignore
+    node.owner_site_admin.publish(event)
+    return event.uuid, time.time()  # type: ignore
+
+
+def wait_for_canaries(target: MISPInstance, canaries: dict[str, float], timeout: int, interval: float) -> dict[str, float]:
+    '''Poll the target until all the canaries are there, returns the latency of each of them'''
+    latencies: dict[str, float] = {}
+    pending = set(canaries)
+    deadline = time.time() + timeout
+    while pending and time.time() < deadline:
+        for event in target.owner_site_admin.search(metadata=True, uuid=list(pending)):  # type: ignore
+            if event.uuid in pending:  # type: ignore
+                latencies[event.uuid] = time.time() - canaries[event.uuid]  # type: ignore
+                pending.discard(event.uuid)  # type: ignore
+        if pending:
+            time.sleep(interval)
+    return latencies
+
+
+def trigger(node: MISPInstance, mode: str, from_central_node: bool):
+    if mode == 'full':
+        node.sync_push_all()
+    elif mode == 'changed':
+        node.sync_push_changed(from_central_node)
+    # mode == 'wait': rely on the push MISP triggers on publish
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the time it takes for an event to be synchronized between the nodes.')
+    parser.add_argument('--sources', nargs='+', help='Name of the admin org of the nodes creating canaries (default: all the nodes, including the central node)')
+    parser.add_argument('--samples', type=int, default=5, help='Number of canaries per source node')
+    parser.add_argument('--mode', choices=['full', 'changed', 'wait'], default='changed',
+                        help='full: sync_push_all, changed: sync_push_changed, wait: do not trigger, wait for the push on publish')
+    parser.add_argument('--timeout', type=int, default=300, help='Give up on a canary after that many seconds')
+    parser.add_argument('--interval', type=float, default=0.5, help='Polling interval on the targets')
+    parser.add_argument('--keep', default=False, action='store_true', help='Do not delete the canaries')
+    args = parser.parse_args()
+
+    instances = MISPInstances()
+    nodes = {instances.central_node.owner_orgname: instances.central_node, **instances.client_nodes}
+    sources = args.sources if args.sources else list(nodes.keys())
+    for name in sources:
+        if name not in nodes:
+            raise Exception(f'Available instances: {list(nodes.keys())}')
+
+    # Star topology: the clients push to the central node, the central node pushes to all the clients
+    edges: dict[str, list[MISPInstance]] = {}
+    for name in sources:
+        if nodes[name] == instances.central_node:
+            edges[name] = list(instances.client_nodes.values())
+        else:
+            edges[name] = [instances.central_node]
+    if not any(edges.values()):
+        # Ex. the central node alone, without client nodes
+        raise Exception(f'No node receives the canaries of {", ".join(sources)}')
+
+    latencies: dict[tuple[str, str], list[float]] = {}
+    lost: dict[tuple[str, str], int] = {}
+    created: dict[str, list[str]] = {}
+    try:
+        for sample in range(args.samples):
+            # canary uuid -> publish time, per target
+            expected: dict[str, dict[str, float]] = {}
+            sources_by_uuid: dict[str, str] = {}
+            for name in sources:
+                node = nodes[name]
+                tagname = tag_central_to_nodes[0] if node == instances.central_node else tag_nodes_to_central[0]
+                uuid, published = create_canary(node, tagname)
+                created.setdefault(name, []).append(uuid)
+                sources_by_uuid[uuid] = name
+                for receiver in edges[name]:
+                    expected.setdefault(receiver.owner_orgname, {})[uuid] = published
+            for name in sources:
+                trigger(nodes[name], args.mode, nodes[name] == instances.central_node)
+
+            with ThreadPoolExecutor(max_workers=len(expected)) as executor:
+                futures = {target: executor.submit(wait_for_canaries, nodes[target], canaries, args.timeout, args.interval)
+                           for target, canaries in expected.items()}
+            for target, future in futures.items():
+                found = future.result()
+                for uuid in expected[target]:
+                    edge = (sources_by_uuid[uuid], target)
+                    if uuid in found:
+                        latencies.setdefault(edge, []).append(found[uuid])
+                    else:
+                        lost[edge] = lost.get(edge, 0) + 1
+            print(f'Sample {sample + 1}/{args.samples} done.')
+    finally:
+        if not args.keep:
+            for name, uuids in created.items():
+                for node in [nodes[name]] + edges[name]:
+                    for uuid in uuids:
+                        node.owner_site_admin.delete_event(uuid)
+
+    print(f'{"Edge":<50} {"n":>4} {"lost":>5} {"p50 (s)":>8} {"p95 (s)":>8} {"max (s)":>8}')
+    all_latencies: list[float] = []
+    for edge in sorted(set(latencies) | set(lost)):
+        values = latencies.get(edge, [])
+        all_latencies += values
+        label = f'{edge[0]} -> {edge[1]}'
+        if values:
+            print(f'{label:<50} {len(values):>4} {lost.get(edge, 0):>5} {percentile(values, 50):>8.2f} {percentile(values, 95):>8.2f} {max(values):>8.2f}')
+        else:
+            print(f'{label:<50} {0:>4} {lost.get(edge, 0):>5} {"-":>8} {"-":>8} {"-":>8}')
+    if all_latencies:
+        print(f'{"Overall":<50} {len(all_latencies):>4} {sum(lost.values()):>5} {percentile(all_latencies, 50):>8.2f} {percentile(all_latencies, 95):>8.2f} {max(all_latencies):>8.2f}')
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Timed spans on the hot paths (docker calls, PyMISP calls, retry sleeps).
+
+Disabled by default. Set MISP_TRACE=<trace.json> in the environment (or pass --trace to the
+scripts supporting it) to get a Chrome/Perfetto trace and a summary per operation at exit.'''
+
+import atexit
+import json
+import math
+import os
+import re
+import threading
+import time
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional
+from urllib.parse import urlparse
+
+from pymisp import PyMISP
+
+
+class Tracer():
+
+    def __init__(self):
+        self.enabled = False
+        self.output: Optional[Path] = None
+        self.spans: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def enable(self, output: Optional[str]=None):
+        if self.enabled:
+            return
+        self.enabled = True
+        if output:
+            self.output = Path(output)
+        atexit.register(self.finish)
+
+    @contextmanager
+    def span(self, category: str, operation: str, node: str='') -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.spans.append({'category': category, 'operation': operation, 'node': node,
+                                   'start': start - self._origin, 'duration': end - start,
+                                   'thread': threading.get_ident()})
+
+    def sleep(self, seconds: float, node: str=''):
+        with self.span('sleep', 'retry sleep', node):
+            time.sleep(seconds)
+
+    def chrome_trace(self) -> dict[str, Any]:
+        '''Trace Event Format, one process per node, one thread per python thread'''
+        nodes = sorted({s['node'] for s in self.spans})
+        pids = {node: i + 1 for i, node in enumerate(nodes)}
+        events: list[dict[str, Any]] = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': node if node else 'local'}}
+                                        for node, pid in pids.items()]
+        for s in self.spans:
+            events.append({'name': s['operation'], 'cat': s['category'], 'ph': 'X', 'pid': pids[s['node']],
+                           'tid': s['thread'], 'ts': round(s['start'] * 1e6), 'dur': round(s['duration'] * 1e6),
+                           'args': {'node': s['node']}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def summary(self) -> str:
+        operations: dict[tuple[str, str], list[float]] = {}
+        for s in self.spans:
+            operations.setdefault((s['category'], s['operation']), []).append(s['duration'])
+        lines = [f'{"Category":<10} {"Operation":<60} {"count":>7} {"total (s)":>10} {"p95 (s)":>9}']
+        for (category, operation), durations in sorted(operations.items(), key=lambda o: sum(o[1]), reverse=True):
+            durations.sort()
+            p95 = durations[max(math.ceil(0.95 * len(durations)), 1) - 1]
+            lines.append(f'{category:<10} {operation[:60]:<60} {len(durations):>7} {sum(durations):>10.2f} {p95:>9.3f}')
+        return '\n'.join(lines)
+
+    def finish(self):
+        if not self.spans:
+            return
+        print(self.summary())
+        if self.output:
+            with self.output.open('w') as f:
+                json.dump(self.chrome_trace(), f)
+            print(f'Trace written in {self.output}, open it in https://ui.perfetto.dev or chrome://tracing')
+
+
+tracer = Tracer()
+if os.environ.get('MISP_TRACE'):
+    tracer.enable(os.environ['MISP_TRACE'])
+
+
+def command_name(command: list[str]) -> str:
+    '''"sudo docker compose ps -q misp-core" -> "docker compose ps"'''
+    command = [part for part in command if part != 'sudo']
+    if len(command) > 1 and command[1] == 'compose':
+        return ' '.join(command[:3])
+    return ' '.join(command[:2])
+
+
+class TracedPyMISP(PyMISP):
+    '''PyMISP, with a span around each HTTP request'''
+
+    def __init__(self, *args, node: str='', **kwargs):
+        self.node = node
+        super().__init__(*args, **kwargs)
+
+    def _prepare_request(self, request_type: str, url: str, *args, **kwargs):  # type: ignore[override]
+        if not tracer.enabled:
+            return super()._prepare_request(request_type, url, *args, **kwargs)
+        path = urlparse(url).path if url.startswith('http') else url
+        # Group the calls on the different objects
+        path = re.sub(r'/(\d+|[0-9a-f]{8}-[0-9a-f-]{27})(?=/|$)', '/<id>', '/' + path.lstrip('/'))
+        with tracer.span('pymisp', f'{request_type} {path}', self.node if self.node else urlparse(self.root_url).netloc):
+            return super()._prepare_request(request_type, url, *args, **kwargs)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import argparse
 import logging
 import os
 
@@ -55,9 +56,17 @@ def is_locked(lock_file: Path, /, *, expire_in_min: int=30) -> bool:
     return True
 
 
+parser = argparse.ArgumentParser(description='Push the sync-tagged events to the sync servers.')
+parser.add_argument('--changed_only', default=False, action='store_true',
+                    help='Only push the events published since the last run, instead of a full push.')
+args = parser.parse_args()
+
 if not is_locked(lock_file) and try_make_file(lock_file):
     with lock_file.open('w') as f:
         f.write(f"{datetime.now().isoformat()};{os.getpid()}")
 
     instances = MISPInstances()
-    instances.sync_push_all()
+    if args.changed_only:
+        instances.sync_push_changed()
+    else:
+        instances.sync_push_all()